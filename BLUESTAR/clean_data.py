@@ -1,9 +1,6 @@
-from datetime import timedelta
 import duckdb
-import pandas as pd
 import time
 from pathlib import Path
-import re
 
 # ==================================================
 # CONFIG
@@ -22,11 +19,10 @@ SOURCE_TABLE = "BLUESTAR"
 TARGET_TABLE = "BLUESTAR_TARGET"
 
 FLTNO_REGEX = r"^([A-Z]{2,3}|\d[A-Z])0+([1-9][0-9]*)$"
+STRIP_WS = r"[\s\v\pZ\x1c-\x1f\x85]*"  # what str.strip() removes, as RE2
 
 MAX_FLTNO_DIGITS = 8
 
-BATCH_SIZE = 100_000
-
 ROUTE_MAX_DAYS = 1
 
 VALID_YEAR_MIN = 2010
@@ -89,14 +85,20 @@ def create_target_table(con):
             Airport2 VARCHAR,
             Airport3 VARCHAR,
             Airport4 VARCHAR,
-            Airport5 VARCHAR,
+            Airport5 VARCHAR
+        )
+    """)
 
-            CONSTRAINT uq_bluestar UNIQUE (
-                PNRNo, AirlineName, TicketNo,
-                FltNo1, FltNo2, FltNo3, FltNo4,
-                FltDate1, FltDate2, FltDate3, FltDate4,
-                Airport1, Airport2, Airport3, Airport4, Airport5
-            )
+
+def create_unique_index(con):
+    # Built after the bulk load: one sorted pass instead of an ART probe per row
+    log("🔑 Creating unique index")
+    con.execute(f"""
+        CREATE UNIQUE INDEX uq_bluestar ON {TARGET_TABLE} (
+            PNRNo, AirlineName, TicketNo,
+            FltNo1, FltNo2, FltNo3, FltNo4,
+            FltDate1, FltDate2, FltDate3, FltDate4,
+            Airport1, Airport2, Airport3, Airport4, Airport5
         )
     """)
 
@@ -106,44 +108,44 @@ def get_total_rows(con) -> int:
 
 
 def create_clean_view(con):
-    log("🧹 Creating cleaned source view")
+    log("🧹 Creating cleaned source table")
 
     # Note: We use {{ }} for regex groups inside the python f-string
     # We use \\1\\2 for backreferences in the replacement string
     con.execute(f"""
-        CREATE OR REPLACE TEMP VIEW cleaned_source AS
+        CREATE OR REPLACE TEMP TABLE cleaned_source AS
+        WITH pre AS (
+            SELECT
+                *,
+                replace(trim(upper(FltNo1)), ' ', '') AS norm_fn1,
+                replace(trim(upper(FltNo2)), ' ', '') AS norm_fn2,
+                replace(trim(upper(FltNo3)), ' ', '') AS norm_fn3,
+                replace(trim(upper(FltNo4)), ' ', '') AS norm_fn4,
+
+                TRY_CAST(FltDate1 AS TIMESTAMP) AS DT1,
+                TRY_CAST(FltDate2 AS TIMESTAMP) AS DT2,
+                TRY_CAST(FltDate3 AS TIMESTAMP) AS DT3,
+                TRY_CAST(FltDate4 AS TIMESTAMP) AS DT4
+            FROM {SOURCE_TABLE}
+        )
         SELECT
+            row_number() OVER () AS rn,
+
             BillDate,
             PaxName,
             PNRNo,
             AirlineName,
             TicketNo,
             
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo1)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN1,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo2)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN2,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo3)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN3,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo4)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN4,
-
-            TRY_CAST(FltDate1 AS TIMESTAMP) AS DT1,
-            TRY_CAST(FltDate2 AS TIMESTAMP) AS DT2,
-            TRY_CAST(FltDate3 AS TIMESTAMP) AS DT3,
-            TRY_CAST(FltDate4 AS TIMESTAMP) AS DT4,
+            NULLIF(regexp_replace(norm_fn1, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN1,
+            NULLIF(regexp_replace(norm_fn2, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN2,
+            NULLIF(regexp_replace(norm_fn3, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN3,
+            NULLIF(regexp_replace(norm_fn4, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN4,
+
+            DT1,
+            DT2,
+            DT3,
+            DT4,
 
             SupplierName,
             PaxType,
@@ -153,185 +155,192 @@ def create_clean_view(con):
             Airport3 AS AP3,
             Airport4 AS AP4,
             Airport5 AS AP5
-        FROM {SOURCE_TABLE}
+        FROM pre
         WHERE
-            (TRY_CAST(FltDate1 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate2 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate3 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate4 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
+            year(DT1) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT2) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT3) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT4) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
     """)
 
 
-def is_same_route(d1, d2):
-    # Check for NaT (Not a Time) before calculation
-    if pd.isna(d1) or pd.isna(d2):
-        return False
-    return abs(d2 - d1) <= timedelta(days=ROUTE_MAX_DAYS)
-
-
-def is_valid_flightno(fn: str, dt: str) -> bool:
-    if pd.isna(fn) or pd.isna(dt):
-        return False
-
-    fn = str(fn).strip()
-
-    # ❌ Ignore empty strings
-    if not fn:
-        return False
-
-    # ❌ Corrupted huge numeric value → drop whole row
-    if fn.isdigit():
-        return False
-    if len(fn) > MAX_FLTNO_DIGITS:
-        return False
-    # ❌ Remove TK000, TK0000, 0000, etc. (Numeric part all zeros)
-    stripped = fn.rstrip("0")
+def create_macros(con):
+    log("🧩 Creating macros")
 
-    # If string is empty (e.g., "0000") -> Drop
-    # If string is all alpha (e.g., "TK") -> Drop
-    if not stripped or stripped.isalpha():
-        return False
-
-    fn = fn.strip().upper()
-    # ❌ Reject invalid short flight numbers (G8, 6P, I5, etc.)
-    # Valid format: 2-3 letters + at least 1 digit (minimum length 3)
-    if not re.fullmatch(r"[A-Z0-9]{2,3}\d+", fn):
-        return False
-    return True
-
-
-# ==================================================
-# DEDUPLICATE EXACT FLIGHT SEGMENTS
-# ==================================================
-def deduplicate_flights(flights):
-    # Sort flights by Date ONLY (x[1]).
-    flights.sort(key=lambda x: x[1])
-    seen_segments = set()
-    unique_flights = []
-
-    for fn, dt, dep_ap, arr_ap in flights:
-        # Deduplicate by FlightNo + FlightDate (date-level)
-        key = (fn, dt.date())
-
-        if key not in seen_segments:
-            seen_segments.add(key)
-            unique_flights.append((fn, dt, dep_ap, arr_ap))
+    # Full match, ignoring surrounding whitespace
+    con.execute(f"""
+        CREATE OR REPLACE TEMP MACRO fullmatch_stripped(s, pattern) AS (
+            regexp_full_match(s, '{STRIP_WS}(?:' || pattern || '){STRIP_WS}')
+        )
+    """)
 
-    return unique_flights
+    # Same rules as the old is_valid_flightno(); \p{Nd} is Python's \d
+    con.execute(f"""
+        CREATE OR REPLACE TEMP MACRO is_valid_flightno(fn) AS (
+            -- ❌ Short flight numbers (G8, 6P, I5, etc.)
+            fullmatch_stripped(fn, '[A-Z0-9]{{2,3}}\\p{{Nd}}+')
+            AND fullmatch_stripped(fn, '[A-Z0-9\\p{{Nd}}]{{3,{MAX_FLTNO_DIGITS}}}')
+            -- ❌ Corrupted huge numeric value, TK000 (numeric part all zeros)
+            AND NOT fullmatch_stripped(fn, '\\p{{Nd}}+|[A-Z]+0+')
+        )
+    """)
 
 
 # ==================================================
-# GROUP FLIGHTS INTO ROUTES (MAX 1-DAY SPAN)
+# ROUTE RECONSTRUCTION (SQL)
 # ==================================================
-def group_into_routes(flights):
-    routes = []
-
-    current = [flights[0]]
-    route_start_date = flights[0][1]
-
-    for f in flights[1:]:
-        if is_same_route(f[1], route_start_date):
-            current.append(f)
-        else:
-            routes.append(current)
-            current = [f]
-            route_start_date = f[1]
-
-    # IMPORTANT: append the last route
-    routes.append(current)
-
-    return routes
-
-
-def insert_target_table(con, out_rows):
-    df_out = pd.DataFrame(out_rows, dtype="object")
-    df_out.replace("", None, inplace=True)
-
-    unique_indices = [2, 3, 4] + list(range(5, 13)) + list(range(15, 20))
-
-    initial_rows = len(df_out)
-    df_out = df_out.drop_duplicates(subset=unique_indices)
-    dropped_rows = initial_rows - len(df_out)
-
-    if dropped_rows > 0:
-        log(f"🗑️  Dropped {dropped_rows} duplicate rows within batch")
-
-    con.execute(f"INSERT OR IGNORE INTO {TARGET_TABLE} SELECT * FROM df_out")
-
-
-def process_batch(con, offset):
-    df = con.execute(f"""
-        SELECT *
-        FROM cleaned_source
-        LIMIT {BATCH_SIZE} OFFSET {offset}
-    """).df()
-
-    if df.empty:
-        return 0
-
-    out_rows = []
-    base_data1 = df[
-        [
-            "BillDate",
-            "PaxName",
-            "PNRNo",
-            "AirlineName",
-            "TicketNo",
-        ]
-    ].values
-    base_data2 = df[
-        [
-            "SupplierName",
-            "PaxType",
-        ]
-    ].values
-
-    for idx, row in enumerate(df.itertuples(index=False)):
-        flights = []
-
-        for i in range(1, 5):
-            fn = getattr(row, f"FN{i}")
-            dt = getattr(row, f"DT{i}")
-
-            if not is_valid_flightno(fn, dt):
-                continue
-
-            depAp = getattr(row, f"AP{i}")
-            arrAp = getattr(row, f"AP{i + 1}")
-
-            flights.append((fn, dt, depAp, arrAp))
-
-        # ❌ No valid (FltNo + FltDate) pairs → skip row
-        if not flights:
-            continue
-
-        flights = deduplicate_flights(flights)
-
-        routes = group_into_routes(flights)
-
-        # Build output rows
-        for route in routes:
-            base1 = list(base_data1[idx])
-            base2 = list(base_data2[idx])
-            fn_out = [None] * 4
-            dt_out = [None] * 4
-            ap_out = [None] * 5
-
-            for i, (fn, dt, dep_ap, arr_ap) in enumerate(route[:4]):
-                fn_out[i] = fn
-                dt_out[i] = dt
-                ap_out[i] = dep_ap
-                if i + 1 < len(ap_out):
-                    ap_out[i + 1] = arr_ap
-
-            out_rows.append(base1 + fn_out + dt_out + base2 + ap_out)
-
-    if not out_rows:
-        return 0
-
-    insert_target_table(con, out_rows)
+def insert_routes(con) -> int:
+    log("🧭 Building routes")
+
+    # legs        : unpivot FN/DT/AP slots into one row per flight segment
+    # valid_legs  : dated legs passing the is_valid_flightno() macro
+    # unique_legs : dedup by FlightNo + FlightDate (date-level), first by date
+    # routed      : recursive walk over the (max 4) sorted legs of a row,
+    #               a leg joins the route while within ROUTE_MAX_DAYS of its start
+    # routes      : pivot legs back to FltNo1-4 / FltDate1-4 / Airport1-5
+    # The final QUALIFY keeps one row per uq_bluestar key, so no OR IGNORE.
+    # NULL key parts compare equal there, as in the old per-batch
+    # drop_duplicates(). Across batches the old OR IGNORE kept such rows (the
+    # index treats NULLs as distinct), so the old output depended on BATCH_SIZE
+    result = con.execute(f"""
+        INSERT INTO {TARGET_TABLE}
+        WITH RECURSIVE src AS (
+            SELECT rn AS row_id, *
+            FROM cleaned_source
+        ),
+        legs AS (
+            SELECT row_id, 1 AS slot, FN1 AS fn, DT1 AS dt, NULLIF(AP1, '') AS dep_ap, NULLIF(AP2, '') AS arr_ap FROM src
+            UNION ALL
+            SELECT row_id, 2, FN2, DT2, NULLIF(AP2, ''), NULLIF(AP3, '') FROM src
+            UNION ALL
+            SELECT row_id, 3, FN3, DT3, NULLIF(AP3, ''), NULLIF(AP4, '') FROM src
+            UNION ALL
+            SELECT row_id, 4, FN4, DT4, NULLIF(AP4, ''), NULLIF(AP5, '') FROM src
+        ),
+        valid_legs AS (
+            SELECT *
+            FROM legs
+            WHERE dt IS NOT NULL
+              AND is_valid_flightno(fn)
+        ),
+        unique_legs AS (
+            SELECT *
+            FROM valid_legs
+            QUALIFY row_number() OVER (
+                PARTITION BY row_id, fn, CAST(dt AS DATE)
+                ORDER BY dt, slot
+            ) = 1
+        ),
+        ordered_legs AS (
+            SELECT
+                *,
+                row_number() OVER (PARTITION BY row_id ORDER BY dt, slot) AS seq
+            FROM unique_legs
+        ),
+        routed AS (
+            SELECT row_id, seq, dt AS route_start, 0 AS route_id
+            FROM ordered_legs
+            WHERE seq = 1
+
+            UNION ALL
+
+            SELECT
+                l.row_id,
+                l.seq,
+                CASE
+                    WHEN l.dt - r.route_start <= INTERVAL {ROUTE_MAX_DAYS} DAY
+                        THEN r.route_start
+                    ELSE l.dt
+                END,
+                CASE
+                    WHEN l.dt - r.route_start <= INTERVAL {ROUTE_MAX_DAYS} DAY
+                        THEN r.route_id
+                    ELSE r.route_id + 1
+                END
+            FROM routed r
+            JOIN ordered_legs l
+              ON l.row_id = r.row_id
+             AND l.seq = r.seq + 1
+        ),
+        route_legs AS (
+            SELECT
+                l.*,
+                r.route_id,
+                row_number() OVER (PARTITION BY l.row_id, r.route_id ORDER BY l.seq) AS pos,
+                count(*) OVER (PARTITION BY l.row_id, r.route_id) AS n_legs
+            FROM ordered_legs l
+            JOIN routed r USING (row_id, seq)
+        ),
+        routes AS (
+            SELECT
+                row_id,
+                route_id,
+                max(n_legs) AS n_legs,
+
+                max(CASE WHEN pos = 1 THEN fn END) AS FltNo1,
+                max(CASE WHEN pos = 2 THEN fn END) AS FltNo2,
+                max(CASE WHEN pos = 3 THEN fn END) AS FltNo3,
+                max(CASE WHEN pos = 4 THEN fn END) AS FltNo4,
+
+                max(CASE WHEN pos = 1 THEN dt END) AS FltDate1,
+                max(CASE WHEN pos = 2 THEN dt END) AS FltDate2,
+                max(CASE WHEN pos = 3 THEN dt END) AS FltDate3,
+                max(CASE WHEN pos = 4 THEN dt END) AS FltDate4,
+
+                max(CASE WHEN pos = 1 THEN dep_ap END) AS dep1,
+                max(CASE WHEN pos = 2 THEN dep_ap END) AS dep2,
+                max(CASE WHEN pos = 3 THEN dep_ap END) AS dep3,
+                max(CASE WHEN pos = 4 THEN dep_ap END) AS dep4,
+                max(CASE WHEN pos = n_legs THEN arr_ap END) AS last_arr
+            FROM route_legs
+            GROUP BY row_id, route_id
+        ),
+        output_rows AS (
+            SELECT
+                r.row_id,
+                r.route_id,
+
+                s.BillDate,
+                NULLIF(s.PaxName, '') AS PaxName,
+                NULLIF(s.PNRNo, '') AS PNRNo,
+                NULLIF(s.AirlineName, '') AS AirlineName,
+                NULLIF(s.TicketNo, '') AS TicketNo,
+
+                r.FltNo1,
+                r.FltNo2,
+                r.FltNo3,
+                r.FltNo4,
+
+                r.FltDate1,
+                r.FltDate2,
+                r.FltDate3,
+                r.FltDate4,
+
+                NULLIF(s.SupplierName, '') AS SupplierName,
+                NULLIF(s.PaxType, '') AS PaxType,
+
+                -- Departure of each leg, then arrival of the last leg
+                r.dep1 AS Airport1,
+                CASE WHEN r.n_legs >= 2 THEN r.dep2 WHEN r.n_legs = 1 THEN r.last_arr END AS Airport2,
+                CASE WHEN r.n_legs >= 3 THEN r.dep3 WHEN r.n_legs = 2 THEN r.last_arr END AS Airport3,
+                CASE WHEN r.n_legs >= 4 THEN r.dep4 WHEN r.n_legs = 3 THEN r.last_arr END AS Airport4,
+                CASE WHEN r.n_legs = 4 THEN r.last_arr END AS Airport5
+            FROM routes r
+            JOIN src s USING (row_id)
+        )
+        SELECT * EXCLUDE (row_id, route_id)
+        FROM output_rows
+        QUALIFY row_number() OVER (
+            PARTITION BY
+                PNRNo, AirlineName, TicketNo,
+                FltNo1, FltNo2, FltNo3, FltNo4,
+                FltDate1, FltDate2, FltDate3, FltDate4,
+                Airport1, Airport2, Airport3, Airport4, Airport5
+            ORDER BY row_id, route_id
+        ) = 1
+    """).fetchone()
 
-    return len(out_rows)
+    return result[0] if result else 0
 
 
 # ==================================================
@@ -344,29 +353,14 @@ def main():
     con = connect_db()
     create_target_table(con)
     create_clean_view(con)
+    create_macros(con)
 
     result = con.execute("SELECT COUNT(*) FROM cleaned_source").fetchone()
     total = result[0] if result else 0
     log(f"📊 Cleaned rows: {total:,}")
 
-    offset = 0
-    batch = 0
-    processed = 0
-
-    while offset < total:
-        batch += 1
-        batch_start = time.time()
-        log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total):,}")
-
-        rows_processed = process_batch(con, offset)
-        processed += rows_processed
-        offset += BATCH_SIZE
-
-        batch_time = time.time() - batch_start
-        progress = (offset / total) * 100
-        eta = (batch_time * (total - offset) / BATCH_SIZE) / 3600
-
-        log(f"✅ Processed {rows_processed:,} rows | {progress:.1f}% | ETA: {eta:.2f}h")
+    processed = insert_routes(con)
+    create_unique_index(con)
 
     elapsed = time.time() - start
     log(f"📊 Total processed: {processed:,} rows")
@@ -1,6 +1,10 @@
-from datetime import timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import time
 from pathlib import Path
 import re
@@ -17,17 +21,21 @@ TARGET_TABLE = "BLUESTAR_TARGET_2"
 REJECTION_TABLE = "BLUESTAR_REJECTIONS"
 
 FLTNO_REGEX = r"^([A-Z]{2,3}|\d[A-Z])0+([1-9][0-9]*)$"
+FLTNO_FORMAT = re.compile(r"[A-Z0-9]{2,3}\d+")
+STRIP_WS = r"[\s\v\pZ\x1c-\x1f\x85]*"  # what str.strip() removes, as RE2
 
 MAX_FLTNO_DIGITS = 8
 
 BATCH_SIZE = 100_000
 
 ROUTE_MAX_DAYS = 1
+NS_PER_DAY = 86_400_000_000_000
 
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
 
 THREADS = 8
+BUILD_WORKERS = 2
 MEMORY_LIMIT = "8GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 KEY_COLS = [
@@ -40,6 +48,67 @@ KEY_COLS = [
     "Airport2",
 ]
 
+TARGET_SCHEMA = pa.schema(
+    [
+        ("BillDate", pa.timestamp("ns")),
+        ("PaxName", pa.string()),
+        ("PNRNo", pa.string()),
+        ("AirlineName", pa.string()),
+        ("TicketNo", pa.string()),
+        ("FltNo1", pa.string()),
+        ("FltNo2", pa.string()),
+        ("FltNo3", pa.string()),
+        ("FltNo4", pa.string()),
+        ("FltDate1", pa.timestamp("ns")),
+        ("FltDate2", pa.timestamp("ns")),
+        ("FltDate3", pa.timestamp("ns")),
+        ("FltDate4", pa.timestamp("ns")),
+        ("SupplierName", pa.string()),
+        ("PaxType", pa.string()),
+        ("Airport1", pa.string()),
+        ("Airport2", pa.string()),
+        ("Airport3", pa.string()),
+        ("Airport4", pa.string()),
+        ("Airport5", pa.string()),
+    ]
+)
+
+# cleaned_source columns copied as-is, under the same TARGET_SCHEMA names
+BASE_COLS = [
+    "BillDate",
+    "PaxName",
+    "PNRNo",
+    "AirlineName",
+    "TicketNo",
+    "SupplierName",
+    "PaxType",
+]
+
+FN_COLS = ["FN1", "FN2", "FN3", "FN4"]
+DT_COLS = ["DT1", "DT2", "DT3", "DT4"]
+VALID_COLS = ["VALID1", "VALID2", "VALID3", "VALID4"]
+AP_COLS = ["AP1", "AP2", "AP3", "AP4", "AP5"]
+
+# cleaned_source columns in REJECTION_TABLE order
+REJ_BASE_COLS = [
+    "BillDate",
+    "PaxName",
+    "PNRNo",
+    "AirlineName",
+    "TicketNo",
+    "RAW_FN1",
+    "RAW_FN2",
+    "RAW_FN3",
+    "RAW_FN4",
+    "RAW_FD1",
+    "RAW_FD2",
+    "RAW_FD3",
+    "RAW_FD4",
+    "SupplierName",
+    "PaxType",
+    *AP_COLS,
+]
+
 
 # ==================================================
 # REJECTION REASONS
@@ -119,6 +188,24 @@ def create_target_table(con):
     """)
 
 
+def create_staging_table(con):
+    # Created once and emptied after every batch, instead of per-batch DDL
+    con.execute("DROP TABLE IF EXISTS _batch_staging")
+    con.execute(
+        f"CREATE TEMP TABLE _batch_staging AS SELECT * FROM {TARGET_TABLE} WHERE 1=0"
+    )
+    con.execute("ALTER TABLE _batch_staging ADD COLUMN _rej_idx INTEGER")
+    con.execute("ALTER TABLE _batch_staging ADD COLUMN _src_rn BIGINT")
+
+    # Temp tables skip the WAL; every batch lands here and the target is
+    # written once at the end by finalize_target_table()
+    con.execute("DROP TABLE IF EXISTS _target_staging")
+    con.execute(
+        "CREATE TEMP TABLE _target_staging AS SELECT * FROM _batch_staging WHERE 1=0"
+    )
+    con.execute("ALTER TABLE _target_staging ADD COLUMN _batch INTEGER")
+
+
 def create_rejection_table(con):
     log("♻️ Creating rejection log table")
     con.execute(f"DROP TABLE IF EXISTS {REJECTION_TABLE}")
@@ -158,42 +245,61 @@ def get_total_rows(con) -> int:
     return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 
+def create_macros(con):
+    # Same rules as is_valid_flightno(), evaluated by DuckDB per slot.
+    # \p{Nd} is Python's \d; STRIP_WS stands in for str.strip()
+    con.execute(f"""
+        CREATE OR REPLACE TEMP MACRO valid_fltno(fn, dt) AS
+            fn IS NOT NULL
+            AND dt IS NOT NULL
+            AND regexp_full_match(fn, '{STRIP_WS}(?:[A-Z0-9]{{2,3}}\\p{{Nd}}+){STRIP_WS}')
+            AND regexp_full_match(fn, '{STRIP_WS}(?:[A-Z0-9\\p{{Nd}}]{{3,{MAX_FLTNO_DIGITS}}}){STRIP_WS}')
+            AND NOT regexp_full_match(fn, '{STRIP_WS}(?:\\p{{Nd}}+|[A-Z]*0*){STRIP_WS}')
+    """)
+
+
 def create_clean_view(con):
-    log("🧹 Creating cleaned source view")
+    log("🧹 Creating cleaned source table")
     con.execute(f"""
-        CREATE OR REPLACE TEMP VIEW cleaned_source AS
+        CREATE OR REPLACE TEMP TABLE cleaned_source AS
+        WITH pre AS (
+            SELECT
+                *,
+                replace(trim(upper(FltNo1)), ' ', '') AS norm_fn1,
+                replace(trim(upper(FltNo2)), ' ', '') AS norm_fn2,
+                replace(trim(upper(FltNo3)), ' ', '') AS norm_fn3,
+                replace(trim(upper(FltNo4)), ' ', '') AS norm_fn4,
+
+                TRY_CAST(FltDate1 AS TIMESTAMP) AS DT1,
+                TRY_CAST(FltDate2 AS TIMESTAMP) AS DT2,
+                TRY_CAST(FltDate3 AS TIMESTAMP) AS DT3,
+                TRY_CAST(FltDate4 AS TIMESTAMP) AS DT4
+            FROM {SOURCE_TABLE}
+        )
         SELECT
+            row_number() OVER (ORDER BY PNRNo, AirlineName, FltNo1, FltDate1) AS rn,
+
+            -- Empty strings become NULL here, so batches never see ''
             BillDate,
-            PaxName,
-            PNRNo,
-            AirlineName,
-            TicketNo,
-
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo1)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN1,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo2)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN2,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo3)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN3,
-            NULLIF(
-                regexp_replace(
-                    replace(trim(upper(FltNo4)), ' ', ''),
-                    '{FLTNO_REGEX}',
-                    '\\1\\2'),'') AS FN4,
-
-            TRY_CAST(FltDate1 AS TIMESTAMP) AS DT1,
-            TRY_CAST(FltDate2 AS TIMESTAMP) AS DT2,
-            TRY_CAST(FltDate3 AS TIMESTAMP) AS DT3,
-            TRY_CAST(FltDate4 AS TIMESTAMP) AS DT4,
+            NULLIF(PaxName, '') AS PaxName,
+            NULLIF(PNRNo, '') AS PNRNo,
+            NULLIF(AirlineName, '') AS AirlineName,
+            NULLIF(TicketNo, '') AS TicketNo,
+
+            NULLIF(regexp_replace(norm_fn1, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN1,
+            NULLIF(regexp_replace(norm_fn2, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN2,
+            NULLIF(regexp_replace(norm_fn3, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN3,
+            NULLIF(regexp_replace(norm_fn4, '{FLTNO_REGEX}', '\\1\\2'), '') AS FN4,
+
+            DT1,
+            DT2,
+            DT3,
+            DT4,
+
+            valid_fltno(FN1, DT1) AS VALID1,
+            valid_fltno(FN2, DT2) AS VALID2,
+            valid_fltno(FN3, DT3) AS VALID3,
+            valid_fltno(FN4, DT4) AS VALID4,
 
             -- Keep raw originals for the rejection log
             CAST(FltDate1 AS VARCHAR) AS RAW_FD1,
@@ -206,20 +312,20 @@ def create_clean_view(con):
             CAST(FltNo3 AS VARCHAR) AS RAW_FN3,
             CAST(FltNo4 AS VARCHAR) AS RAW_FN4,
 
-            SupplierName,
-            PaxType,
+            NULLIF(SupplierName, '') AS SupplierName,
+            NULLIF(PaxType, '') AS PaxType,
 
-            Airport1 AS AP1,
-            Airport2 AS AP2,
-            Airport3 AS AP3,
-            Airport4 AS AP4,
-            Airport5 AS AP5
-        FROM {SOURCE_TABLE}
+            NULLIF(Airport1, '') AS AP1,
+            NULLIF(Airport2, '') AS AP2,
+            NULLIF(Airport3, '') AS AP3,
+            NULLIF(Airport4, '') AS AP4,
+            NULLIF(Airport5, '') AS AP5
+        FROM pre
         WHERE
-            (TRY_CAST(FltDate1 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate2 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate3 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate4 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
+            year(DT1) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT2) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT3) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(DT4) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
             ORDER BY PNRNo, AirlineName, FltNo1, FltDate1
     """)
 
@@ -249,10 +355,10 @@ def log_invalid_date_range_rows(con, rejection_rows: list):
             CAST(Airport5 AS VARCHAR)
         FROM {SOURCE_TABLE}
         WHERE NOT (
-            (TRY_CAST(FltDate1 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate2 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate3 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-            OR (TRY_CAST(FltDate4 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
+            year(TRY_CAST(FltDate1 AS TIMESTAMP)) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(TRY_CAST(FltDate2 AS TIMESTAMP)) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(TRY_CAST(FltDate3 AS TIMESTAMP)) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            OR year(TRY_CAST(FltDate4 AS TIMESTAMP)) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
         )
     """).fetchall()
 
@@ -266,12 +372,6 @@ def log_invalid_date_range_rows(con, rejection_rows: list):
         )
 
 
-def is_same_route(d1, d2):
-    if pd.isna(d1) or pd.isna(d2):
-        return False
-    return abs(d2 - d1) <= timedelta(days=ROUTE_MAX_DAYS)
-
-
 def is_valid_flightno(fn, dt) -> tuple[bool, str | None, str | None]:
     if pd.isna(fn) and pd.isna(dt):
         return False, Reason.FN_NULL + "-" + Reason.DT_NULL, f"fn={fn!r}, dt={dt!r}"
@@ -305,75 +405,60 @@ def is_valid_flightno(fn, dt) -> tuple[bool, str | None, str | None]:
         )
 
     fn_upper = fn.strip().upper()
-    if not re.fullmatch(r"[A-Z0-9]{2,3}\d+", fn_upper):
+    if not FLTNO_FORMAT.fullmatch(fn_upper):
         return False, Reason.FN_BAD_FORMAT, f"fn={fn_upper!r}"
 
     return True, None, None
 
 
-def deduplicate_flights(flights):
-    flights.sort(key=lambda x: x[1])
-    seen_segments = set()
-    unique_flights = []
+def duplicate_leg_mask(fn_s, dt_ns, valid_s) -> np.ndarray:
+    """Legs repeating an earlier FlightNo + FlightDate (date-level) in the same row."""
+    # Pack (flight-number code, day ordinal) into one int64 per leg
+    fn_codes = pd.factorize(fn_s.ravel())[0].reshape(fn_s.shape).astype(np.int64)
+    day = dt_ns // NS_PER_DAY
+    key = (fn_codes << 32) | (day & 0xFFFFFFFF)
 
-    for fn, dt, dep_ap, arr_ap, slot in flights:
-        key = (fn, dt.date())
-        if key not in seen_segments:
-            seen_segments.add(key)
-            unique_flights.append((fn, dt, dep_ap, arr_ap, slot))
+    dup = np.zeros(valid_s.shape, dtype=bool)
+    for j in range(1, valid_s.shape[1]):
+        for k in range(j):
+            dup[:, j] |= valid_s[:, k] & valid_s[:, j] & (key[:, k] == key[:, j])
+    return dup
 
-    return unique_flights
 
+def route_ids(dt_ns, keep) -> np.ndarray:
+    """Route number per sorted leg; a route spans ROUTE_MAX_DAYS from its first leg."""
+    # Plain int64 nanoseconds: one scalar compare per leg, no timedelta math
+    max_span = ROUTE_MAX_DAYS * NS_PER_DAY
+    ids = np.zeros(dt_ns.shape, dtype=np.int64)
+    route_start = dt_ns[:, 0].copy()
 
-def group_into_routes(flights):
-    routes = []
-    current = [flights[0]]
-    route_start_date = flights[0][1]
+    for j in range(1, dt_ns.shape[1]):
+        new_route = keep[:, j] & (dt_ns[:, j] - route_start > max_span)
+        route_start = np.where(new_route, dt_ns[:, j], route_start)
+        ids[:, j] = ids[:, j - 1] + new_route
+    return ids
 
-    for f in flights[1:]:
-        if is_same_route(f[1], route_start_date):
-            current.append(f)
-        else:
-            routes.append(current)
-            current = [f]
-            route_start_date = f[1]
 
-    routes.append(current)
-    return routes
+def rejection_base_matrix(tbl) -> np.ndarray:
+    """Source values of every row as str/None, ready to prefix a rejection row."""
+    out = np.empty((tbl.num_rows, len(REJ_BASE_COLS)), dtype=object)
+    for j, col in enumerate(REJ_BASE_COLS):
+        values = tbl.column(col).to_pylist()
+        out[:, j] = [str(v) if v is not None else None for v in values]
+    return out
 
 
-def insert_target_table(con, paired_rows, rejection_rows):
-    if not paired_rows:
+def insert_target_table(
+    con, batch, out_rows, base_cols, rej_bases, src_rns, rejection_rows
+):
+    if not len(out_rows):
         return
 
-    col_names = [
-        "BillDate",
-        "PaxName",
-        "PNRNo",
-        "AirlineName",
-        "TicketNo",
-        "FltNo1",
-        "FltNo2",
-        "FltNo3",
-        "FltNo4",
-        "FltDate1",
-        "FltDate2",
-        "FltDate3",
-        "FltDate4",
-        "SupplierName",
-        "PaxType",
-        "Airport1",
-        "Airport2",
-        "Airport3",
-        "Airport4",
-        "Airport5",
-    ]
-
-    out_rows = [p[0] for p in paired_rows]
-    rej_bases = [p[1] for p in paired_rows]  # index-safe: same list, never drifts
+    col_names = TARGET_SCHEMA.names
 
     df_out = pd.DataFrame(out_rows, columns=col_names, dtype="object")
-    df_out.replace("", None, inplace=True)
+    for col, values in base_cols.to_pandas().items():
+        df_out[col] = values
 
     for col in [
         "PNRNo",
@@ -394,90 +479,118 @@ def insert_target_table(con, paired_rows, rejection_rows):
     for dc in ["FltDate1", "FltDate2", "FltDate3", "FltDate4"]:
         df_out[dc] = pd.to_datetime(df_out[dc], errors="coerce")
 
+    # Typed Arrow columns let DuckDB scan the batch without unboxing objects
+    arrow_staging = pa.Table.from_pandas(
+        df_out, schema=TARGET_SCHEMA, preserve_index=False
+    )
+    arrow_staging = arrow_staging.append_column(
+        "_rej_idx", pa.array(range(len(df_out)), pa.int32())
+    )  # 0..N, lines up with rej_bases
+    arrow_staging = arrow_staging.append_column(
+        "_src_rn", pa.array(src_rns, pa.int64())
+    )  # cleaned_source.rn, for rejections logged at finalize time
+    con.execute("INSERT INTO _batch_staging SELECT * FROM arrow_staging")
+
     # ── Stage 1: batch-level dedup ──────────────────────────────────────────
-    is_dup = df_out.duplicated(subset=KEY_COLS, keep="first")
-    dup_idxs = df_out.index[is_dup].tolist()
+    dup_idxs = sorted(
+        int(r[0])
+        for r in con.execute(f"""
+            DELETE FROM _batch_staging
+            WHERE _rej_idx IN (
+                SELECT _rej_idx
+                FROM _batch_staging
+                QUALIFY row_number() OVER (
+                    PARTITION BY {", ".join(KEY_COLS)}
+                    ORDER BY _rej_idx
+                ) > 1
+            )
+            RETURNING _rej_idx
+        """).fetchall()
+    )
 
     for i in dup_idxs:
         rejection_rows.append(
-            rej_bases[i] + [Reason.BATCH_DUPLICATE, "Duplicate within batch"]
+            list(rej_bases[i]) + [Reason.BATCH_DUPLICATE, "Duplicate within batch"]
         )
 
-    df_out = df_out[~is_dup].reset_index(drop=True)
-    rej_bases = [
-        rej_bases[i] for i in range(len(paired_rows)) if i not in set(dup_idxs)
-    ]
-
     if dropped := len(dup_idxs):
         log(f"🗑️ Dropped {dropped} duplicate rows within batch")
 
-    if df_out.empty:
-        return
+    # Conflicts against earlier batches are resolved once, in finalize_target_table()
+    con.execute(f"INSERT INTO _target_staging SELECT *, {batch} FROM _batch_staging")
 
-    # ── Stage 2: DB conflict check via staging table ─────────────────────────
-    con.execute("DROP TABLE IF EXISTS _batch_staging")
-    con.execute(
-        f"CREATE TEMP TABLE _batch_staging AS SELECT * FROM {TARGET_TABLE} WHERE 1=0"
-    )
-    con.execute("ALTER TABLE _batch_staging ADD COLUMN _rej_idx INTEGER")
+    staged = len(df_out) - len(dup_idxs)
+    log(f"✅ Staged {staged:,} rows for {TARGET_TABLE}")
+    con.execute("DELETE FROM _batch_staging")
 
-    df_staging = df_out.copy()
-    df_staging["_rej_idx"] = range(len(df_staging))  # 0..N, lines up with rej_bases
-    con.execute("INSERT INTO _batch_staging SELECT * FROM df_staging")
 
-    # NULL-safe JOIN — IS NOT DISTINCT FROM treats NULL == NULL as TRUE
-    conflict_idxs = {
-        int(r[0])
-        for r in con.execute(f"""
-            SELECT s._rej_idx
-            FROM _batch_staging s
-            WHERE EXISTS (
-                SELECT 1 FROM {TARGET_TABLE} t
-                WHERE TRIM(s.PNRNo)       = TRIM(t.PNRNo)
-                  AND TRIM(s.AirlineName) = TRIM(t.AirlineName)
-                  AND TRIM(s.TicketNo)    = TRIM(t.TicketNo)
-              AND (s.FltNo1 IS NOT DISTINCT FROM t.FltNo1)
-              AND s.FltDate1 IS NOT DISTINCT FROM t.FltDate1
-              AND TRIM(s.Airport1)    = TRIM(t.Airport1)
-              AND TRIM(s.Airport2)    = TRIM(t.Airport2)
-              AND TRIM(s.Airport3)    = TRIM(t.Airport3)
-              AND TRIM(s.Airport4)    = TRIM(t.Airport4)
-              AND TRIM(s.Airport5)    = TRIM(t.Airport5)
-              AND (s.FltNo2 IS NOT DISTINCT FROM t.FltNo2)
-              AND (s.FltNo3 IS NOT DISTINCT FROM t.FltNo3)
-              AND (s.FltNo4 IS NOT DISTINCT FROM t.FltNo4)
-              AND (s.FltDate2 IS NOT DISTINCT FROM t.FltDate2)
-              AND (s.FltDate3 IS NOT DISTINCT FROM t.FltDate3)
-              AND (s.FltDate4 IS NOT DISTINCT FROM t.FltDate4)
+def finalize_target_table(con):
+    """Write all staged batches into the target, skipping composite-key repeats."""
+    target_cols = ", ".join(TARGET_SCHEMA.names)
+    trim_cols = [
+        "PNRNo",
+        "AirlineName",
+        "TicketNo",
+        "Airport1",
+        "Airport2",
+        "Airport3",
+        "Airport4",
+        "Airport5",
+    ]
+    exact_cols = [f"FltNo{i}" for i in range(1, 5)] + [
+        f"FltDate{i}" for i in range(1, 5)
+    ]
+
+    # Same key as the old per-batch EXISTS probe: trimmed columns must be
+    # non-NULL to match, FltNo/FltDate compare NULL-safely. The first row
+    # in batch order wins, every later one is a DB unique violation.
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _target_conflicts AS
+        SELECT _batch, _rej_idx, _src_rn
+        FROM _target_staging
+        WHERE {" AND ".join(f"TRIM({c}) IS NOT NULL" for c in trim_cols)}
+        QUALIFY row_number() OVER (
+            PARTITION BY {", ".join([f"TRIM({c})" for c in trim_cols] + exact_cols)}
+            ORDER BY _batch, _rej_idx
+        ) > 1
+    """)
+
+    rej_cols = ", ".join(
+        f"NULLIF(CAST(s.{c} AS VARCHAR), '')" for c in REJ_BASE_COLS
+    )
+    con.execute(f"""
+        INSERT INTO {REJECTION_TABLE} (
+            {", ".join(TARGET_SCHEMA.names)}, RejectionReason, RejectionDetail
         )
-    """).fetchall()
-    }
-    for i in sorted(conflict_idxs):
-        rejection_rows.append(
-            rej_bases[i]
-            + [Reason.DB_UNIQUE_VIOLATION, "Composite key already in target"]
+        SELECT
+            {rej_cols},
+            '{Reason.DB_UNIQUE_VIOLATION}',
+            'Composite key already in target'
+        FROM _target_conflicts c
+        JOIN cleaned_source s ON s.rn = c._src_rn
+        ORDER BY c._batch, c._rej_idx
+    """)
+
+    con.execute(f"""
+        INSERT INTO {TARGET_TABLE} ({target_cols})
+        SELECT {target_cols}
+        FROM _target_staging s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM _target_conflicts c
+            WHERE c._batch = s._batch AND c._rej_idx = s._rej_idx
         )
+        ORDER BY _batch, _rej_idx
+    """)
 
-    if ignored := len(conflict_idxs):
-        log(f"⚠️ {ignored} rows skipped — already exist in target")
-
-    # Insert only non-conflicting rows
-    target_cols = ", ".join(col_names)
-    if conflict_idxs:
-        placeholders = ", ".join(str(i) for i in sorted(conflict_idxs))
-        con.execute(f"""
-            INSERT INTO {TARGET_TABLE} ({target_cols})
-            SELECT {target_cols} FROM _batch_staging
-            WHERE _rej_idx NOT IN ({placeholders})
-        """)
-    else:
-        con.execute(f"""
-            INSERT INTO {TARGET_TABLE} ({target_cols})
-            SELECT {target_cols} FROM _batch_staging
-        """)
-
-    log(f"✅ Inserted {len(df_out) - len(conflict_idxs):,} rows into {TARGET_TABLE}")
-    con.execute("DROP TABLE IF EXISTS _batch_staging")
+    ignored = con.execute("SELECT COUNT(*) FROM _target_conflicts").fetchone()[0]
+    if ignored:
+        log(f"⚠️ {ignored:,} rows skipped — already exist in target")
+
+    inserted = con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()[0]
+    log(f"✅ Inserted {inserted:,} rows into {TARGET_TABLE}")
+
+    con.execute("DROP TABLE IF EXISTS _target_conflicts")
+    con.execute("DROP TABLE IF EXISTS _target_staging")
 
 
 def flush_rejections(con, rejection_rows: list):
@@ -498,78 +611,65 @@ def flush_rejections(con, rejection_rows: list):
     rejection_rows.clear()
 
 
-def process_batch(con, offset, rejection_rows: list):
-    df = con.execute(f"""
+def fetch_batch(con, offset):
+    return con.execute(f"""
         SELECT * FROM cleaned_source
-        LIMIT {BATCH_SIZE} OFFSET {offset}
-    """).df()
-
-    if df.empty:
-        return 0
-
-    paired_rows = []  # each entry is (out_row, rej_base) — never drifts apart
-
-    base_cols1 = ["BillDate", "PaxName", "PNRNo", "AirlineName", "TicketNo"]
-    base_cols2 = ["SupplierName", "PaxType"]
-    raw_cols = [
-        "RAW_FN1",
-        "RAW_FN2",
-        "RAW_FN3",
-        "RAW_FN4",
-        "RAW_FD1",
-        "RAW_FD2",
-        "RAW_FD3",
-        "RAW_FD4",
-    ]
-    ap_cols = ["AP1", "AP2", "AP3", "AP4", "AP5"]
-
-    base_data1 = df[base_cols1].values
-    base_data2 = df[base_cols2].values
-    raw_data = df[raw_cols].values
-    ap_data = df[ap_cols].values
-
-    for idx, row in enumerate(df.itertuples(index=False)):
-
-        def make_rej_base(idx=idx):
-            # Use the named columns from the dataframe directly to avoid index errors
-            curr_row = df.iloc[idx]
-
-            return [
-                str(curr_row["BillDate"]) if pd.notna(curr_row["BillDate"]) else None,
-                str(curr_row["PaxName"]) if pd.notna(curr_row["PaxName"]) else None,
-                str(curr_row["PNRNo"]) if pd.notna(curr_row["PNRNo"]) else None,
-                str(curr_row["AirlineName"])
-                if pd.notna(curr_row["AirlineName"])
-                else None,
-                str(curr_row["TicketNo"]) if pd.notna(curr_row["TicketNo"]) else None,
-                str(curr_row["RAW_FN1"]) if pd.notna(curr_row["RAW_FN1"]) else None,
-                str(curr_row["RAW_FN2"]) if pd.notna(curr_row["RAW_FN2"]) else None,
-                str(curr_row["RAW_FN3"]) if pd.notna(curr_row["RAW_FN3"]) else None,
-                str(curr_row["RAW_FN4"]) if pd.notna(curr_row["RAW_FN4"]) else None,
-                str(curr_row["RAW_FD1"]) if pd.notna(curr_row["RAW_FD1"]) else None,
-                str(curr_row["RAW_FD2"]) if pd.notna(curr_row["RAW_FD2"]) else None,
-                str(curr_row["RAW_FD3"]) if pd.notna(curr_row["RAW_FD3"]) else None,
-                str(curr_row["RAW_FD4"]) if pd.notna(curr_row["RAW_FD4"]) else None,
-                str(curr_row["SupplierName"])
-                if pd.notna(curr_row["SupplierName"])
-                else None,
-                str(curr_row["PaxType"]) if pd.notna(curr_row["PaxType"]) else None,
-                str(curr_row["AP1"]) if pd.notna(curr_row["AP1"]) else None,
-                str(curr_row["AP2"]) if pd.notna(curr_row["AP2"]) else None,
-                str(curr_row["AP3"]) if pd.notna(curr_row["AP3"]) else None,
-                str(curr_row["AP4"]) if pd.notna(curr_row["AP4"]) else None,
-                str(curr_row["AP5"]) if pd.notna(curr_row["AP5"]) else None,
-            ]
+        WHERE rn > {offset} AND rn <= {offset + BATCH_SIZE}
+    """).fetch_arrow_table()
+
+
+def column_matrix(tbl, cols) -> np.ndarray:
+    """Stack Arrow columns into a (rows x cols) object matrix; nulls become None."""
+    out = np.empty((tbl.num_rows, len(cols)), dtype=object)
+    for j, col in enumerate(cols):
+        out[:, j] = tbl.column(col).to_pylist()
+    return out
 
-        flights = []
-        slot_rejections = []
 
-        for i in range(1, 5):
-            fn = getattr(row, f"FN{i}")
-            dt = getattr(row, f"DT{i}")
-            valid, reason, detail = is_valid_flightno(fn, dt)
+def build_batch(tbl):
+    """Pivot one cleaned_source slice into target rows, without touching the DB."""
+    rejection_rows = []
+
+    n_rows = tbl.num_rows
+    fn_arr = column_matrix(tbl, FN_COLS)
+    ap_arr = column_matrix(tbl, AP_COLS)
+    dt_arr = np.column_stack(
+        [tbl.column(c).cast(pa.timestamp("ns")).to_numpy() for c in DT_COLS]
+    )
+    valid = np.column_stack([tbl.column(c).to_numpy() for c in VALID_COLS])
+    # Epoch nanoseconds, converted once; sorting, dedup and routing share them
+    dt_ns = dt_arr.view(np.int64)
+
+    # Sort each row's legs by date (stable: slot order on ties), invalid legs last
+    sort_key = np.where(valid, dt_ns, np.iinfo(np.int64).max)
+    order = np.argsort(sort_key, axis=1, kind="stable")
+    fn_s = np.take_along_axis(fn_arr, order, axis=1)
+    dt_s = np.take_along_axis(dt_arr, order, axis=1)
+    dt_ns_s = np.take_along_axis(dt_ns, order, axis=1)
+    dep_s = np.take_along_axis(ap_arr[:, :4], order, axis=1)
+    arr_s = np.take_along_axis(ap_arr[:, 1:], order, axis=1)
+    valid_s = np.take_along_axis(valid, order, axis=1)
+
+    keep = valid_s & ~duplicate_leg_mask(fn_s, dt_ns_s, valid_s)
+    route_s = route_ids(dt_ns_s, keep)
+    has_flights = keep.any(axis=1)
+
+    rej_data = rejection_base_matrix(tbl)
+
+    # A row yields at most one route per leg
+    out_rows = np.empty((n_rows * len(FN_COLS), len(TARGET_SCHEMA)), dtype=object)
+    out_src = np.empty(n_rows * len(FN_COLS), dtype=np.int64)
+    n_out = 0
+
+    for idx in range(n_rows):
+        if not has_flights[idx]:
+            slot_rejections = []
+
+            for i in range(1, 5):
+                fn = fn_arr[idx, i - 1]
+                dt = pd.Timestamp(dt_arr[idx, i - 1])
+                _, reason, detail = is_valid_flightno(fn, dt)
 
-            if not valid:
                 if (
                     reason
                     in (
@@ -582,14 +682,8 @@ def process_batch(con, offset, rejection_rows: list):
                 ):
                     continue
                 slot_rejections.append((i, reason, detail))
-                continue
 
-            dep_ap = getattr(row, f"AP{i}")
-            arr_ap = getattr(row, f"AP{i + 1}")
-            flights.append((fn, dt, dep_ap, arr_ap, i))
-
-        if not flights:
-            rej_base = make_rej_base()
+            rej_base = list(rej_data[idx])
             if slot_rejections:
                 primary = next(
                     (r for r in slot_rejections if r[0] == 1), slot_rejections[0]
@@ -606,54 +700,48 @@ def process_batch(con, offset, rejection_rows: list):
                 )
             continue
 
-        flights = deduplicate_flights(flights)
-        routes = group_into_routes(flights)
-        rej_base = make_rej_base()
+        legs = np.flatnonzero(keep[idx])
+        routes = np.split(legs, np.flatnonzero(np.diff(route_s[idx, legs])) + 1)
 
         for route in routes:
-            base1 = list(base_data1[idx])
-            base2 = list(base_data2[idx])
-            fn_out = [None] * 4
-            dt_out = [None] * 4
-            ap_out = [None] * 5
-
-            for i, (fn, dt, dep_ap, arr_ap, slot) in enumerate(route[:4]):
-                fn_out[i] = fn
-                dt_out[i] = dt
-                ap_out[i] = dep_ap
-                if i + 1 < len(ap_out):
-                    ap_out[i + 1] = arr_ap
-
-            # Explicitly build the list to ensure index alignment
-            out_row = [
-                base1[0],
-                base1[1],
-                base1[2],
-                base1[3],
-                base1[4],  # BillDate to TicketNo
-                fn_out[0],
-                fn_out[1],
-                fn_out[2],
-                fn_out[3],  # FltNos
-                dt_out[0],
-                dt_out[1],
-                dt_out[2],
-                dt_out[3],  # FltDates
-                base2[0],
-                base2[1],  # Supplier, PaxType
-                ap_out[0],
-                ap_out[1],
-                ap_out[2],
-                ap_out[3],
-                ap_out[4],  # Airports
-            ]
-            paired_rows.append((out_row, rej_base))  # ✅ kept together
+            out_row = out_rows[n_out]  # view, unset cells stay None
+            for i, j in enumerate(route):
+                out_row[5 + i] = fn_s[idx, j]  # FltNos
+                out_row[9 + i] = dt_s[idx, j]  # FltDates
+                out_row[15 + i] = dep_s[idx, j]  # Airports
+                out_row[16 + i] = arr_s[idx, j]
+
+            out_src[n_out] = idx
+            n_out += 1
+
+    # Per-row columns are gathered straight from the batch in one typed Arrow
+    # take: BillDate stays a timestamp, no round trip through Python objects
+    src = out_src[:n_out]
+    base_cols = tbl.select(BASE_COLS).take(src)
+
+    # rej_data rows and rn follow out_src, so all stay aligned through the insert
+    src_rns = tbl.column("rn").to_numpy()[src]
+    return out_rows[:n_out], base_cols, rej_data[src], src_rns, rejection_rows
+
+
+def finish_batch(con, total, batch, offset, batch_start, future) -> int:
+    out_rows, base_cols, rej_bases, src_rns, rejection_rows = future.result()
+    log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total):,}")
+
+    insert_target_table(
+        con, batch, out_rows, base_cols, rej_bases, src_rns, rejection_rows
+    )
+    if rejection_rows:
+        flush_rejections(con, rejection_rows)
 
-    if not paired_rows:
-        return 0
+    offset += BATCH_SIZE
+    batch_time = time.time() - batch_start
+    progress = (offset / total) * 100
+    eta = (batch_time * (total - offset) / BATCH_SIZE) / 3600
 
-    insert_target_table(con, paired_rows, rejection_rows)
-    return len(paired_rows)
+    rows_processed = len(out_rows)
+    log(f"✅ Processed {rows_processed:,} rows | {progress:.1f}% | ETA: {eta:.2f}h")
+    return rows_processed
 
 
 # ==================================================
@@ -665,7 +753,9 @@ def main():
 
     con = connect_db()
     create_target_table(con)
+    create_staging_table(con)
     create_rejection_table(con)
+    create_macros(con)
     create_clean_view(con)
 
     rejection_rows: list = []
@@ -679,28 +769,25 @@ def main():
     total = result[0] if result else 0
     log(f"📊 Cleaned rows: {total:,}")
 
-    offset = 0
-    batch = 0
     processed = 0
 
-    while offset < total:
-        batch += 1
-        batch_start = time.time()
-        log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total):,}")
+    # Batches are pivoted on worker threads; staging inserts stay on this
+    # connection in batch order
+    with ThreadPoolExecutor(max_workers=BUILD_WORKERS) as pool:
+        pending = deque()
 
-        rejection_rows = []
-        rows_processed = process_batch(con, offset, rejection_rows)
-        processed += rows_processed
-        offset += BATCH_SIZE
+        for batch, offset in enumerate(range(0, total, BATCH_SIZE), start=1):
+            tbl = fetch_batch(con, offset)
+            future = pool.submit(build_batch, tbl)
+            pending.append((batch, offset, time.time(), future))
 
-        if rejection_rows:
-            flush_rejections(con, rejection_rows)
+            if len(pending) > BUILD_WORKERS:
+                processed += finish_batch(con, total, *pending.popleft())
 
-        batch_time = time.time() - batch_start
-        progress = (offset / total) * 100
-        eta = (batch_time * (total - offset) / BATCH_SIZE) / 3600
+        while pending:
+            processed += finish_batch(con, total, *pending.popleft())
 
-        log(f"✅ Processed {rows_processed:,} rows | {progress:.1f}% | ETA: {eta:.2f}h")
+    finalize_target_table(con)
 
     log("\n📋 Rejection Summary:")
     summary = con.execute(f"""
@@ -710,7 +797,7 @@ def main():
         ORDER BY cnt DESC
     """).fetchall()
     for reason, cnt in summary:
-        log(f" {reason:<30} {cnt:>10,}")
+        log(f" {reason or '(none)':<30} {cnt:>10,}")
 
     src = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
     tgt = con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()[0]
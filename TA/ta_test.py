@@ -1,4 +1,6 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import duckdb
@@ -11,15 +13,17 @@ DATABASE_NAME = "my_db.duckdb"
 DB_PATH = DATABASE_DIR / DATABASE_NAME
 
 SOURCE_TABLE = "TA_MASTER"
+SORTED_TABLE = "TA_MASTER_SORTED"
 TARGET_TABLE = "TA_MASTER_TARGET"
 FINAL_MASTER_TABLE = "TA_MASTER_FINAL"
 
 BATCH_SIZE = 500_000
+PARALLEL_BATCHES = 2
 
 VALID_YEAR_MIN = 1990
 VALID_YEAR_MAX = 2027
 
-THREADS = 4
+THREADS = os.cpu_count() or 4  # all cores: window/regex work scales with threads
 MEMORY_LIMIT = "6GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 
@@ -101,6 +105,8 @@ def create_macros(con: duckdb.DuckDBPyConnection) -> None:
         CREATE OR REPLACE MACRO normalize_flight(flight) AS (
             CASE
                 WHEN flight IS NULL THEN NULL
+                -- VO codes (1–2 letters only) are not flights
+                WHEN is_vo(flight) THEN NULL
                 -- airline code (2–3 letters) + optional space + digits
                 WHEN regexp_matches(UPPER(TRIM(flight)), '^[A-Z]{2,3}\\s*[0-9]+$')
                 THEN
@@ -136,61 +142,51 @@ def get_total_rows(con: duckdb.DuckDBPyConnection) -> int:
     return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 
-def get_target_count(con: duckdb.DuckDBPyConnection) -> int:
-    return con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()[0]
+def create_sorted_source(con: duckdb.DuckDBPyConnection) -> int:
+    log("🔃 Sorting source by passenger and PNR")
 
-
-# delete rows if starts with only letters
-def delete_invalid_flight_no(con: duckdb.DuckDBPyConnection) -> None:
-    con.execute("""
-        DELETE
-        FROM TA_MASTER
-        WHERE regexp_matches(TRIM(UPPER("S1FltNo")), '^[A-Z]{1,2}$');
+    # rank() - 1 is the number of rows before a passenger/PNR group, so a
+    # whole group always falls into one batch and trips never split at
+    # batch boundaries. Not TEMP: batch cursors must be able to read it
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {SORTED_TABLE} AS
+        SELECT *,
+            (rank() OVER (ORDER BY "Pax Name", "PNR CRS") - 1) // {BATCH_SIZE} AS _batch
+        FROM {SOURCE_TABLE}
+        ORDER BY "Pax Name", "PNR CRS"
     """)
+    return con.execute(
+        f"SELECT COALESCE(MAX(_batch) + 1, 0) FROM {SORTED_TABLE}"
+    ).fetchone()[0]
 
 
-def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> None:
-    con.execute(f"""
+def process_batch(con: duckdb.DuckDBPyConnection, batch_no: int) -> int:
+    result = con.execute(f"""
         INSERT INTO {TARGET_TABLE}
 
         WITH src AS (
             SELECT *
-            FROM {SOURCE_TABLE}
-            WHERE rowid >= {offset}
-              AND rowid < {offset + limit}
+            FROM {SORTED_TABLE}
+            WHERE _batch = {batch_no}
         ),
 unpivoted AS (
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S1FltNo AS FltNo,
-         S1Date  AS Dte, "Airport 1" AS DepAir, "Airport 2" AS ArrAir, 1 AS Segment
-    FROM src
-    WHERE TRIM(S1FltNo) <> ''
-    UNION ALL
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S2FltNo AS FltNo,
-        S2Date  AS Dte, "Airport 2" AS DepAir, "Airport 3" AS ArrAir, 2 AS Segment
-    FROM src
-    WHERE TRIM(S2FltNo) <> ''
-    UNION ALL
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S3FltNo AS FltNo,
-        S3Date  AS Dte, "Airport 3" AS DepAir, "Airport 4" AS ArrAir, 3 AS Segment
-    FROM src
-    WHERE TRIM(S3FltNo) <> ''
-    UNION ALL
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S4FltNo AS FltNo,
-        S4Date  AS Dte, "Airport 4" AS DepAir, "Airport 5" AS ArrAir, 4 AS Segment
-    FROM src
-    WHERE TRIM(S4FltNo) <> ''
-    UNION ALL
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S5FltNo AS FltNo,
-        S5Date  AS Dte, "Airport 5" AS DepAir, "Airport 6" AS ArrAir, 5 AS Segment
+    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number",
+        FltNo, Dte, DepAir, ArrAir, CAST(Segment AS INTEGER) AS Segment
     FROM src
-    WHERE TRIM(S5FltNo) <> ''
-    UNION ALL
-    SELECT "Pax Name", "PNR CRS", "PNR Airline", Airlines, "Ticket Number", S6FltNo AS FltNo,
-        S6Date  AS Dte, "Airport 6" AS DepAir, "Airport 7" AS ArrAir, 6 AS Segment
-    FROM src
-    WHERE TRIM(S6FltNo) <> ''
+    UNPIVOT INCLUDE NULLS (
+        (FltNo, Dte, DepAir, ArrAir) FOR Segment IN (
+            (S1FltNo, S1Date, "Airport 1", "Airport 2") AS '1',
+            (S2FltNo, S2Date, "Airport 2", "Airport 3") AS '2',
+            (S3FltNo, S3Date, "Airport 3", "Airport 4") AS '3',
+            (S4FltNo, S4Date, "Airport 4", "Airport 5") AS '4',
+            (S5FltNo, S5Date, "Airport 5", "Airport 6") AS '5',
+            (S6FltNo, S6Date, "Airport 6", "Airport 7") AS '6'
+        )
+    )
+    WHERE TRIM(FltNo) <> ''
 ),
-cleaned AS (
+-- normalized in place; DuckDB lets WHERE reuse the select aliases
+filtered AS (
     SELECT
         "Pax Name",
         "PNR CRS",
@@ -203,30 +199,19 @@ cleaned AS (
         ArrAir,
         Segment
     FROM unpivoted
-),
-filtered AS (
-    SELECT *
-    FROM cleaned
     WHERE clean_flt IS NOT NULL
       AND clean_dte IS NOT NULL
-      AND NOT is_vo(clean_flt)
-),
-deduped AS (
-    SELECT *,
-        ROW_NUMBER() OVER (
-            PARTITION BY "Pax Name", "PNR CRS", clean_dte
-            ORDER BY Segment
-        ) AS rn
-    FROM filtered
 ),
+-- one window for dedup and LAG: only the first leg of each date has a
+-- prev_dte different from its own date
 with_prev AS (
     SELECT *,
         LAG(clean_dte) OVER (
             PARTITION BY "Pax Name", "PNR CRS"
              ORDER BY clean_dte, Segment
         ) AS prev_dte
-    FROM deduped
-    WHERE rn = 1
+    FROM filtered
+    QUALIFY prev_dte IS DISTINCT FROM clean_dte
 ),
 with_trip_id AS (
     SELECT *,
@@ -234,7 +219,8 @@ with_trip_id AS (
             CASE
                 WHEN prev_dte IS NULL THEN 1
                 WHEN clean_dte < prev_dte THEN 1
-                WHEN EXTRACT(EPOCH FROM (clean_dte - prev_dte)) > 36 * 3600 THEN 1
+                -- 36h gap as an int64 microsecond diff (cheaper than + INTERVAL)
+                WHEN epoch_us(clean_dte) - epoch_us(prev_dte) > 129600000000 THEN 1
                 ELSE 0
             END
         ) OVER (
@@ -252,6 +238,9 @@ sequenced AS (
         ) AS seq_id
     FROM with_trip_id
 ),
+-- MAX(CASE ...) on purpose: native PIVOT evaluates every USING aggregate
+-- once per seq_id, so the three ANY_VALUE columns become 18 and the
+-- pivot runs ~2x slower than this single GROUP BY
 pivoted AS (
     SELECT
         "Pax Name",
@@ -292,6 +281,31 @@ SELECT
     "Airport 1", "Airport 2", "Airport 3", "Airport 4",
     "Airport 5", "Airport 6", "Airport 7"
 FROM pivoted
+    """).fetchone()
+    # INSERT reports its own row count
+    return result[0] if result else 0
+
+
+def run_batch(con: duckdb.DuckDBPyConnection, batch_no: int, n_batches: int) -> int:
+    # Own cursor per batch so batches can run side by side
+    cur = con.cursor()
+    try:
+        log(f"🔄 Batch {batch_no + 1}/{n_batches}")
+        added = process_batch(cur, batch_no)
+    finally:
+        cur.close()
+    log(f"✅ Batch {batch_no + 1}/{n_batches}: added {added:,} rows")
+    return added
+
+
+def cluster_target_by_date(con: duckdb.DuckDBPyConnection) -> None:
+    # Rewrite the target in S1Date order: row-group min/max then lets
+    # year/date filters skip whole row groups instead of full scans
+    log("🗂️ Clustering target table by S1Date")
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {TARGET_TABLE} AS
+        SELECT * FROM {TARGET_TABLE}
+        ORDER BY S1Date
     """)
 
 
@@ -321,70 +335,26 @@ def seperate_flights_by_airports(con: duckdb.DuckDBPyConnection) -> None:
             AND "Airport3" IS NOT NULL
         )
     ),
-    -- -------- LEG 1 --------
-    leg1 AS (
-        SELECT
-            "Pax Name",
-            "PNR CRS",
-            "PNR Airline",
-            "Airlines",
-            "Ticket Number",
-            "S1FltNo" AS "S1FltNo",
-            NULL AS "S2FltNo",
-            NULL AS "S3FltNo",
-            NULL AS "S4FltNo",
-            NULL AS "S5FltNo",
-            NULL AS "S6FltNo",
-            "S1Date" AS "S1Date",
-            NULL AS "S2Date",
-            NULL AS "S3Date",
-            NULL AS "S4Date",
-            NULL AS "S5Date",
-            NULL AS "S6Date",
-            "Airport1" AS "Airport1",
-            "Airport2" AS "Airport2",
-            NULL AS "Airport3",
-            NULL AS "Airport4",
-            NULL AS "Airport5",
-            NULL AS "Airport6",
-            NULL AS "Airport7"
-        FROM to_split
-    ),
-    -- -------- LEG 2 --------
-    leg2 AS (
+    -- -------- LEG 1 / LEG 2 (one scan of to_split) --------
+    legs AS (
         SELECT
             "Pax Name",
             "PNR CRS",
             "PNR Airline",
             "Airlines",
             "Ticket Number",
-            "S2FltNo" AS "S1FltNo",
-            NULL AS "S2FltNo",
-            NULL AS "S3FltNo",
-            NULL AS "S4FltNo",
-            NULL AS "S5FltNo",
-            NULL AS "S6FltNo",
-            "S2Date" AS "S1Date",
-            NULL AS "S2Date",
-            NULL AS "S3Date",
-            NULL AS "S4Date",
-            NULL AS "S5Date",
-            NULL AS "S6Date",
-            "Airport2" AS "Airport1",
-            "Airport3" AS "Airport2",
-            NULL AS "Airport3",
-            NULL AS "Airport4",
-            NULL AS "Airport5",
-            NULL AS "Airport6",
-            NULL AS "Airport7"
+            CASE leg WHEN 1 THEN "S1FltNo" ELSE "S2FltNo" END AS "S1FltNo",
+            CASE leg WHEN 1 THEN "S1Date" ELSE "S2Date" END AS "S1Date",
+            CASE leg WHEN 1 THEN "Airport1" ELSE "Airport2" END AS "Airport1",
+            CASE leg WHEN 1 THEN "Airport2" ELSE "Airport3" END AS "Airport2"
         FROM to_split
+        CROSS JOIN (VALUES (1), (2)) v(leg)
     )
     -- -------- FINAL RESULT --------
+    -- BY NAME fills the remaining segment columns of legs with NULL
     SELECT * FROM not_split
-    UNION ALL
-    SELECT * FROM leg1
-    UNION ALL
-    SELECT * FROM leg2;
+    UNION ALL BY NAME
+    SELECT * FROM legs;
     """)
 
 
@@ -400,22 +370,17 @@ def main() -> None:
     total_rows = get_total_rows(con)
     log(f"📊 Source rows: {total_rows:,}")
     create_macros(con)
+    n_batches = create_sorted_source(con)
 
-    offset = 0
-    batch_no = 0
-    inserted_prev = 0
-
-    while offset < total_rows:
-        batch_no += 1
-        log(f"🔄 Batch {batch_no} | rows {offset:,} → {offset + BATCH_SIZE:,}")
-
-        process_batch(con, offset, BATCH_SIZE)
-
-        inserted_now = get_target_count(con)
-        log(f"✅ Added {inserted_now - inserted_prev:,} rows")
+    # Batches hold disjoint passenger groups, so they can run concurrently
+    with ThreadPoolExecutor(max_workers=PARALLEL_BATCHES) as ex:
+        inserted = sum(
+            ex.map(lambda b: run_batch(con, b, n_batches), range(n_batches))
+        )
+    log(f"📊 Inserted {inserted:,} rows")
 
-        inserted_prev = inserted_now
-        offset += BATCH_SIZE
+    con.execute(f"DROP TABLE IF EXISTS {SORTED_TABLE}")
+    cluster_target_by_date(con)
 
     elapsed = time.time() - start
     log(f"🎉 ETL completed in {int(elapsed // 60)}m {elapsed % 60:.2f}s")
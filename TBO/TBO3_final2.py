@@ -1,284 +1,261 @@
-import duckdb
-import pandas as pd
-import re
-from pathlib import Path
-import time
-
-# --------------------------------------------------
-# CONFIG
-# --------------------------------------------------
-DATABASE_DIR = Path(r"C:\DuckDB")
-DATABASE_NAME = "my_db.duckdb"
-DB_PATH = DATABASE_DIR / DATABASE_NAME
-
-SOURCE_TABLE = "TBO3_MASTER"
-TARGET_TABLE = "TBO3_MASTER_TARGET"
-BATCH_SIZE = 100_000  # Reduced for memory efficiency
-
-VALID_YEAR_MIN = 1990
-VALID_YEAR_MAX = 2100
-
-# --------------------------------------------------
-# CONNECT
-# --------------------------------------------------
-con = duckdb.connect(DB_PATH)
-
-# --------------------------------------------------
-# RECREATE TARGET TABLE
-# --------------------------------------------------
-con.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
-
-con.execute(f"""
-CREATE TABLE {TARGET_TABLE} (
-    PaxName TEXT,
-    BookingRef TEXT,
-    ETicketNo TEXT,
-    ClientCode TEXT,
-    Airline TEXT,
-    JourneyType TEXT,
-
-    FlightNumber1 TEXT,
-    FlightNumber2 TEXT,
-    FlightNumber3 TEXT,
-    FlightNumber4 TEXT,
-    FlightNumber5 TEXT,
-    FlightNumber6 TEXT,
-    FlightNumber7 TEXT,
-
-    DepartureDateLocal1 DATE,
-    DepartureDateLocal2 DATE,
-    DepartureDateLocal3 DATE,
-    DepartureDateLocal4 DATE,
-    DepartureDateLocal5 DATE,
-    DepartureDateLocal6 DATE,
-    DepartureDateLocal7 DATE,
-
-    Airport1 TEXT,
-    Airport2 TEXT,
-    Airport3 TEXT,
-    Airport4 TEXT,
-    Airport5 TEXT,
-    Airport6 TEXT,
-    Airport7 TEXT,
-    Airport8 TEXT
-);
-""")
-
-
-# --------------------------------------------------
-# HELPERS
-# --------------------------------------------------
-def is_rnk(flight):
-    if not isinstance(flight, str):
-        return False
-    if flight.endswith("000"):
-        return True
-
-
-def normalize_flight_number(fn):
-    if not isinstance(fn, str):
-        return None
-
-    fn = fn.strip().upper()
-    m = re.fullmatch(r"([A-Z]{2,3})(0*)(\d+)", fn)
-    if not m:
-        return fn
-
-    airline, _, number = m.groups()
-    return f"{airline}{int(number)}"
-
-
-def normalize_date(value):
-    d = pd.to_datetime(value, errors="coerce")
-    if pd.isna(d):
-        return None
-    if d.year < VALID_YEAR_MIN or d.year > VALID_YEAR_MAX:
-        return None
-    return d.date()
-
-
-def same_route(d1, d2):
-    if d1 is None or d2 is None:
-        return False
-    return abs((d2 - d1).days) <= 1
-
-
-# --------------------------------------------------
-# PROCESS LOOP
-# --------------------------------------------------
-offset = 0
-start_time = time.time()
-print(
-    f"⏰ Start Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}"
-)
-
-while True:
-    df = con.execute(f"""
-        SELECT *
-        FROM {SOURCE_TABLE}
-        LIMIT {BATCH_SIZE} OFFSET {offset}
-    """).df()
-
-    if df.empty:
-        break
-
-    out_rows = []
-
-    for _, row in df.iterrows():
-        base = {
-            "PaxName": row["PaxName"],
-            "BookingRef": row["BookingRef"],
-            "ETicketNo": row["ETicketNo"],
-            "ClientCode": row["ClientCode"],
-            "Airline": row["Airline"],
-            "JourneyType": row["JourneyType"],
-        }
-
-        # --------------------------------------------------
-        # 1️⃣ ROW-LEVEL DUPLICATE + RNK CLEAN (RAW DATA)
-        # --------------------------------------------------
-        seen_raw = set()
-        cleaned_raw = []
-
-        for i in range(1, 8):
-            fn = row.get(f"FlightNumber{i}")
-            dt = row.get(f"DepartureDateLocal{i}")
-            ap = row.get(f"Airport{i}")
-
-            if not fn or not dt:
-                continue
-
-            fn_clean = fn.strip().upper()
-
-            if is_rnk(fn_clean):
-                continue
-
-            key = (fn_clean, dt)
-            if key in seen_raw:
-                continue
-
-            seen_raw.add(key)
-            cleaned_raw.append((fn_clean, dt, ap))
-
-        # --------------------------------------------------
-        # 2️⃣ NORMALIZE
-        # --------------------------------------------------
-        flights = []
-        for fn, dt, ap in cleaned_raw:
-            n_fn = normalize_flight_number(fn)
-            n_dt = normalize_date(dt)
-
-            if n_fn and n_dt:
-                flights.append((n_fn, n_dt, ap))
-
-        if not flights:
-            continue
-
-        # --------------------------------------------------
-        # 3️⃣ SPLIT ROUTES
-        # --------------------------------------------------
-        routes = []
-        current = []
-
-        for fn, dt, ap in flights:
-            if not current:
-                current.append((fn, dt, ap))
-                continue
-
-            prev_fn, prev_dt, _ = current[-1]
-
-            if fn == prev_fn and dt == prev_dt:
-                continue
-
-            if same_route(prev_dt, dt):
-                current.append((fn, dt, ap))
-            else:
-                routes.append(current)
-                current = [(fn, dt, ap)]
-
-        if current:
-            routes.append(current)
-
-        # --------------------------------------------------
-        # 4️⃣ BUILD OUTPUT ROWS
-        # --------------------------------------------------
-        for route in routes:
-            new = base.copy()
-
-            for i in range(1, 8):
-                new[f"FlightNumber{i}"] = None
-                new[f"DepartureDateLocal{i}"] = None
-                new[f"Airport{i}"] = None
-            new["Airport8"] = None
-
-            # route-level safety duplicate
-            seen = set()
-            compacted = []
-
-            for fn, dt, ap in route:
-                key = (fn, dt)
-                if key in seen:
-                    continue
-                seen.add(key)
-                compacted.append((fn, dt, ap))
-
-            for i, (fn, dt, ap) in enumerate(compacted, start=1):
-                if i > 7:
-                    break
-                new[f"FlightNumber{i}"] = fn
-                new[f"DepartureDateLocal{i}"] = dt
-                new[f"Airport{i}"] = ap
-
-            out_rows.append(new)
-
-    out_df = pd.DataFrame(out_rows)
-
-    if not out_df.empty:
-        con.register("out_df", out_df)
-        con.execute(f"""
-    INSERT INTO {TARGET_TABLE} (
-        PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-
-        FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4,
-        FlightNumber5, FlightNumber6, FlightNumber7,
-
-        DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3,
-        DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6,
-        DepartureDateLocal7,
-
-        Airport1, Airport2, Airport3, Airport4,
-        Airport5, Airport6, Airport7, Airport8
-    )
-    SELECT
-        PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-
-        FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4,
-        FlightNumber5, FlightNumber6, FlightNumber7,
-
-        DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3,
-        DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6,
-        DepartureDateLocal7,
-
-        Airport1, Airport2, Airport3, Airport4,
-        Airport5, Airport6, Airport7, Airport8
-    FROM out_df
-""")
-
-        con.unregister("out_df")
-
-    offset += BATCH_SIZE
-    print(f"✅ Processed {offset} rows")
-# Calculate execution time
-end_time = time.time()
-execution_time = end_time - start_time
-
-# Convert to hours, minutes, seconds
-hours = int(execution_time // 3600)
-minutes = int((execution_time % 3600) // 60)
-seconds = int(execution_time % 60)
-print(f"⏰ End Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))}")
-print(
-    f"⏱️  Execution Time: {hours:02d} hours, {minutes:02d} minutes, {seconds:02d} seconds"
-)
-
-print("🎉 FINAL ETL COMPLETED SUCCESSFULLY")
+import duckdb
+import os
+from pathlib import Path
+import time
+
+# --------------------------------------------------
+# CONFIG
+# --------------------------------------------------
+DATABASE_DIR = Path(r"C:\DuckDB")
+DATABASE_NAME = "my_db.duckdb"
+DB_PATH = DATABASE_DIR / DATABASE_NAME
+
+SOURCE_TABLE = "TBO3_MASTER"
+TARGET_TABLE = "TBO3_MASTER_TARGET"
+
+VALID_YEAR_MIN = 1990
+VALID_YEAR_MAX = 2100
+
+THREADS = os.cpu_count() or 4  # all cores: window/regex work scales with threads
+MEMORY_LIMIT = "6GB"
+TEMP_DIR = "/tmp/duckdb_temp"
+CHECKPOINT_THRESHOLD = "1GB"
+
+# --------------------------------------------------
+# CONNECT
+# --------------------------------------------------
+con = duckdb.connect(DB_PATH)
+con.execute(f"SET threads TO {THREADS}")
+con.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
+con.execute("SET preserve_insertion_order = false")  # row order is not needed
+con.execute(f"SET temp_directory = '{TEMP_DIR}'")  # spill the big pivot to disk
+con.execute(f"SET checkpoint_threshold = '{CHECKPOINT_THRESHOLD}'")
+con.execute("SET enable_progress_bar = false")
+
+# --------------------------------------------------
+# RECREATE TARGET TABLE
+# --------------------------------------------------
+con.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
+
+con.execute(f"""
+CREATE TABLE {TARGET_TABLE} (
+    PaxName TEXT,
+    BookingRef TEXT,
+    ETicketNo TEXT,
+    ClientCode TEXT,
+    Airline TEXT,
+    JourneyType TEXT,
+
+    FlightNumber1 TEXT,
+    FlightNumber2 TEXT,
+    FlightNumber3 TEXT,
+    FlightNumber4 TEXT,
+    FlightNumber5 TEXT,
+    FlightNumber6 TEXT,
+    FlightNumber7 TEXT,
+
+    DepartureDateLocal1 DATE,
+    DepartureDateLocal2 DATE,
+    DepartureDateLocal3 DATE,
+    DepartureDateLocal4 DATE,
+    DepartureDateLocal5 DATE,
+    DepartureDateLocal6 DATE,
+    DepartureDateLocal7 DATE,
+
+    Airport1 TEXT,
+    Airport2 TEXT,
+    Airport3 TEXT,
+    Airport4 TEXT,
+    Airport5 TEXT,
+    Airport6 TEXT,
+    Airport7 TEXT,
+    Airport8 TEXT
+);
+""")
+
+
+# --------------------------------------------------
+# HELPER MACROS
+# --------------------------------------------------
+con.execute("""
+CREATE OR REPLACE MACRO is_rnk(flight) AS (
+    flight IS NOT NULL AND right(flight, 3) = '000'
+)
+""")
+
+con.execute("""
+CREATE OR REPLACE MACRO normalize_flight(flight) AS (
+    CASE
+        WHEN regexp_full_match(flight, '[A-Z]{2,3}[0-9]+')
+            THEN regexp_replace(flight, '^([A-Z]{2,3})0*([0-9])', '\\1\\2')
+        ELSE flight
+    END
+)
+""")
+
+con.execute(f"""
+CREATE OR REPLACE MACRO normalize_date(dt) AS (
+    CASE
+        WHEN YEAR(TRY_CAST(dt AS TIMESTAMP)) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+            THEN CAST(TRY_CAST(dt AS TIMESTAMP) AS DATE)
+    END
+)
+""")
+
+# --------------------------------------------------
+# PROCESS (single SQL pipeline)
+# --------------------------------------------------
+start_time = time.time()
+print(
+    f"⏰ Start Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}"
+)
+
+result = con.execute(f"""
+INSERT INTO {TARGET_TABLE} (
+    PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+
+    FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4,
+    FlightNumber5, FlightNumber6, FlightNumber7,
+
+    DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3,
+    DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6,
+    DepartureDateLocal7,
+
+    Airport1, Airport2, Airport3, Airport4,
+    Airport5, Airport6, Airport7, Airport8
+)
+WITH unpivoted AS (
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber1 AS fn, DepartureDateLocal1 AS dt, Airport1 AS ap, 1 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber2 AS fn, DepartureDateLocal2 AS dt, Airport2 AS ap, 2 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber3 AS fn, DepartureDateLocal3 AS dt, Airport3 AS ap, 3 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber4 AS fn, DepartureDateLocal4 AS dt, Airport4 AS ap, 4 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber5 AS fn, DepartureDateLocal5 AS dt, Airport5 AS ap, 5 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber6 AS fn, DepartureDateLocal6 AS dt, Airport6 AS ap, 6 AS slot
+    FROM {SOURCE_TABLE}
+    UNION ALL
+    SELECT rowid AS row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+           FlightNumber7 AS fn, DepartureDateLocal7 AS dt, Airport7 AS ap, 7 AS slot
+    FROM {SOURCE_TABLE}
+),
+-- 1️⃣ ROW-LEVEL DUPLICATE + RNK CLEAN (RAW DATA)
+raw_cleaned AS (
+    SELECT *, upper(trim(fn)) AS fn_clean
+    FROM unpivoted
+    WHERE fn <> '' AND dt IS NOT NULL
+      AND NOT is_rnk(upper(trim(fn)))
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY row_id, upper(trim(fn)), dt
+        ORDER BY slot
+    ) = 1
+),
+-- 2️⃣ NORMALIZE
+flights AS (
+    SELECT *,
+        normalize_flight(fn_clean) AS clean_flt,
+        normalize_date(dt) AS clean_dte
+    FROM raw_cleaned
+    WHERE normalize_flight(fn_clean) <> ''
+      AND normalize_date(dt) IS NOT NULL
+),
+-- 3️⃣ SPLIT ROUTES (> 1 day from the previous flight starts a new route)
+with_trip_id AS (
+    SELECT *,
+        SUM(
+            CASE
+                WHEN prev_dte IS NULL THEN 1
+                WHEN abs(clean_dte - prev_dte) > 1 THEN 1
+                ELSE 0
+            END
+        ) OVER (
+            PARTITION BY row_id
+            ORDER BY slot
+            ROWS UNBOUNDED PRECEDING
+        ) AS trip_id
+    FROM (
+        SELECT *,
+            LAG(clean_dte) OVER (PARTITION BY row_id ORDER BY slot) AS prev_dte
+        FROM flights
+    )
+),
+-- route-level safety duplicate
+compacted AS (
+    SELECT *
+    FROM with_trip_id
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY row_id, trip_id, clean_flt, clean_dte
+        ORDER BY slot
+    ) = 1
+),
+sequenced AS (
+    SELECT *,
+        ROW_NUMBER() OVER (PARTITION BY row_id, trip_id ORDER BY slot) AS seq_id
+    FROM compacted
+)
+-- 4️⃣ BUILD OUTPUT ROWS
+SELECT
+    ANY_VALUE(PaxName),
+    ANY_VALUE(BookingRef),
+    ANY_VALUE(ETicketNo),
+    ANY_VALUE(ClientCode),
+    ANY_VALUE(Airline),
+    ANY_VALUE(JourneyType),
+
+    MAX(CASE WHEN seq_id = 1 THEN clean_flt END) AS FlightNumber1,
+    MAX(CASE WHEN seq_id = 2 THEN clean_flt END) AS FlightNumber2,
+    MAX(CASE WHEN seq_id = 3 THEN clean_flt END) AS FlightNumber3,
+    MAX(CASE WHEN seq_id = 4 THEN clean_flt END) AS FlightNumber4,
+    MAX(CASE WHEN seq_id = 5 THEN clean_flt END) AS FlightNumber5,
+    MAX(CASE WHEN seq_id = 6 THEN clean_flt END) AS FlightNumber6,
+    MAX(CASE WHEN seq_id = 7 THEN clean_flt END) AS FlightNumber7,
+
+    MAX(CASE WHEN seq_id = 1 THEN clean_dte END) AS DepartureDateLocal1,
+    MAX(CASE WHEN seq_id = 2 THEN clean_dte END) AS DepartureDateLocal2,
+    MAX(CASE WHEN seq_id = 3 THEN clean_dte END) AS DepartureDateLocal3,
+    MAX(CASE WHEN seq_id = 4 THEN clean_dte END) AS DepartureDateLocal4,
+    MAX(CASE WHEN seq_id = 5 THEN clean_dte END) AS DepartureDateLocal5,
+    MAX(CASE WHEN seq_id = 6 THEN clean_dte END) AS DepartureDateLocal6,
+    MAX(CASE WHEN seq_id = 7 THEN clean_dte END) AS DepartureDateLocal7,
+
+    MAX(CASE WHEN seq_id = 1 THEN ap END) AS Airport1,
+    MAX(CASE WHEN seq_id = 2 THEN ap END) AS Airport2,
+    MAX(CASE WHEN seq_id = 3 THEN ap END) AS Airport3,
+    MAX(CASE WHEN seq_id = 4 THEN ap END) AS Airport4,
+    MAX(CASE WHEN seq_id = 5 THEN ap END) AS Airport5,
+    MAX(CASE WHEN seq_id = 6 THEN ap END) AS Airport6,
+    MAX(CASE WHEN seq_id = 7 THEN ap END) AS Airport7,
+    NULL AS Airport8
+FROM sequenced
+GROUP BY row_id, trip_id
+""").fetchone()
+
+print(f"✅ Inserted {result[0] if result else 0} rows")
+# Calculate execution time
+end_time = time.time()
+execution_time = end_time - start_time
+
+# Convert to hours, minutes, seconds
+hours = int(execution_time // 3600)
+minutes = int((execution_time % 3600) // 60)
+seconds = int(execution_time % 60)
+print(f"⏰ End Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end_time))}")
+print(
+    f"⏱️  Execution Time: {hours:02d} hours, {minutes:02d} minutes, {seconds:02d} seconds"
+)
+
+print("🎉 FINAL ETL COMPLETED SUCCESSFULLY")
@@ -2,8 +2,8 @@ from pathlib import Path
 import duckdb
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import re
-from typing import List, Tuple, Set
 import time
 
 # --------------------------------------------------
@@ -22,7 +22,7 @@ VALID_YEAR_MIN = 1990
 VALID_YEAR_MAX = 2100
 
 # Pre-compile regex patterns for maximum speed
-RNK_PATTERN = re.compile(r"^[A-Z]{2,3}0+$")
+RNK_PATTERN = re.compile(r"^\s*[A-Z]{2,3}0+\s*$", re.IGNORECASE)
 FLIGHT_NORMALIZE_PATTERN = re.compile(r"^([A-Z]{2,3})(0*)(\d+)$")
 
 # Pre-compute column lists for vectorization
@@ -37,6 +37,9 @@ con = duckdb.connect(DB_PATH)
 con.execute("PRAGMA threads = 4;")  # Adjust based on your CPU cores
 con.execute("PRAGMA memory_limit = '8GB';")  # For 12GB RAM systems
 con.execute("PRAGMA enable_progress_bar = false;")  # Disable for batch processing
+con.execute("PRAGMA preserve_insertion_order = false;")  # Batch order is not needed
+con.execute("PRAGMA temp_directory = '/tmp/duckdb_temp';")  # Spill location for sorts
+con.execute("PRAGMA checkpoint_threshold = '1GB';")  # Fewer checkpoints while inserting
 
 # --------------------------------------------------
 # RECREATE TARGET TABLE
@@ -88,11 +91,8 @@ def is_rnk_vectorized(flights_series):
     if flights_series.dtype != "object":
         flights_series = flights_series.astype(str)
 
-    # Convert to uppercase and strip
-    upper_flights = flights_series.str.upper().str.strip()
-
-    # Use pandas string methods for fast matching
-    return upper_flights.str.match(RNK_PATTERN, na=False)
+    # Case and surrounding whitespace are handled by the pattern: one pass
+    return flights_series.str.match(RNK_PATTERN, na=False)
 
 
 def normalize_flight_numbers_vectorized(flights_series):
@@ -124,8 +124,9 @@ def normalize_flight_numbers_vectorized(flights_series):
 
 def normalize_dates_vectorized(dates_series):
     """Vectorized date normalization."""
-    # Convert to datetime with errors='coerce'
-    dt_series = pd.to_datetime(dates_series, errors="coerce")
+    # Convert to datetime with errors='coerce'; "mixed" infers the format per
+    # value, as the old per-row call did, instead of from the first one
+    dt_series = pd.to_datetime(dates_series, errors="coerce", format="mixed")
 
     # Filter valid years
     valid_mask = (dt_series.dt.year >= VALID_YEAR_MIN) & (
@@ -136,96 +137,111 @@ def normalize_dates_vectorized(dates_series):
     return dt_series
 
 
-def process_single_row_optimized(row_series, base_fields):
-    """Optimized single row processing using vectorized operations."""
-    # Extract all flight data at once using vectorized operations
-    flight_nums = row_series[FLIGHT_COLS].values
-    dates = row_series[DATE_COLS].values
-    airports = row_series[AIRPORT_COLS[:7]].values  # First 7 airports for flights
-
-    # Normalize flights and dates vectorized
-    normalized_flights = normalize_flight_numbers_vectorized(pd.Series(flight_nums))
-    normalized_dates = normalize_dates_vectorized(pd.Series(dates))
+def split_routes_vectorized(flights, dates, valid):
+    """Vectorized route splitting over (rows x 7) leg matrices.
 
-    # Create flights list with vectorized filtering
-    flights = []
-    for i in range(len(flight_nums)):
-        fn = (
-            normalized_flights.iloc[i] if pd.notna(normalized_flights.iloc[i]) else None
+    Returns the route number of every leg and a mask of legs that go into
+    the output row of their route.
+    """
+    n_rows, n_legs = flights.shape
+    has_date = ~np.isnat(dates)
+    one_day = np.timedelta64(1, "D")
+
+    route = np.full((n_rows, n_legs), -1, dtype=np.int64)
+    starts = np.zeros((n_rows, n_legs), dtype=bool)
+    current = np.full(n_rows, -1, dtype=np.int64)
+    prev_fn = np.full(n_rows, None, dtype=object)
+    prev_dt = np.full(n_rows, np.datetime64("NaT"), dtype=dates.dtype)
+    has_prev = np.zeros(n_rows, dtype=bool)
+
+    for j in range(n_legs):
+        fn, dt, ok = flights[:, j], dates[:, j], valid[:, j]
+        same_dt = (dt == prev_dt) | (np.isnat(dt) & np.isnat(prev_dt))
+        repeat = has_prev & (fn == prev_fn) & same_dt
+
+        # Same route while the day difference (floored) stays within one day
+        with np.errstate(invalid="ignore"):
+            days = np.floor((dt - prev_dt) / one_day)
+        near = has_date[:, j] & ~np.isnat(prev_dt) & (np.abs(days) <= 1)
+
+        new_route = ok & ~repeat & ~(has_prev & near)
+        current = current + new_route
+        starts[:, j] = new_route
+        route[:, j] = np.where(ok & ~repeat, current, -1)
+
+        prev_fn = np.where(ok, fn, prev_fn)
+        prev_dt = np.where(ok, dt, prev_dt)
+        has_prev |= ok
+
+    # Route-level dedup: first (flight, date) per route, dated legs only
+    keep = (route >= 0) & has_date
+    for j in range(1, n_legs):
+        for k in range(j):
+            keep[:, j] &= ~(
+                keep[:, k]
+                & (route[:, k] == route[:, j])
+                & (flights[:, k] == flights[:, j])
+                & (dates[:, k] == dates[:, j])
+            )
+    return route, starts, keep
+
+
+def process_batch_vectorized(df, base_field_names):
+    """Normalize a whole batch column-wise and build its output rows."""
+    n_rows = len(df)
+    n_legs = len(FLIGHT_COLS)
+
+    # One normalization call per column instead of per row
+    flights = np.empty((n_rows, n_legs), dtype=object)
+    dates = np.empty((n_rows, n_legs), dtype="datetime64[ns]")
+    valid = np.zeros((n_rows, n_legs), dtype=bool)
+    for j, (fc, dc) in enumerate(zip(FLIGHT_COLS, DATE_COLS)):
+        fn = normalize_flight_numbers_vectorized(df[fc].astype(object))
+        fn = fn.astype(object).where(fn.notna(), None)
+        flights[:, j] = fn.to_numpy()
+        dates[:, j] = normalize_dates_vectorized(df[dc]).to_numpy(
+            dtype="datetime64[ns]"
         )
-        dt = normalized_dates.iloc[i] if pd.notna(normalized_dates.iloc[i]) else None
-        ap = airports[i] if i < len(airports) and pd.notna(airports[i]) else None
-
-        if fn and not RNK_PATTERN.fullmatch(str(fn).upper()):
-            flights.append((fn, dt, ap))
-
-    # Split routes with optimized algorithm
-    routes = []
-    current_route = []
-
-    for fn, dt, ap in flights:
-        if not current_route:
-            current_route.append((fn, dt, ap))
-            continue
-
-        prev_fn, prev_dt, _ = current_route[-1]
-
-        # Quick checks to avoid expensive operations
-        if fn == prev_fn and dt == prev_dt:
-            continue
-
-        if dt is not None and prev_dt is not None:
-            day_diff = abs((dt - prev_dt).days)
-            if day_diff <= 1:
-                current_route.append((fn, dt, ap))
-            else:
-                routes.append(current_route)
-                current_route = [(fn, dt, ap)]
-        else:
-            routes.append(current_route)
-            current_route = [(fn, dt, ap)]
-
-    if current_route:
-        routes.append(current_route)
-
-    # Build output rows
-    out_rows = []
-    for route in routes:
-        new_row = base_fields.copy()
-
-        # Reset flight/date/airport columns
-        for i in range(1, 8):
-            new_row[f"FlightNumber{i}"] = None
-            new_row[f"DepartureDateLocal{i}"] = None
-            new_row[f"Airport{i}"] = None
-        new_row["Airport8"] = None
-
-        # Remove duplicates while preserving order
-        seen: Set[Tuple] = set()
-        compacted = []
-
-        for fn, dt, ap in route:
-            if fn is None or dt is None:
-                continue
-
-            key = (fn, dt)
-            if key in seen:
-                continue
-
-            seen.add(key)
-            compacted.append((fn, dt, ap))
-
-        # Write compacted route to output row
-        for i, (fn, dt, ap) in enumerate(compacted, start=1):
-            if i > 7:
-                break
-            new_row[f"FlightNumber{i}"] = fn
-            new_row[f"DepartureDateLocal{i}"] = dt
-            new_row[f"Airport{i}"] = ap
-
-        out_rows.append(new_row)
+        valid[:, j] = (fn.notna() & (fn != "") & ~is_rnk_vectorized(fn)).to_numpy()
+
+    airports = df[AIRPORT_COLS[:n_legs]].astype(object)
+    airports = airports.where(airports.notna(), None).to_numpy()
+
+    route, starts, keep = split_routes_vectorized(flights, dates, valid)
+
+    # Global output row per (source row, route); slot order within each route
+    n_routes = starts.sum(axis=1)
+    first_out = np.cumsum(n_routes) - n_routes
+    n_out = int(n_routes.sum())
+
+    rows, cols = np.nonzero(keep)  # row-major, so each route's legs are adjacent
+    out_idx = first_out[rows] + route[rows, cols]
+    idx = np.arange(len(out_idx))
+    group_start = np.r_[True, out_idx[1:] != out_idx[:-1]]
+    pos = idx - np.maximum.accumulate(np.where(group_start, idx, 0))
+
+    out_fn = np.full((n_out, n_legs), None, dtype=object)
+    out_dt = np.full((n_out, n_legs), np.datetime64("NaT"), dtype="datetime64[ns]")
+    out_ap = np.full((n_out, len(AIRPORT_COLS)), None, dtype=object)
+    out_fn[out_idx, pos] = flights[rows, cols]
+    out_dt[out_idx, pos] = dates[rows, cols]
+    out_ap[out_idx, pos] = airports[rows, cols]
+
+    # Arrow columns straight from the arrays, no intermediate DataFrame
+    out_src = np.repeat(np.arange(n_rows), n_routes)
+    base = pa.Table.from_pandas(df[base_field_names], preserve_index=False)
+    columns = base.take(out_src).columns
+    columns += [pa.array(out_fn[:, j], type=pa.string()) for j in range(n_legs)]
+    columns += [
+        pa.array(out_dt[:, j], from_pandas=True).cast(pa.date32())
+        for j in range(n_legs)
+    ]
+    columns += [
+        pa.array(out_ap[:, j], from_pandas=True) for j in range(len(AIRPORT_COLS))
+    ]
+    names = base_field_names + FLIGHT_COLS + DATE_COLS + AIRPORT_COLS
 
-    return out_rows
+    return pa.Table.from_arrays(columns, names=names)
 
 
 # --------------------------------------------------
@@ -233,6 +249,7 @@ def process_single_row_optimized(row_series, base_fields):
 # --------------------------------------------------
 offset = 0
 total_processed = 0
+total_rows = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 print("🚀 Starting optimized ETL process...")
 start_time = time.time()
@@ -240,24 +257,23 @@ print(
     f"⏰ Start Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}"
 )
 
-while True:
-    # Fetch batch with optimized query
+while offset < total_rows:
+    # rowid range instead of OFFSET, so each batch scans only its own rows
     query = f"""
         SELECT *
         FROM {SOURCE_TABLE}
-        LIMIT {BATCH_SIZE} OFFSET {offset}
+        WHERE rowid >= {offset}
+          AND rowid < {offset + BATCH_SIZE}
     """
 
     df = con.execute(query).df()
 
     if df.empty:
-        break
+        offset += BATCH_SIZE
+        continue
 
     print(f"📦 Processing batch starting at {offset}, size: {len(df)}")
 
-    # Process batch more efficiently
-    all_out_rows = []
-
     # Get base field names once
     base_field_names = [
         "PaxName",
@@ -268,25 +284,29 @@ while True:
         "JourneyType",
     ]
 
-    for idx, row in df.iterrows():
-        base_fields = {field: row[field] for field in base_field_names}
-        batch_rows = process_single_row_optimized(row, base_fields)
-        all_out_rows.extend(batch_rows)
-
-    # Convert to DataFrame once
-    if all_out_rows:
-        out_df = pd.DataFrame(all_out_rows)
+    # Whole batch at once: columns are normalized together, routes split
+    # with array ops
+    out_arrow = process_batch_vectorized(df, base_field_names)
 
-        # Use bulk insert for maximum performance
+    if out_arrow.num_rows:
+        # Arrow scan: DuckDB reads the columns without per-cell conversion
         con.execute(f"""
             INSERT INTO {TARGET_TABLE}
-            SELECT * FROM out_df
+            SELECT * FROM out_arrow
         """)
 
     offset += BATCH_SIZE
-    total_processed += len(all_out_rows)
+    total_processed += out_arrow.num_rows
     print(f"✅ Processed {offset} source rows, generated {total_processed} output rows")
 
+# Rewrite the target in date order so row-group min/max prunes date filters
+print("🗂️ Clustering target table by DepartureDateLocal1")
+con.execute(f"""
+    CREATE OR REPLACE TABLE {TARGET_TABLE} AS
+    SELECT * FROM {TARGET_TABLE}
+    ORDER BY DepartureDateLocal1
+""")
+
 # Calculate execution time
 end_time = time.time()
 execution_time = end_time - start_time
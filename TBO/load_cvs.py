@@ -6,6 +6,7 @@ import duckdb
 
 import glob
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 # ==================================================
 # CONFIG
@@ -37,34 +38,49 @@ def connect_db() -> duckdb.DuckDBPyConnection:
     return con
 
 
+def csv_table_name(csv_path: str) -> str:
+    filename = os.path.basename(csv_path)
+    # Sanitize table name: allow only letters, digits, underscores
+    table_name = re.sub(r"[^a-zA-Z0-9_]", "_", os.path.splitext(filename)[0])
+
+    # Ensure table name doesn't start with a digit (prepend underscore if needed)
+    if table_name[0].isdigit():
+        table_name = f"_{table_name}"
+    return table_name
+
+
+def load_cvs_file(con, csv_path: str) -> None:
+    filename = os.path.basename(csv_path)
+    table_name = csv_table_name(csv_path)
+
+    # Each worker gets its own cursor; statements on one cursor run serially
+    cur = con.cursor()
+    try:
+        # Use read_csv_auto() — DuckDB infers header and types automatically
+        cur.execute(
+            f"""
+            CREATE TABLE "{table_name}" AS
+            SELECT * FROM read_csv_auto(?)
+        """,
+            [csv_path],
+        )
+        print(f" ➤ Created table: `{table_name}` from `{filename}`")
+    except Exception as e:
+        print(f"   ❌ Failed `{filename}`: {e}")
+    finally:
+        cur.close()
+
+
 def load_cvs_files(con) -> None:
     csv_files = glob.glob(os.path.join(CVS_DIR, "*.csv"))
     if not csv_files:
         print("❌ No CSV files found.")
-    else:
-        print(f"📁 Found {len(csv_files)} CSV file(s). Creating tables...\n")
-    for csv_path in csv_files:
-        filename = os.path.basename(csv_path)
-        # Sanitize table name: allow only letters, digits, underscores
-        table_name = re.sub(r"[^a-zA-Z0-9_]", "_", os.path.splitext(filename)[0])
-
-        # Ensure table name doesn't start with a digit (prepend underscore if needed)
-        if table_name[0].isdigit():
-            table_name = f"_{table_name}"
-
-        print(f" ➤ Creating table: `{table_name}` from `{filename}`")
-
-        try:
-            # Use read_csv_auto() — DuckDB infers header and types automatically
-            con.execute(f"""
-                CREATE TABLE "{table_name}" AS
-                SELECT * FROM read_csv_auto('{csv_path}')
-            """)
-            # Optional: report schema
-            schema = con.execute(f'DESCRIBE "{table_name}"').fetchdf()
-            print(f"   Columns: {list(schema['column_name'])}")
-        except Exception as e:
-            print(f"   ❌ Failed: {e}")
+        return
+    print(f"📁 Found {len(csv_files)} CSV file(s). Creating tables...\n")
+
+    # One table per file, files loaded concurrently
+    with ThreadPoolExecutor(max_workers=THREADS) as ex:
+        list(ex.map(lambda p: load_cvs_file(con, p), csv_files))
 
 
 def main() -> None:
@@ -3,6 +3,7 @@ from pathlib import Path
 
 import duckdb
 import pandas as pd
+import pyarrow as pa
 
 
 # ==================================================
@@ -36,7 +37,7 @@ def connect_db() -> duckdb.DuckDBPyConnection:
 
 
 def load_excel_files(con) -> None:
-    dfs = []
+    tables = []
 
     for file in sorted(EXCEL_DIR.glob("*.xlsx")):
         log(f"⏰ Loading {file.name}")
@@ -51,27 +52,30 @@ def load_excel_files(con) -> None:
             dtype=str,
         )
 
-        for sheet_name, df in sheets.items():
+        # pop each sheet so its object-dtype frame is freed once converted
+        for sheet_name in list(sheets):
+            df = sheets.pop(sheet_name)
             if df.empty:
                 continue
 
             df["source_file"] = file.name
             df["source_sheet"] = sheet_name
-            dfs.append(df)
+            tables.append(pa.Table.from_pandas(df, preserve_index=False))
 
-    if not dfs:
+    if not tables:
         raise RuntimeError("No Excel data found")
 
-    # Concatenate all sheets
-    final_df = pd.concat(dfs, ignore_index=True)
+    # Concatenate all sheets: Arrow appends chunks instead of copying every
+    # cell into one big object array; columns missing in a sheet become NULL
+    final_arrow = pa.concat_tables(tables, promote_options="default")
 
     # Recreate table
     con.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
-    con.register("final_df", final_df)
+    con.register("final_arrow", final_arrow)
 
     con.execute(f"""
         CREATE TABLE {TABLE_NAME} AS
-        SELECT * FROM final_df
+        SELECT * FROM final_arrow
     """)
 
 
@@ -11,8 +11,6 @@ DB_PATH = DATABASE_DIR / DATABASE_NAME
 
 SOURCE_TABLE = "TBO3_MASTER"
 TARGET_TABLE = "TBO3_MASTER_TARGET"
-TEMP_TABLE = "TBO3_MASTER_TEMP"
-BATCH_SIZE = 500_000  # Process 500k records at a time
 
 VALID_YEAR_MIN = 1990
 VALID_YEAR_MAX = 2100
@@ -26,90 +24,13 @@ con = duckdb.connect(DB_PATH)
 con.execute("SET threads TO 4")  # Reduced threads
 con.execute("SET memory_limit = '6GB'")  # Leave some headroom
 con.execute("SET preserve_insertion_order = false")  # Save memory
+con.execute("SET temp_directory = '/tmp/duckdb_temp'")  # Spill for the one-shot CTAS
 
 start_time = time.time()
 print(
     f"⏰ Start Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}"
 )
 
-# --------------------------------------------------
-# RECREATE TARGET TABLE
-# --------------------------------------------------
-con.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
-
-con.execute(f"""
-CREATE TABLE {TARGET_TABLE} (
-    PaxName TEXT,
-    BookingRef TEXT,
-    ETicketNo TEXT,
-    ClientCode TEXT,
-    Airline TEXT,
-    JourneyType TEXT,
-
-    FlightNumber1 TEXT,
-    FlightNumber2 TEXT,
-    FlightNumber3 TEXT,
-    FlightNumber4 TEXT,
-    FlightNumber5 TEXT,
-    FlightNumber6 TEXT,
-    FlightNumber7 TEXT,
-
-    DepartureDateLocal1 TIMESTAMP,
-    DepartureDateLocal2 TIMESTAMP,
-    DepartureDateLocal3 TIMESTAMP,
-    DepartureDateLocal4 TIMESTAMP,
-    DepartureDateLocal5 TIMESTAMP,
-    DepartureDateLocal6 TIMESTAMP,
-    DepartureDateLocal7 TIMESTAMP,
-
-    Airport1 TEXT,
-    Airport2 TEXT,
-    Airport3 TEXT,
-    Airport4 TEXT,
-    Airport5 TEXT,
-    Airport6 TEXT,
-    Airport7 TEXT,
-    Airport8 TEXT
-);
-""")
-# --------------------------------------------------
-# CREATE HELPER MACROS IN DUCKDB
-# --------------------------------------------------
-
-con.execute("""
-CREATE OR REPLACE MACRO is_rnk(flight) AS (
-    CASE
-        WHEN flight IS NULL THEN FALSE
-        WHEN regexp_matches(UPPER(TRIM(flight)), '^[A-Z]{2,3}0+$') THEN TRUE
-        ELSE FALSE
-    END
-)
-""")
-
-con.execute("""
-CREATE OR REPLACE MACRO normalize_flight(flight) AS (
-    CASE
-        WHEN flight IS NULL THEN NULL
-        WHEN regexp_matches(UPPER(TRIM(flight)), '^([A-Z]{2,3})(0*)([0-9]+)$') THEN
-            regexp_replace(UPPER(TRIM(flight)), '^([A-Z]{2,3})0+([0-9]+)$', '\\1\\2')
-        ELSE UPPER(TRIM(flight))
-    END
-)
-""")
-
-con.execute(f"""
-CREATE OR REPLACE MACRO normalize_date(dt) AS (
-    CASE
-        WHEN dt IS NULL THEN NULL
-        WHEN TRY_CAST(dt AS TIMESTAMP) IS NULL THEN NULL
-        WHEN YEAR(TRY_CAST(dt AS TIMESTAMP)) < {VALID_YEAR_MIN}
-             OR YEAR(TRY_CAST(dt AS TIMESTAMP)) > {VALID_YEAR_MAX} THEN NULL
-        ELSE TRY_CAST(dt AS TIMESTAMP)
-    END
-)
-""")
-print("✅ Helper macros created")
-
 # --------------------------------------------------
 # GET TOTAL COUNT
 # --------------------------------------------------
@@ -117,119 +38,108 @@ total_rows = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 print(f"📊 Total source records: {total_rows:,}")
 
 # --------------------------------------------------
-# PROCESS IN BATCHES
+# BUILD TARGET IN ONE CTAS
 # --------------------------------------------------
-offset = 0
-batch_num = 0
-total_inserted = 0
-
-while offset < total_rows:
-    batch_num += 1
-    print(
-        f"🔄 Processing batch {batch_num} (rows {offset:,} to {offset + BATCH_SIZE:,})..."
-    )
+# One pipelined scan -> transform -> write instead of an INSERT per batch;
+# large inputs spill to temp_directory
+print(f"🔄 Creating {TARGET_TABLE}...")
 
-    # Create temp table for this batch
-    con.execute(f"DROP TABLE IF EXISTS {TEMP_TABLE}")
-
-    con.execute(f"""
-    CREATE TABLE {TEMP_TABLE} AS
-    SELECT * FROM {SOURCE_TABLE}
-    LIMIT {BATCH_SIZE} OFFSET {offset}
-    """)
-    # Process this batch
-    con.execute(f"""
-    INSERT INTO {TARGET_TABLE}
+con.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
+result = con.execute(f"""
+    CREATE TABLE {TARGET_TABLE} AS
     WITH unpivoted AS (
+        -- one scan of the source instead of seven UNION ALL arms
         SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber1 as FlightNumber, DepartureDateLocal1 as DepartureDate,
-               Airport1 as DepAir, Airport2 as ArrAir, 1 as OriginalSeq
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber1, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber2, DepartureDateLocal2, Airport2, Airport3, 2
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber2, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber3, DepartureDateLocal3, Airport3, Airport4, 3
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber3, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber4, DepartureDateLocal4, Airport4, Airport5, 4
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber4, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber5, DepartureDateLocal5, Airport5, Airport6, 5
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber5, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber6, DepartureDateLocal6, Airport6, Airport7, 6
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber6, '')), '') != ''
-        UNION ALL
-        SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-               FlightNumber7, DepartureDateLocal7, Airport7, Airport8, 7
-        FROM {TEMP_TABLE} WHERE NULLIF(TRIM(COALESCE(FlightNumber7, '')), '') != ''
+               FlightNumber, DepartureDate, DepAir, ArrAir,
+               CAST(OriginalSeq AS INTEGER) AS OriginalSeq
+        FROM {SOURCE_TABLE}
+        UNPIVOT INCLUDE NULLS (
+            (FlightNumber, DepartureDate, DepAir, ArrAir) FOR OriginalSeq IN (
+                (FlightNumber1, DepartureDateLocal1, Airport1, Airport2) AS '1',
+                (FlightNumber2, DepartureDateLocal2, Airport2, Airport3) AS '2',
+                (FlightNumber3, DepartureDateLocal3, Airport3, Airport4) AS '3',
+                (FlightNumber4, DepartureDateLocal4, Airport4, Airport5) AS '4',
+                (FlightNumber5, DepartureDateLocal5, Airport5, Airport6) AS '5',
+                (FlightNumber6, DepartureDateLocal6, Airport6, Airport7) AS '6',
+                (FlightNumber7, DepartureDateLocal7, Airport7, Airport8) AS '7'
+            )
+        )
+        WHERE TRIM(FlightNumber) <> ''
     ),
+    -- trim/upper and TRY_CAST once per leg, shared by the checks below
+    prepared AS (
+        SELECT *,
+            UPPER(TRIM(FlightNumber)) AS flt,
+            TRY_CAST(DepartureDate AS TIMESTAMP) AS dte
+        FROM unpivoted
+    ),
+    -- normalized in place; DuckDB lets WHERE reuse the select aliases
     cleaned AS (
         SELECT
             PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-            normalize_flight(FlightNumber) AS clean_flt,
-            normalize_date(DepartureDate) AS clean_dte,
+            CASE
+                WHEN regexp_matches(flt, '^[A-Z]{{2,3}}0+$') THEN NULL
+                ELSE regexp_replace(flt, '^([A-Z]{{2,3}})0+([0-9]+)$', '\\1\\2')
+            END AS clean_flt,
+            CASE
+                WHEN YEAR(dte) BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX} THEN dte
+            END AS clean_dte,
             DepAir, ArrAir, OriginalSeq
-        FROM unpivoted
-        WHERE normalize_flight(FlightNumber) IS NOT NULL
-          AND normalize_date(DepartureDate) IS NOT NULL
-          AND NOT is_rnk(FlightNumber)
+        FROM prepared
+        WHERE clean_flt IS NOT NULL
+          AND clean_dte IS NOT NULL
     ),
     -- 🔹 STEP 1: Deduplicate by EXACT timestamp
-    deduped AS (
-        SELECT *,
-            ROW_NUMBER() OVER (
-                PARTITION BY
-                    BookingRef,
-                    PaxName,
-                    clean_dte
-                ORDER BY OriginalSeq
-            ) AS rn_timestamp
-        FROM cleaned
-    ),
+    -- hash aggregate keeping the first leg per date; arg_min_null (unlike
+    -- arg_min) keeps that leg's NULLs instead of skipping to another leg
     kept_after_dedup AS (
-        SELECT * FROM deduped WHERE rn_timestamp = 1
+        SELECT
+            PaxName, BookingRef,
+            arg_min_null(ETicketNo, OriginalSeq) AS ETicketNo,
+            arg_min_null(ClientCode, OriginalSeq) AS ClientCode,
+            arg_min_null(Airline, OriginalSeq) AS Airline,
+            arg_min_null(JourneyType, OriginalSeq) AS JourneyType,
+            arg_min_null(clean_flt, OriginalSeq) AS clean_flt,
+            clean_dte,
+            arg_min_null(DepAir, OriginalSeq) AS DepAir,
+            arg_min_null(ArrAir, OriginalSeq) AS ArrAir,
+            MIN(OriginalSeq) AS OriginalSeq
+        FROM cleaned
+        GROUP BY BookingRef, PaxName, clean_dte
     ),
     -- 🔹 STEP 2: Order remaining legs and detect trip breaks (>36h gap)
+    -- LAG and pos share one window spec, so DuckDB sorts each partition once.
+    -- clean_dte is unique per partition after the dedup, so it breaks
+    -- OriginalSeq ties: both windows below see the same total order, and
+    -- pos - trip_start stays a dense 0..n-1 per trip
     with_prev AS (
         SELECT *,
-            LAG(clean_dte) OVER (
-                PARTITION BY BookingRef,
-                PaxName
-                ORDER BY OriginalSeq
-            ) AS prev_dte
+            LAG(clean_dte) OVER w AS prev_dte,
+            ROW_NUMBER() OVER w AS pos
         FROM kept_after_dedup
+        WINDOW w AS (PARTITION BY BookingRef, PaxName ORDER BY OriginalSeq, clean_dte)
     ),
     with_trip_id AS (
         SELECT *,
-            SUM(
-                CASE
-                    WHEN prev_dte IS NULL THEN 1
-                    WHEN EXTRACT(EPOCH FROM (clean_dte - prev_dte)) > 36 * 3600 THEN 1
-                    ELSE 0
-                END
-            ) OVER (
-                PARTITION BY BookingRef,
-                PaxName
-                ORDER BY OriginalSeq
-                ROWS UNBOUNDED PRECEDING
-            ) AS trip_id
-        FROM with_prev
+            SUM(CASE WHEN is_break THEN 1 ELSE 0 END) OVER w AS trip_id,
+            -- position of the leg that opened the current trip
+            MAX(CASE WHEN is_break THEN pos END) OVER w AS trip_start
+        FROM (
+            SELECT *,
+                -- 36h gap as an int64 microsecond diff (cheaper than + INTERVAL)
+                prev_dte IS NULL
+                    OR epoch_us(clean_dte) - epoch_us(prev_dte) > 129600000000 AS is_break
+            FROM with_prev
+        )
+        WINDOW w AS (
+            PARTITION BY BookingRef, PaxName
+            ORDER BY OriginalSeq, clean_dte
+            ROWS UNBOUNDED PRECEDING
+        )
     ),
-    -- 🔹 STEP 3: Sequence within each trip
+    -- 🔹 STEP 3: Sequence within each trip (no extra window sort)
     sequenced AS (
-        SELECT *,
-            ROW_NUMBER() OVER (
-                PARTITION BY BookingRef,
-                PaxName, trip_id
-                ORDER BY OriginalSeq
-            ) AS seq_id
+        SELECT *, pos - trip_start + 1 AS seq_id
         FROM with_trip_id
     ),
     -- 🔹 STEP 4: Pivot per trip
@@ -268,29 +178,25 @@ while offset < total_rows:
         FROM sequenced
         GROUP BY PaxName, BookingRef, trip_id
     )
+    -- CTAS takes its schema from this SELECT: pin the source-typed columns to TEXT
     SELECT
-        PaxName, BookingRef, NULL AS ETicketNo, ClientCode, Airline, JourneyType,
+        PaxName::TEXT AS PaxName, BookingRef::TEXT AS BookingRef,
+        NULL::TEXT AS ETicketNo, ClientCode::TEXT AS ClientCode,
+        Airline::TEXT AS Airline, JourneyType::TEXT AS JourneyType,
         FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4,
         FlightNumber5, FlightNumber6, FlightNumber7,
         DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3,
         DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6,
         DepartureDateLocal7,
-        Airport1, Airport2, Airport3, Airport4, Airport5, Airport6, Airport7, Airport8
+        Airport1::TEXT AS Airport1, Airport2::TEXT AS Airport2,
+        Airport3::TEXT AS Airport3, Airport4::TEXT AS Airport4,
+        Airport5::TEXT AS Airport5, Airport6::TEXT AS Airport6,
+        Airport7::TEXT AS Airport7, Airport8::TEXT AS Airport8
     FROM pivoted
-    """)
-    result = con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()
-    batch_count = result[0] if result is not None else 0
-    rows_added = batch_count - total_inserted
-    total_inserted = batch_count
-
-    print(
-        f"✅ Batch {batch_num} complete. Added {rows_added:,} rows. Total: {total_inserted:,}"
-    )
-
-    offset += BATCH_SIZE
-
-# Cleanup
-con.execute(f"DROP TABLE IF EXISTS {TEMP_TABLE}")
+""").fetchone()
+# CTAS reports its own row count
+total_inserted = result[0] if result is not None else 0
+print(f"✅ {TARGET_TABLE} created with {total_inserted:,} rows")
 
 # Calculate execution time
 elapsed_time = time.time() - start_time
@@ -1,8 +1,7 @@
 import duckdb
-import pandas as pd
+import os
 import time
 from pathlib import Path
-from datetime import timedelta
 
 # ==================================================
 # CONFIG - Easy to change settings
@@ -14,12 +13,10 @@ DB_PATH = DATABASE_DIR / DATABASE_NAME
 SOURCE_TABLE = "TBO3_MASTER"
 TARGET_TABLE = "TBO3_MASTER_TARGET"
 
-BATCH_SIZE = 500_000  # Increased batch size for fewer iterations
-
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
 
-THREADS = 4
+THREADS = os.cpu_count() or 4  # all cores: window/regex work scales with threads
 MEMORY_LIMIT = "8GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 
@@ -147,129 +144,132 @@ def create_clean_view(con):
 
 
 # ==================================================
-# ROUTE SPLITTING LOGIC
+# ROUTE SPLITTING (SQL)
 # ==================================================
-def is_same_route(date1, date2):
-    """Check if two flights are part of the same journey (within 36 hours)"""
-    if date1 is None or date2 is None:
-        return False
-    return abs(date2 - date1) <= timedelta(hours=36)
-    # return abs((date2 - date1).days) <= 1
-
-
-def split_into_routes(flights):
-    """
-    Split a list of flights into separate routes.
-    Flights are in the same route if they're within 36 hours of each other.
-    """
-    if not flights:
-        return []
-
-    routes = []
-    current_route = []
-
-    for flight in flights:
-        if not current_route:
-            # First flight starts a new route
-            current_route.append(flight)
-        elif is_same_route(current_route[-1][1], flight[1]):
-            # Flight is within 36h of previous - add to current route
-            current_route.append(flight)
-        else:
-            # Flight is more than 36h later - start new route
-            routes.append(current_route)
-            current_route = [flight]
-
-    # Don't forget the last route
-    if current_route:
-        routes.append(current_route)
-
-    return routes
-
-
-def process_batch(con, offset):
+def insert_routes(con):
     """
-    Process one batch of rows:
-    1. Get cleaned data from database
-    2. Split flights into separate routes
-    3. Insert results into target table
+    Build all target rows in one streamed INSERT (no LIMIT/OFFSET batches):
+    1. Unpivot the 7 legs of every source row
+    2. Drop unusable legs and repeated dates within a row
+    3. Split each row's legs into routes (>36h from previous leg = new route)
+    4. Pivot one output row per route into the target table
     """
-    # Step 1: Get data from database
-    df = con.execute(f"""
-        SELECT *
+    result = con.execute(f"""
+    INSERT INTO {TARGET_TABLE}
+    WITH numbered AS (
+        SELECT *, ROW_NUMBER() OVER () AS row_id
         FROM cleaned_source
-        LIMIT {BATCH_SIZE} OFFSET {offset}
-    """).df()
-
-    if df.empty:
-        return 0
-
-    output_rows = []
-
-    # Step 2: Process each row
-    for row in df.itertuples(index=False):
-        # Get the basic info (same for all routes)
-        base_info = list(row[:6])  # PaxName, BookingRef, etc.
-
-        # Collect all valid flights from this row
-        flights = []
-        date_set = set()  # To avoid duplicate dates
-        for i in range(1, 8):
-            flight_number = getattr(row, f"FN{i}")
-            departure_date = getattr(row, f"DT{i}")
-            departure_airport = getattr(row, f"AP{i}")
-            arrival_airport = getattr(row, f"AP{i + 1}")
-
-            if departure_date in date_set:
-                continue
-            # Skip invalid flights
-            if not flight_number or not departure_date or flight_number.endswith("000"):
-                continue
-
-            flights.append(
-                (flight_number, departure_date, departure_airport, arrival_airport)
+    ),
+    legs AS (
+        SELECT row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+               fn, dt, dep_ap, arr_ap, CAST(leg AS INTEGER) AS leg
+        FROM numbered
+        UNPIVOT INCLUDE NULLS (
+            (fn, dt, dep_ap, arr_ap) FOR leg IN (
+                (FN1, DT1, AP1, AP2) AS '1',
+                (FN2, DT2, AP2, AP3) AS '2',
+                (FN3, DT3, AP3, AP4) AS '3',
+                (FN4, DT4, AP4, AP5) AS '4',
+                (FN5, DT5, AP5, AP6) AS '5',
+                (FN6, DT6, AP6, AP7) AS '6',
+                (FN7, DT7, AP7, AP8) AS '7'
             )
-            date_set.add(departure_date)
-
-        if not flights:
-            continue
-
-        # Step 3: Split flights into separate routes
-        routes = split_into_routes(flights)
-
-        # Step 4: Create one output row per route
-        for route in routes:
-            output_row = base_info.copy()
-
-            # Initialize empty columns
-            flight_nums = [None] * 7
-            dates = [None] * 7
-            airports = [None] * 8
-
-            # Fill in the data from this route (max 7 flights)
-            for i, (fn, dt, dep_ap, arr_ap) in enumerate(route[:7]):
-                flight_nums[i] = fn
-                dates[i] = dt
-                airports[i] = dep_ap
-                if i + 1 < len(airports):
-                    airports[i + 1] = arr_ap
-
-            # Combine all data
-            output_row.extend(flight_nums)
-            output_row.extend(dates)
-            output_row.extend(airports)
-            output_rows.append(output_row)
-
-    if not output_rows:
-        return 0
-
-    # Step 5: Insert into target table
-    df_output = pd.DataFrame(output_rows)
-    con.register("batch_data", df_output)
-    con.execute(f"INSERT INTO {TARGET_TABLE} SELECT * FROM batch_data")
-    con.unregister("batch_data")
-
-    return len(output_rows)
+        )
+    ),
+    -- usable legs only; a date seen earlier in the same row is skipped
+    valid AS (
+        SELECT *
+        FROM legs
+        WHERE fn IS NOT NULL
+          AND fn <> ''
+          AND dt IS NOT NULL
+          AND NOT ends_with(fn, '000')
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY row_id, dt ORDER BY leg) = 1
+    ),
+    with_prev AS (
+        SELECT *,
+            LAG(dt) OVER (PARTITION BY row_id ORDER BY leg) AS prev_dt
+        FROM valid
+    ),
+    -- same route while within 36h (either direction) of the previous leg
+    with_route AS (
+        SELECT *,
+            SUM(
+                CASE
+                    WHEN prev_dt IS NOT NULL
+                     -- 36h as an int64 microsecond diff (cheaper than +/- INTERVAL)
+                     AND abs(epoch_us(dt) - epoch_us(prev_dt)) <= 129600000000
+                    THEN 0
+                    ELSE 1
+                END
+            ) OVER (
+                PARTITION BY row_id
+                ORDER BY leg
+                ROWS UNBOUNDED PRECEDING
+            ) AS route_id
+        FROM with_prev
+    ),
+    sequenced AS (
+        SELECT *,
+            ROW_NUMBER() OVER (PARTITION BY row_id, route_id ORDER BY leg) AS pos
+        FROM with_route
+    )
+    SELECT
+        ANY_VALUE(PaxName) AS PaxName,
+        ANY_VALUE(BookingRef) AS BookingRef,
+        ANY_VALUE(ETicketNo) AS ETicketNo,
+        ANY_VALUE(ClientCode) AS ClientCode,
+        ANY_VALUE(Airline) AS Airline,
+        ANY_VALUE(JourneyType) AS JourneyType,
+
+        MAX(CASE WHEN pos = 1 THEN fn END) AS FlightNumber1,
+        MAX(CASE WHEN pos = 2 THEN fn END) AS FlightNumber2,
+        MAX(CASE WHEN pos = 3 THEN fn END) AS FlightNumber3,
+        MAX(CASE WHEN pos = 4 THEN fn END) AS FlightNumber4,
+        MAX(CASE WHEN pos = 5 THEN fn END) AS FlightNumber5,
+        MAX(CASE WHEN pos = 6 THEN fn END) AS FlightNumber6,
+        MAX(CASE WHEN pos = 7 THEN fn END) AS FlightNumber7,
+
+        MAX(CASE WHEN pos = 1 THEN dt END) AS DepartureDateLocal1,
+        MAX(CASE WHEN pos = 2 THEN dt END) AS DepartureDateLocal2,
+        MAX(CASE WHEN pos = 3 THEN dt END) AS DepartureDateLocal3,
+        MAX(CASE WHEN pos = 4 THEN dt END) AS DepartureDateLocal4,
+        MAX(CASE WHEN pos = 5 THEN dt END) AS DepartureDateLocal5,
+        MAX(CASE WHEN pos = 6 THEN dt END) AS DepartureDateLocal6,
+        MAX(CASE WHEN pos = 7 THEN dt END) AS DepartureDateLocal7,
+
+        -- Airport k is leg k's departure, or the arrival of the last leg
+        MAX(CASE WHEN pos = 1 THEN dep_ap END) AS Airport1,
+        CASE
+            WHEN COUNT(*) >= 2 THEN MAX(CASE WHEN pos = 2 THEN dep_ap END)
+            WHEN COUNT(*) = 1 THEN MAX(CASE WHEN pos = 1 THEN arr_ap END)
+        END AS Airport2,
+        CASE
+            WHEN COUNT(*) >= 3 THEN MAX(CASE WHEN pos = 3 THEN dep_ap END)
+            WHEN COUNT(*) = 2 THEN MAX(CASE WHEN pos = 2 THEN arr_ap END)
+        END AS Airport3,
+        CASE
+            WHEN COUNT(*) >= 4 THEN MAX(CASE WHEN pos = 4 THEN dep_ap END)
+            WHEN COUNT(*) = 3 THEN MAX(CASE WHEN pos = 3 THEN arr_ap END)
+        END AS Airport4,
+        CASE
+            WHEN COUNT(*) >= 5 THEN MAX(CASE WHEN pos = 5 THEN dep_ap END)
+            WHEN COUNT(*) = 4 THEN MAX(CASE WHEN pos = 4 THEN arr_ap END)
+        END AS Airport5,
+        CASE
+            WHEN COUNT(*) >= 6 THEN MAX(CASE WHEN pos = 6 THEN dep_ap END)
+            WHEN COUNT(*) = 5 THEN MAX(CASE WHEN pos = 5 THEN arr_ap END)
+        END AS Airport6,
+        CASE
+            WHEN COUNT(*) >= 7 THEN MAX(CASE WHEN pos = 7 THEN dep_ap END)
+            WHEN COUNT(*) = 6 THEN MAX(CASE WHEN pos = 6 THEN arr_ap END)
+        END AS Airport7,
+        CASE WHEN COUNT(*) = 7 THEN MAX(CASE WHEN pos = 7 THEN arr_ap END) END AS Airport8
+    FROM sequenced
+    GROUP BY row_id, route_id
+    """).fetchone()
+
+    return result[0] if result else 0
 
 
 # ==================================================
@@ -288,22 +288,9 @@ def main():
     total_rows = con.execute("SELECT COUNT(*) FROM cleaned_source").fetchone()[0]
     log(f"Total rows to process: {total_rows:,}")
 
-    # Process in batches
-    offset = 0
-    batch_number = 0
-    total_inserted = 0
-
-    while offset < total_rows:
-        batch_number += 1
-        log(
-            f"Processing batch {batch_number}: rows {offset:,} to {min(offset + BATCH_SIZE, total_rows):,}"
-        )
-
-        rows_inserted = process_batch(con, offset)
-        total_inserted += rows_inserted
-
-        log(f"  → Inserted {rows_inserted:,} output rows")
-        offset += BATCH_SIZE
+    # Routes are split per source row, so one pass needs no batching
+    log("Splitting routes...")
+    total_inserted = insert_routes(con)
 
     # Finish
     elapsed_seconds = time.time() - start_time
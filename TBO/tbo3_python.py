@@ -1,4 +1,5 @@
 import duckdb
+import numpy as np
 import pandas as pd
 import re
 import time
@@ -44,7 +45,6 @@ def connect_db() -> duckdb.DuckDBPyConnection:
     con.execute(f"SET memory_limit='{MEMORY_LIMIT}'")
     con.execute("SET preserve_insertion_order=false")
     con.execute("SET enable_progress_bar=false")
-    con.execute("SET force_parallelism=true")
     con.execute(f"SET temp_directory='{TEMP_DIR}'")
     return con
 
@@ -93,106 +93,112 @@ def get_total_rows(con) -> int:
     return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 
-def create_clean_view(con):
-    log("🧹 Creating cleaned source view")
+def create_clean_table(con):
+    log("🧹 Creating cleaned source table")
 
+    # Materialized once: a view would re-run the casts/regexes for every batch
     con.execute(f"""
-        CREATE OR REPLACE TEMP VIEW cleaned_source AS
-        SELECT
-            ROW_NUMBER() OVER () AS row_id,
-            
-            PaxName,
-            BookingRef,
-            ETicketNo,
-            ClientCode,
-            Airline,
-            JourneyType,
-
-            regexp_replace(upper(FlightNumber1), '^([A-Z]{{2,3}})0*', '\\1') AS FN1,
-            regexp_replace(upper(FlightNumber2), '^([A-Z]{{2,3}})0*', '\\1') AS FN2,
-            regexp_replace(upper(FlightNumber3), '^([A-Z]{{2,3}})0*', '\\1') AS FN3,
-            regexp_replace(upper(FlightNumber4), '^([A-Z]{{2,3}})0*', '\\1') AS FN4,
-            regexp_replace(upper(FlightNumber5), '^([A-Z]{{2,3}})0*', '\\1') AS FN5,
-            regexp_replace(upper(FlightNumber6), '^([A-Z]{{2,3}})0*', '\\1') AS FN6,
-            regexp_replace(upper(FlightNumber7), '^([A-Z]{{2,3}})0*', '\\1') AS FN7,
-
-            TRY_CAST(DepartureDateLocal1 AS TIMESTAMP) AS DT1,
-            TRY_CAST(DepartureDateLocal2 AS TIMESTAMP) AS DT2,
-            TRY_CAST(DepartureDateLocal3 AS TIMESTAMP) AS DT3,
-            TRY_CAST(DepartureDateLocal4 AS TIMESTAMP) AS DT4,
-            TRY_CAST(DepartureDateLocal5 AS TIMESTAMP) AS DT5,
-            TRY_CAST(DepartureDateLocal6 AS TIMESTAMP) AS DT6,
-            TRY_CAST(DepartureDateLocal7 AS TIMESTAMP) AS DT7,
-
-            Airport1 AS AP1,
-            Airport2 AS AP2,
-            Airport3 AS AP3,
-            Airport4 AS AP4,
-            Airport5 AS AP5,
-            Airport6 AS AP6,
-            Airport7 AS AP7,
-            Airport8 AS AP8
-        FROM {SOURCE_TABLE}
-        WHERE
-              (TRY_CAST(DepartureDateLocal1 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal2 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal3 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal4 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal5 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal6 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
-           OR (TRY_CAST(DepartureDateLocal7 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
+        CREATE OR REPLACE TEMP TABLE cleaned_source AS
+        SELECT ROW_NUMBER() OVER () AS row_id, *
+        FROM (
+            SELECT
+                PaxName,
+                BookingRef,
+                ETicketNo,
+                ClientCode,
+                Airline,
+                JourneyType,
+
+                regexp_replace(upper(FlightNumber1), '^([A-Z]{{2,3}})0*', '\\1') AS FN1,
+                regexp_replace(upper(FlightNumber2), '^([A-Z]{{2,3}})0*', '\\1') AS FN2,
+                regexp_replace(upper(FlightNumber3), '^([A-Z]{{2,3}})0*', '\\1') AS FN3,
+                regexp_replace(upper(FlightNumber4), '^([A-Z]{{2,3}})0*', '\\1') AS FN4,
+                regexp_replace(upper(FlightNumber5), '^([A-Z]{{2,3}})0*', '\\1') AS FN5,
+                regexp_replace(upper(FlightNumber6), '^([A-Z]{{2,3}})0*', '\\1') AS FN6,
+                regexp_replace(upper(FlightNumber7), '^([A-Z]{{2,3}})0*', '\\1') AS FN7,
+
+                TRY_CAST(DepartureDateLocal1 AS TIMESTAMP) AS DT1,
+                TRY_CAST(DepartureDateLocal2 AS TIMESTAMP) AS DT2,
+                TRY_CAST(DepartureDateLocal3 AS TIMESTAMP) AS DT3,
+                TRY_CAST(DepartureDateLocal4 AS TIMESTAMP) AS DT4,
+                TRY_CAST(DepartureDateLocal5 AS TIMESTAMP) AS DT5,
+                TRY_CAST(DepartureDateLocal6 AS TIMESTAMP) AS DT6,
+                TRY_CAST(DepartureDateLocal7 AS TIMESTAMP) AS DT7,
+
+                Airport1 AS AP1,
+                Airport2 AS AP2,
+                Airport3 AS AP3,
+                Airport4 AS AP4,
+                Airport5 AS AP5,
+                Airport6 AS AP6,
+                Airport7 AS AP7,
+                Airport8 AS AP8
+            FROM {SOURCE_TABLE}
+        )
+        -- filter on the DT columns: each TRY_CAST runs once per value
+        -- (plain OR chain on purpose: list_transform/list_has_any forms are 4-8x slower)
+        WHERE (
+              DT1 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT2 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT3 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT4 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT5 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT6 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+           OR DT7 BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31'
+        )
+          -- at least one flight number, none of them a '000' placeholder
+          AND COALESCE(FN1, FN2, FN3, FN4, FN5, FN6, FN7) IS NOT NULL
+          AND NOT COALESCE(
+                  FN1 LIKE '%000' OR FN2 LIKE '%000' OR FN3 LIKE '%000'
+               OR FN4 LIKE '%000' OR FN5 LIKE '%000' OR FN6 LIKE '%000'
+               OR FN7 LIKE '%000',
+              FALSE)
     """)
 
 
 # ==================================================
 # ROUTE LOGIC
 # ==================================================
-def same_route(d1, d2):
-    return abs((d2 - d1).days) <= 1
+# abs(timedelta.days) <= 1 means -1 day <= gap < 2 days (days is floored)
+DAY_NS = 86_400_000_000_000
+NAT_NS = -9_223_372_036_854_775_808  # NaT viewed as int64
+
+# cleaned_source column names, in target-table order
+BASE_COLS = ("PaxName", "BookingRef", "ETicketNo", "ClientCode", "Airline", "JourneyType")
+FN_COLS = tuple(f"FN{i}" for i in range(1, 8))
+DT_COLS = tuple(f"DT{i}" for i in range(1, 8))
+AP_COLS = tuple(f"AP{i}" for i in range(1, 9))
 
 
 def process_batch(con, offset):
     df = con.execute(f"""
         SELECT *
         FROM cleaned_source
-        LIMIT {BATCH_SIZE} OFFSET {offset}
+        WHERE row_id > {offset} AND row_id <= {offset + BATCH_SIZE}
     """).df()
 
     if df.empty:
         return 0
 
-    # Convert to numpy arrays for faster processing
-    fn_cols = [f"FN{i}" for i in range(1, 8)]
-    dt_cols = [f"DT{i}" for i in range(1, 8)]
-    ap_cols = [f"AP{i}" for i in range(1, 9)]
+    # Bind each column once: no getattr / f-string per cell in the row loop
+    base_arrs = [df[c].to_numpy(dtype=object) for c in BASE_COLS]
+    fn_arrs = [df[c].to_numpy(dtype=object) for c in FN_COLS]
+    dt_arrs = [df[c].to_numpy(dtype=object) for c in DT_COLS]
+    # Same dates as int nanoseconds, for the route check below
+    ns_arrs = [df[c].to_numpy(dtype="datetime64[ns]").view("i8").tolist() for c in DT_COLS]
+    ap_arrs = [df[c].to_numpy(dtype=object) for c in AP_COLS]
 
-    # Pre-filter valid flights using vectorized operations
-    valid_mask = (
-        (df[fn_cols].notna().any(axis=1))
-        & (df[dt_cols].notna().any(axis=1))
-        & (~df[fn_cols].astype(str).str.endswith("000").any(axis=1))
-    )
-    df = df[valid_mask]
-
-    if df.empty:
-        return 0
+    # The loop only decides where each kept leg goes; values are scattered after
+    out_base = []  # source row of each output route
+    out_row, out_slot, src_row, src_leg = [], [], [], []
 
-    out_rows = []
-    base_data = df[
-        ["PaxName", "BookingRef", "ETicketNo", "ClientCode", "Airline", "JourneyType"]
-    ].values
-
-    # Process rows using list comprehension for better performance
-    for idx, row in enumerate(df.itertuples(index=False)):
+    for idx in range(len(df)):
         flights = []
-        for i in range(1, 8):
-            fn = getattr(row, f"FN{i}")
-            dt = getattr(row, f"DT{i}")
-            depAp = getattr(row, f"AP{i}")
-            arrAp = getattr(row, f"AP{i + 1}")
-
-            if fn and dt and not fn.endswith("000"):
-                flights.append((fn, dt, depAp, arrAp))
+        for i in range(7):
+            fn = fn_arrs[i][idx]
+            # NULL slots arrive as NaN (truthy) from pandas, so test for str
+            if isinstance(fn, str) and fn and dt_arrs[i][idx] and not fn.endswith("000"):
+                flights.append(i)
 
         if not flights:
             continue
@@ -201,36 +207,53 @@ def process_batch(con, offset):
         routes = []
         current = [flights[0]]
 
-        for f in flights[1:]:
-            if same_route(current[-1][1], f[1]):
-                current.append(f)
+        for i in flights[1:]:
+            # NaT is never on the same route (as with Timedelta comparisons)
+            prev_ns = ns_arrs[current[-1]][idx]
+            if prev_ns != NAT_NS and -DAY_NS <= ns_arrs[i][idx] - prev_ns < 2 * DAY_NS:
+                current.append(i)
             else:
                 routes.append(current)
-                current = [f]
+                current = [i]
         routes.append(current)
 
-        # Build output rows
         for route in routes:
-            row_out = list(base_data[idx])
-            fn_out = [None] * 7
-            dt_out = [None] * 7
-            ap_out = [None] * 8
+            r = len(out_base)
+            out_base.append(idx)
+            for slot, i in enumerate(route):
+                out_row.append(r)
+                out_slot.append(slot)
+                src_row.append(idx)
+                src_leg.append(i)
+
+    if not out_base:
+        return 0
 
-            for i, (fn, dt, dep_ap, arr_ap) in enumerate(route[:7]):
-                fn_out[i] = fn
-                dt_out[i] = dt
-                ap_out[i] = dep_ap
-                if i + 1 < len(ap_out):
-                    ap_out[i + 1] = arr_ap
+    # Build output rows: one fancy-index write per column block
+    n_out = len(out_base)
+    out_row = np.array(out_row)
+    out_slot = np.array(out_slot)
+    src_row = np.array(src_row)
+    src_leg = np.array(src_leg)
 
-            out_rows.append(row_out + fn_out + dt_out + ap_out)
+    fn_out = np.full((n_out, 7), None, dtype=object)
+    fn_out[out_row, out_slot] = np.column_stack(fn_arrs)[src_row, src_leg]
+    dt_out = np.full((n_out, 7), None, dtype=object)
+    dt_out[out_row, out_slot] = np.column_stack(dt_arrs)[src_row, src_leg]
 
-    if not out_rows:
-        return 0
+    # Arrivals first, then departures: each leg's departure overwrites the
+    # previous leg's arrival, only the last arrival of a route survives
+    ap_mat = np.column_stack(ap_arrs)
+    ap_out = np.full((n_out, 8), None, dtype=object)
+    ap_out[out_row, out_slot + 1] = ap_mat[src_row, src_leg + 1]
+    ap_out[out_row, out_slot] = ap_mat[src_row, src_leg]
+
+    base_out = np.column_stack(base_arrs)[out_base]
+    out_rows = np.hstack([base_out, fn_out, dt_out, ap_out])
 
     # Use more efficient DataFrame creation
     df_out = pd.DataFrame(out_rows, dtype="object")
-    con.execute(f"INSERT INTO {TARGET_TABLE} SELECT * FROM df_out")
+    con.append(TARGET_TABLE, df_out)
 
     return len(out_rows)
 
@@ -244,7 +267,7 @@ def main():
 
     con = connect_db()
     create_target_table(con)
-    create_clean_view(con)
+    create_clean_table(con)
 
     result = con.execute("SELECT COUNT(*) FROM cleaned_source").fetchone()
     total = result[0] if result else 0
@@ -257,7 +280,7 @@ def main():
     while offset < total:
         batch += 1
         batch_start = time.time()
-        log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total)::,}")
+        log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total):,}")
 
         rows_processed = process_batch(con, offset)
         processed += rows_processed
@@ -1,6 +1,6 @@
 import duckdb
-import pandas as pd
-import re
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import time
 
@@ -15,12 +15,14 @@ SOURCE_TABLE = "TBO3_MASTER"
 TARGET_TABLE = "TBO3_MASTER_TARGET"
 
 BATCH_SIZE = 200_000
+PARALLEL_BATCHES = 2
 
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
 
-THREADS = 4
+THREADS = os.cpu_count() or 4  # one pool, shared by the batch cursors
 MEMORY_LIMIT = "6GB"
+CHECKPOINT_THRESHOLD = "16GB"  # no mid-ingest checkpoints
 TEMP_DIR = "/tmp/duckdb_temp"
 
 
@@ -38,6 +40,7 @@ def connect_db() -> duckdb.DuckDBPyConnection:
     con.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
     con.execute("SET preserve_insertion_order = false")
     con.execute(f"SET temp_directory='{TEMP_DIR}'")
+    con.execute(f"SET checkpoint_threshold = '{CHECKPOINT_THRESHOLD}'")
     return con
 
 
@@ -86,160 +89,165 @@ def get_total_rows(con: duckdb.DuckDBPyConnection) -> int:
     return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 
-def get_target_count(con: duckdb.DuckDBPyConnection) -> int:
-    return con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()[0]
+def create_macros(con: duckdb.DuckDBPyConnection) -> None:
+    log("🧩 Creating helper macros")
 
+    con.execute("""
+        CREATE OR REPLACE MACRO is_rnk(flight) AS (
+            COALESCE(ends_with(flight, '000'), FALSE)
+        )
+    """)
 
-def is_rnk(flight: str) -> bool:
-    if not isinstance(flight, str):
-        return False
-    return flight.endswith("000")
-
-
-def normalize_flight_number(fn: str) -> str | None:
-    if not isinstance(fn, str):
-        return None
-    fn = fn.strip().upper()
-    m = re.fullmatch(r"([A-Z]{2,3})(0*)(\d+)", fn)
-    if not m:
-        return fn
-    airline, _, number = m.groups()
-    return f"{airline}{int(number)}"
-
-
-def normalize_date(value) -> str | None:
-    d = pd.to_datetime(value, errors="coerce")
-    if pd.isna(d):
-        return None
-    if d.year < VALID_YEAR_MIN or d.year > VALID_YEAR_MAX:
-        return None
-    return d.to_pydatetime()
-
+    con.execute("""
+        CREATE OR REPLACE MACRO normalize_flight(flight) AS (
+            -- AA0012 -> AA12; anything else is returned unchanged
+            regexp_replace(flight, '^([A-Z]{2,3})0+([0-9]+)$', '\\1\\2')
+        )
+    """)
 
-def same_route(d1, d2):
-    if d1 is None or d2 is None:
-        return False
-    return abs((d2 - d1).days) <= 1
+    con.execute(f"""
+        CREATE OR REPLACE MACRO normalize_date(dt) AS (
+            CASE
+                WHEN YEAR(TRY_CAST(dt AS TIMESTAMP))
+                     BETWEEN {VALID_YEAR_MIN} AND {VALID_YEAR_MAX}
+                THEN TRY_CAST(dt AS TIMESTAMP)
+            END
+        )
+    """)
 
 
 def process_batch(con: duckdb.DuckDBPyConnection, offset: int) -> int:
-    query = f"""
-        SELECT *
-        FROM {SOURCE_TABLE}
-        LIMIT {BATCH_SIZE} OFFSET {offset}
     """
-
-    df = con.execute(query).df()
-    if df.empty:
-        return
-
-    inserted = 0
-    out_rows = []
-    for _, row in df.iterrows():
-        base_columns = {
-            "PaxName": row["PaxName"],
-            "BookingRef": row["BookingRef"],
-            "ETicketNo": row["ETicketNo"],
-            "ClientCode": row["ClientCode"],
-            "Airline": row["Airline"],
-            "JourneyType": row["JourneyType"],
-        }
-
-        unique_flights = set()
-        cleaned_raw = []
-        for i in range(1, 8):
-            fn = row.get(f"FlightNumber{i}")
-            dt = row.get(f"DepartureDateLocal{i}")
-            ap = row.get(f"Airport{i}")
-
-            if not fn or not dt:
-                continue
-
-            fn_clean = fn.strip().upper()
-            if is_rnk(fn_clean):
-                continue
-
-            key = (fn_clean, dt)
-            if key in unique_flights:
-                continue
-            unique_flights.add(key)
-            cleaned_raw.append((fn_clean, dt, ap))
-
-        flights = []
-        for fn_clean, dt, ap in cleaned_raw:
-            n_fn = normalize_flight_number(fn_clean)
-            n_dt = normalize_date(dt)
-            if n_fn and n_dt:
-                flights.append((n_fn, n_dt, ap))
-
-        if not flights:
-            continue
-
-        routes = []
-        current = []
-        for fn, dt, ap in flights:
-            if not current:
-                current.append((fn, dt, ap))
-                continue
-            prev_fn, prev_dt, _ = current[-1]
-            if fn == prev_fn and dt == prev_dt:
-                continue
-            if same_route(prev_dt, dt):
-                current.append((fn, dt, ap))
-            else:
-                routes.append(current)
-                current = [(fn, dt, ap)]
-        if current:
-            routes.append(current)
-
-        for route in routes:
-            new_row = base_columns.copy()
-
-            for i in range(1, 8):
-                new_row[f"FlightNumber{i}"] = None
-                new_row[f"DepartureDateLocal{i}"] = None
-                new_row[f"Airport{i}"] = None
-            new_row["Airport8"] = None
-
-            seen = set()
-            compacted = []
-            for fn, dt, ap in route:
-                key = (fn, dt)
-                if key in seen:
-                    continue
-                seen.add(key)
-                compacted.append((fn, dt, ap))
-
-            for i, (fn, dt, ap) in enumerate(compacted, start=1):
-                if i > 7:
-                    break
-                new_row[f"FlightNumber{i}"] = fn
-                new_row[f"DepartureDateLocal{i}"] = dt
-                new_row[f"Airport{i}"] = ap
-
-            out_rows.append(new_row)
-
-    df_out = pd.DataFrame(out_rows)
-    if not df_out.empty:
-        con.register("df_out_view", df_out)
-        con.execute(f"""
-            INSERT INTO {TARGET_TABLE} (
-                PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4, FlightNumber5, FlightNumber6, FlightNumber7,
-                DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3, DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6, DepartureDateLocal7,
-                Airport1, Airport2, Airport3, Airport4, Airport5, Airport6, Airport7, Airport8
+    Split each source row of the batch into routes, all inside DuckDB:
+    1. Unpivot the 7 legs and keep the usable ones (first of each
+       flight/date pair within the row)
+    2. Start a new route unless a leg departs within [-1 day, +2 days)
+       of the previous leg
+    3. Drop repeated flight/date pairs within a route and pivot one
+       target row per route
+    """
+    result = con.execute(f"""
+        INSERT INTO {TARGET_TABLE}
+        WITH src AS (
+            SELECT rowid AS row_id, *
+            FROM {SOURCE_TABLE}
+            WHERE rowid >= {offset}
+              AND rowid < {offset + BATCH_SIZE}
+        ),
+        legs AS (
+            SELECT row_id, PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
+                   UPPER(TRIM(FlightNumber)) AS flt, DepartureDate, Airport,
+                   CAST(leg AS INTEGER) AS leg
+            FROM src
+            UNPIVOT INCLUDE NULLS (
+                (FlightNumber, DepartureDate, Airport) FOR leg IN (
+                    (FlightNumber1, DepartureDateLocal1, Airport1) AS '1',
+                    (FlightNumber2, DepartureDateLocal2, Airport2) AS '2',
+                    (FlightNumber3, DepartureDateLocal3, Airport3) AS '3',
+                    (FlightNumber4, DepartureDateLocal4, Airport4) AS '4',
+                    (FlightNumber5, DepartureDateLocal5, Airport5) AS '5',
+                    (FlightNumber6, DepartureDateLocal6, Airport6) AS '6',
+                    (FlightNumber7, DepartureDateLocal7, Airport7) AS '7'
+                )
             )
-            SELECT 
-                PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                FlightNumber1, FlightNumber2, FlightNumber3, FlightNumber4, FlightNumber5, FlightNumber6, FlightNumber7,
-                DepartureDateLocal1, DepartureDateLocal2, DepartureDateLocal3, DepartureDateLocal4, DepartureDateLocal5, DepartureDateLocal6, DepartureDateLocal7,
-                Airport1, Airport2, Airport3, Airport4, Airport5, Airport6, Airport7, Airport8
-            FROM df_out_view
-        """)
-        con.unregister("df_out_view")
-        inserted += len(df_out)
-
-    return inserted
+        ),
+        valid AS (
+            SELECT *,
+                normalize_flight(flt) AS clean_flt,
+                normalize_date(DepartureDate) AS clean_dte
+            FROM legs
+            WHERE flt <> ''
+              AND NOT is_rnk(flt)
+              AND clean_dte IS NOT NULL
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY row_id, flt, DepartureDate
+                ORDER BY leg
+            ) = 1
+        ),
+        with_route AS (
+            SELECT *,
+                SUM(CASE WHEN same_route THEN 0 ELSE 1 END) OVER (
+                    PARTITION BY row_id
+                    ORDER BY leg
+                    ROWS UNBOUNDED PRECEDING
+                ) AS route_id
+            FROM (
+                SELECT *,
+                    -- same route while -24h <= gap < 48h (abs(timedelta.days) <= 1)
+                    COALESCE(
+                        epoch_us(clean_dte) - epoch_us(LAG(clean_dte) OVER (
+                            PARTITION BY row_id ORDER BY leg
+                        )) BETWEEN -86400000000 AND 172799999999,
+                        FALSE
+                    ) AS same_route
+                FROM valid
+            )
+        ),
+        compacted AS (
+            SELECT *
+            FROM with_route
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY row_id, route_id, clean_flt, clean_dte
+                ORDER BY leg
+            ) = 1
+        ),
+        sequenced AS (
+            SELECT *,
+                ROW_NUMBER() OVER (
+                    PARTITION BY row_id, route_id
+                    ORDER BY leg
+                ) AS pos
+            FROM compacted
+        )
+        SELECT
+            ANY_VALUE(PaxName),
+            ANY_VALUE(BookingRef),
+            ANY_VALUE(ETicketNo),
+            ANY_VALUE(ClientCode),
+            ANY_VALUE(Airline),
+            ANY_VALUE(JourneyType),
+
+            MAX(CASE WHEN pos = 1 THEN clean_flt END),
+            MAX(CASE WHEN pos = 2 THEN clean_flt END),
+            MAX(CASE WHEN pos = 3 THEN clean_flt END),
+            MAX(CASE WHEN pos = 4 THEN clean_flt END),
+            MAX(CASE WHEN pos = 5 THEN clean_flt END),
+            MAX(CASE WHEN pos = 6 THEN clean_flt END),
+            MAX(CASE WHEN pos = 7 THEN clean_flt END),
+
+            MAX(CASE WHEN pos = 1 THEN clean_dte END),
+            MAX(CASE WHEN pos = 2 THEN clean_dte END),
+            MAX(CASE WHEN pos = 3 THEN clean_dte END),
+            MAX(CASE WHEN pos = 4 THEN clean_dte END),
+            MAX(CASE WHEN pos = 5 THEN clean_dte END),
+            MAX(CASE WHEN pos = 6 THEN clean_dte END),
+            MAX(CASE WHEN pos = 7 THEN clean_dte END),
+
+            MAX(CASE WHEN pos = 1 THEN Airport END),
+            MAX(CASE WHEN pos = 2 THEN Airport END),
+            MAX(CASE WHEN pos = 3 THEN Airport END),
+            MAX(CASE WHEN pos = 4 THEN Airport END),
+            MAX(CASE WHEN pos = 5 THEN Airport END),
+            MAX(CASE WHEN pos = 6 THEN Airport END),
+            MAX(CASE WHEN pos = 7 THEN Airport END),
+            NULL
+        FROM sequenced
+        GROUP BY row_id, route_id
+    """).fetchone()
+    # INSERT reports its own row count
+    return result[0] if result else 0
+
+
+def run_batch(con: duckdb.DuckDBPyConnection, offset: int) -> int:
+    # Own cursor per batch so batches can run side by side
+    cur = con.cursor()
+    try:
+        log(f"🔄 Batch rows {offset:,} → {offset + BATCH_SIZE:,}")
+        added = process_batch(cur, offset)
+    finally:
+        cur.close()
+    log(f"✅ Batch rows {offset:,} → {offset + BATCH_SIZE:,}: added {added:,} rows")
+    return added
 
 
 def main() -> None:
@@ -248,20 +256,16 @@ def main() -> None:
 
     con = connect_db()
     create_target_table(con)
+    create_macros(con)
 
     total_rows = get_total_rows(con)
     log(f"📊 Total source records: {total_rows:,}")
 
-    offset = 0
-    batch_no = 0
-
-    while offset < total_rows:
-        batch_no += 1
-        log(f"🔄 Batch {batch_no} | rows {offset:,} → {offset + BATCH_SIZE:,}")
-
-        process_batch(con, offset)
-
-        offset += BATCH_SIZE
+    # Batches cover disjoint rowid ranges, so they need no shared state
+    offsets = range(0, total_rows, BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=PARALLEL_BATCHES) as ex:
+        inserted = sum(ex.map(lambda o: run_batch(con, o), offsets))
+    log(f"📊 Inserted {inserted:,} rows")
 
     # Calculate execution time
     end_time = time.time()
@@ -1,3 +1,4 @@
+import os
 import time
 from pathlib import Path
 
@@ -18,7 +19,7 @@ BATCH_SIZE = 200_000
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
 
-THREADS = 4
+THREADS = os.cpu_count() or 4  # all cores: window/regex work scales with threads
 MEMORY_LIMIT = "6GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 
@@ -106,15 +107,22 @@ def create_macros(con: duckdb.DuckDBPyConnection) -> None:
 
     con.execute("""
         CREATE OR REPLACE MACRO normalize_flight(flight) AS (
+            -- one regex pass: strings without a zero-padded number are
+            -- returned unchanged (NULL stays NULL)
+            regexp_replace(
+                UPPER(TRIM(flight)),
+                '^([A-Z]{2,3})0+([0-9]+)$',
+                '\\1\\2'
+            )
+        )
+    """)
+
+    # Normalized flight number, or NULL for RNK codes
+    con.execute("""
+        CREATE OR REPLACE MACRO clean_flight(flight) AS (
             CASE
-                WHEN flight IS NULL THEN NULL
-                WHEN regexp_matches(UPPER(TRIM(flight)), '^([A-Z]{2,3})(0*)([0-9]+)$')
-                    THEN regexp_replace(
-                        UPPER(TRIM(flight)),
-                        '^([A-Z]{2,3})0+([0-9]+)$',
-                        '\\1\\2'
-                    )
-                ELSE UPPER(TRIM(flight))
+                WHEN is_rnk(normalize_flight(flight)) THEN NULL
+                ELSE normalize_flight(flight)
             END
         )
     """)
@@ -140,15 +148,11 @@ def get_total_rows(con: duckdb.DuckDBPyConnection) -> int:
     return con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
 
 
-def get_target_count(con: duckdb.DuckDBPyConnection) -> int:
-    return con.execute(f"SELECT COUNT(*) FROM {TARGET_TABLE}").fetchone()[0]
-
-
 # ==================================================
 # BATCH PROCESSING (FIXED)
 # ==================================================
-def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> None:
-    con.execute(f"""
+def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> int:
+    result = con.execute(f"""
         INSERT INTO {TARGET_TABLE}
 
         WITH src AS (
@@ -159,54 +163,38 @@ def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> No
         ),
         unpivoted AS (
             SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber1 AS FlightNumber, DepartureDateLocal1 AS DepartureDate,
-                   Airport1 AS DepAir, Airport2 AS ArrAir, 1 AS OriginalSeq
-            FROM src WHERE TRIM(FlightNumber1) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber2, DepartureDateLocal2, Airport2, Airport3, 2
-            FROM src WHERE TRIM(FlightNumber2) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber3, DepartureDateLocal3, Airport3, Airport4, 3
-            FROM src WHERE TRIM(FlightNumber3) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber4, DepartureDateLocal4, Airport4, Airport5, 4
-            FROM src WHERE TRIM(FlightNumber4) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber5, DepartureDateLocal5, Airport5, Airport6, 5
-            FROM src WHERE TRIM(FlightNumber5) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber6, DepartureDateLocal6, Airport6, Airport7, 6
-            FROM src WHERE TRIM(FlightNumber6) <> ''
-            UNION ALL
-            SELECT PaxName, BookingRef, ETicketNo, ClientCode, Airline, JourneyType,
-                   FlightNumber7, DepartureDateLocal7, Airport7, Airport8, 7
-            FROM src WHERE TRIM(FlightNumber7) <> ''
+                   FlightNumber, DepartureDate, DepAir, ArrAir,
+                   CAST(OriginalSeq AS INTEGER) AS OriginalSeq
+            FROM src
+            UNPIVOT INCLUDE NULLS (
+                (FlightNumber, DepartureDate, DepAir, ArrAir) FOR OriginalSeq IN (
+                    (FlightNumber1, DepartureDateLocal1, Airport1, Airport2) AS '1',
+                    (FlightNumber2, DepartureDateLocal2, Airport2, Airport3) AS '2',
+                    (FlightNumber3, DepartureDateLocal3, Airport3, Airport4) AS '3',
+                    (FlightNumber4, DepartureDateLocal4, Airport4, Airport5) AS '4',
+                    (FlightNumber5, DepartureDateLocal5, Airport5, Airport6) AS '5',
+                    (FlightNumber6, DepartureDateLocal6, Airport6, Airport7) AS '6',
+                    (FlightNumber7, DepartureDateLocal7, Airport7, Airport8) AS '7'
+                )
+            )
+            WHERE TRIM(FlightNumber) <> ''
         ),
-        cleaned AS (
+        -- normalized in place; DuckDB lets WHERE reuse the select aliases
+        filtered AS (
             SELECT
                 PaxName,
                 BookingRef,
                 ClientCode,
                 Airline,
                 JourneyType,
-                normalize_flight(FlightNumber) AS clean_flt,
+                clean_flight(FlightNumber) AS clean_flt,
                 normalize_date(DepartureDate) AS clean_dte,
                 DepAir,
                 ArrAir,
                 OriginalSeq
             FROM unpivoted
-        ),
-        filtered AS (
-            SELECT *
-            FROM cleaned
             WHERE clean_flt IS NOT NULL
               AND clean_dte IS NOT NULL
-              AND NOT is_rnk(clean_flt)
         ),
         deduped AS (
             SELECT *,
@@ -231,7 +219,8 @@ def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> No
                     CASE
                         WHEN prev_dte IS NULL THEN 1
                         WHEN clean_dte < prev_dte THEN 1
-                        WHEN EXTRACT(EPOCH FROM (clean_dte - prev_dte)) > 36 * 3600 THEN 1
+                        -- 36h gap as an int64 microsecond diff (cheaper than + INTERVAL)
+                        WHEN epoch_us(clean_dte) - epoch_us(prev_dte) > 129600000000 THEN 1
                         ELSE 0
                     END
                 ) OVER (
@@ -299,7 +288,9 @@ def process_batch(con: duckdb.DuckDBPyConnection, offset: int, limit: int) -> No
             Airport1, Airport2, Airport3, Airport4,
             Airport5, Airport6, Airport7, Airport8
         FROM pivoted
-    """)
+    """).fetchone()
+    # INSERT reports its own row count
+    return result[0] if result else 0
 
 
 # ==================================================
@@ -319,23 +310,21 @@ def main() -> None:
 
     offset = 0
     batch_no = 0
-    inserted_prev = 0
+    inserted = 0
 
     while offset < total_rows:
         batch_no += 1
         log(f"🔄 Batch {batch_no} | rows {offset:,} → {offset + BATCH_SIZE:,}")
 
-        process_batch(con, offset, BATCH_SIZE)
-
-        inserted_now = get_target_count(con)
-        log(f"✅ Added {inserted_now - inserted_prev:,} rows")
+        added = process_batch(con, offset, BATCH_SIZE)
+        log(f"✅ Added {added:,} rows")
 
-        inserted_prev = inserted_now
+        inserted += added
         offset += BATCH_SIZE
 
     elapsed = time.time() - start
     log(f"🎉 ETL completed in {int(elapsed // 60)}m {elapsed % 60:.2f}s")
-    log(f"📊 Final row count: {inserted_prev:,}")
+    log(f"📊 Final row count: {inserted:,}")
 
     con.close()
 
@@ -1,9 +1,6 @@
 import duckdb
-import pandas as pd
 import time
 from pathlib import Path
-import re
-from datetime import timedelta
 
 # ==================================================
 # CONFIG
@@ -19,6 +16,7 @@ BATCH_SIZE = 100_000
 MAX_FLTNO_DIGITS = 8
 FLTNO_REGEX = r"^([A-Z]{2,3}|\d[A-Z])0+([1-9][0-9]*)$"
 ROUTE_MAX_DAYS = 1
+STRIP_WS = r"[\s\v\pZ\x1c-\x1f\x85]*"  # what str.strip() removes, as RE2
 
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
@@ -27,6 +25,17 @@ THREADS = 8
 MEMORY_LIMIT = "8GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 
+# Composite key, enforced once by finalize_target_table() instead of a
+# UNIQUE index probed on every insert
+KEY_COLS = [
+    "BookingId",
+    "PaxName",
+    "FlightNumber1",
+    "FlightDate1",
+    "Airport1",
+    "Airport2",
+]
+
 
 # ==================================================
 # UTILS
@@ -81,11 +90,7 @@ def create_target_table(con):
             Airport3 VARCHAR,
             Airport4 VARCHAR,
             Airport5 VARCHAR,
-            Airport6 VARCHAR,
-
-            CONSTRAINT uq_tripjack UNIQUE (
-                BookingId, PaxName, FlightNumber1, FlightDate1,Airport1, Airport2
-            )
+            Airport6 VARCHAR
         )
     """)
 
@@ -95,10 +100,15 @@ def get_total_rows(con) -> int:
 
 
 def create_clean_view(con):
-    log("🧹 Creating cleaned source view")
+    log("🧹 Materializing cleaned source")
+    con.execute("DROP TABLE IF EXISTS _cleaned_source")
 
+    # Computed once and numbered, so batches are _row_id ranges instead of
+    # an OFFSET that re-runs the DISTINCT for every batch
     con.execute(f"""
-        CREATE OR REPLACE TEMP VIEW cleaned_source AS
+        CREATE TEMP TABLE _cleaned_source AS
+        SELECT row_number() OVER () AS _row_id, *
+        FROM (
         SELECT DISTINCT
             BookingId,
             PaxName,
@@ -152,154 +162,155 @@ def create_clean_view(con):
            OR (TRY_CAST(DepartureDateLocal3 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
            OR (TRY_CAST(DepartureDateLocal4 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
            OR (TRY_CAST(DepartureDateLocal5 AS TIMESTAMP) BETWEEN '{VALID_YEAR_MIN}-01-01' AND '{VALID_YEAR_MAX}-12-31')
+        )
     """)
+    con.execute("CREATE INDEX idx_cleaned_row_id ON _cleaned_source (_row_id)")
 
 
-def is_same_route(d1, d2):
-    # Check for NaT (Not a Time) before calculation
-    if pd.isna(d1) or pd.isna(d2):
-        return False
-    return abs(d2 - d1) <= timedelta(days=ROUTE_MAX_DAYS)
-
-
-def is_valid_flightno(fn: str, dt: str) -> bool:
-    if pd.isna(fn) or pd.isna(dt):
-        return False
-
-    fn = str(fn).strip()
-
-    # ❌ Ignore empty strings
-    if not fn:
-        return False
-
-    # ❌ Corrupted huge numeric value → drop whole row
-    if fn.isdigit():
-        return False
-    if len(fn) > MAX_FLTNO_DIGITS:
-        return False
-    # ❌ Remove TK000, TK0000, 0000, etc. (Numeric part all zeros)
-    stripped = fn.rstrip("0")
-
-    # If string is empty (e.g., "0000") -> Drop
-    # If string is all alpha (e.g., "TK") -> Drop
-    if not stripped or stripped.isalpha():
-        return False
-
-    fn = fn.strip().upper()
-    # ❌ Reject invalid short flight numbers (G8, 6P, I5, etc.)
-    # Valid format: 2-3 letters + at least 1 digit (minimum length 3)
-    if not re.fullmatch(r"[A-Z0-9]{2,3}\d+", fn):
-        return False
-    return True
-
-
-def deduplicate_flights(flights):
-    # Sort flights by Date ONLY (x[1]).
-    flights.sort(key=lambda x: x[1])
-    seen_segments = set()
-    unique_flights = []
-
-    for fn, dt, dep_ap, arr_ap in flights:
-        # Deduplicate by FlightNo + FlightDate (date-level)
-        key = (fn, dt.date())
-
-        if key not in seen_segments:
-            seen_segments.add(key)
-            unique_flights.append((fn, dt, dep_ap, arr_ap))
-
-    return unique_flights
-
-
-def group_into_routes(flights):
-    routes = []
-
-    current = [flights[0]]
-    route_start_date = flights[0][1]
-
-    for f in flights[1:]:
-        if is_same_route(f[1], route_start_date):
-            current.append(f)
-        else:
-            routes.append(current)
-            current = [f]
-            route_start_date = f[1]
-
-    # IMPORTANT: append the last route
-    routes.append(current)
-
-    return routes
-
-
-def process_batch(con, offset):
-    df = con.execute(f"""
-        SELECT *
-        FROM cleaned_source
-        LIMIT {BATCH_SIZE} OFFSET {offset}
-    """).df()
-
-    if df.empty:
-        return 0
+def create_macros(con):
+    log("🧩 Creating macros")
 
-    out_rows = []
-    base_data = df[
-        [
-            "BookingId",
-            "PaxName",
-            "JourneyBucket",
-            "BookingRef_PNR",
-            "Airline",
-            "ETicketNo",
-        ]
-    ].values
-
-    for idx, row in enumerate(df.itertuples(index=False)):
-        flights = []
-
-        for i in range(1, 6):
-            fn = getattr(row, f"FN{i}")
-            dt = getattr(row, f"DT{i}")
-
-            if not is_valid_flightno(fn, dt):
-                continue
-
-            depAp = getattr(row, f"AP{i}")
-            arrAp = getattr(row, f"AP{i + 1}")
-
-            flights.append((fn, dt, depAp, arrAp))
-
-        # ❌ No valid (FltNo + FltDate) pairs → skip row
-        if not flights:
-            continue
-
-        flights = deduplicate_flights(flights)
-
-        routes = group_into_routes(flights)
-
-        # Build output rows
-        for route in routes:
-            row_out = list(base_data[idx])
-            fn_out = [None] * 5
-            dt_out = [None] * 5
-            ap_out = [None] * 6
-
-            for i, (fn, dt, dep_ap, arr_ap) in enumerate(route[:6]):
-                fn_out[i] = fn
-                dt_out[i] = dt
-                ap_out[i] = dep_ap
-                if i + 1 < len(ap_out):
-                    ap_out[i + 1] = arr_ap
-
-            out_rows.append(row_out + fn_out + dt_out + ap_out)
+    # Full match, ignoring surrounding whitespace
+    con.execute(f"""
+        CREATE OR REPLACE MACRO fullmatch_stripped(s, pattern) AS (
+            regexp_full_match(s, '{STRIP_WS}(?:' || pattern || '){STRIP_WS}')
+        )
+    """)
 
-    if not out_rows:
-        return 0
+    # 2-3 letters/digits + digits, at most MAX_FLTNO_DIGITS long, not purely
+    # numeric and not letters followed by zeros only (TK000)
+    con.execute(f"""
+        CREATE OR REPLACE MACRO is_valid_flightno(fn) AS (
+            fullmatch_stripped(fn, '[A-Z0-9]{{2,3}}\\p{{Nd}}+')
+            AND fullmatch_stripped(fn, '[A-Z0-9\\p{{Nd}}]{{3,{MAX_FLTNO_DIGITS}}}')
+            AND NOT fullmatch_stripped(fn, '\\p{{Nd}}+|[A-Z]+0+')
+        )
+    """)
 
-    df_out = pd.DataFrame(out_rows, dtype="object")
-    # NEW: Remove duplicates from the batch before inserting
-    df_out = df_out.drop_duplicates()
-    con.execute(f"INSERT OR IGNORE INTO {TARGET_TABLE} SELECT * FROM df_out")
 
-    return len(df_out)
+def process_batch(con, row_id_start):
+    """
+    Split each cleaned row of the batch into routes, all inside DuckDB:
+    1. Unpivot the 5 legs, keep valid flight numbers with a date
+    2. Drop repeated flight/day pairs, order the rest by date
+    3. Walk the legs in order: a route lasts while a leg departs within
+       ROUTE_MAX_DAYS of the route's first leg
+    4. Pivot one target row per route
+    """
+    result = con.execute(f"""
+        INSERT INTO {TARGET_TABLE}
+        WITH RECURSIVE batch AS (
+            SELECT _row_id AS row_id, * EXCLUDE (_row_id)
+            FROM _cleaned_source
+            WHERE _row_id BETWEEN {row_id_start} AND {row_id_start + BATCH_SIZE - 1}
+        ),
+        legs AS (
+            SELECT *, CAST(leg AS INTEGER) AS slot
+            FROM batch
+            UNPIVOT INCLUDE NULLS (
+                (fn, dt, dep_ap, arr_ap) FOR leg IN (
+                    (FN1, DT1, AP1, AP2) AS '1',
+                    (FN2, DT2, AP2, AP3) AS '2',
+                    (FN3, DT3, AP3, AP4) AS '3',
+                    (FN4, DT4, AP4, AP5) AS '4',
+                    (FN5, DT5, AP5, AP6) AS '5'
+                )
+            )
+            WHERE dt IS NOT NULL
+              AND is_valid_flightno(fn)
+            -- first of each flight/day pair, by date then slot
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY row_id, fn, CAST(dt AS DATE)
+                ORDER BY dt, slot
+            ) = 1
+        ),
+        ordered AS (
+            SELECT *,
+                ROW_NUMBER() OVER (PARTITION BY row_id ORDER BY dt, slot) AS pos
+            FROM legs
+        ),
+        route_walk AS (
+            SELECT row_id, pos, dt AS route_start, 1 AS route_id
+            FROM ordered
+            WHERE pos = 1
+
+            UNION ALL
+
+            -- legs are date-ordered, so the gap to the route start is >= 0
+            SELECT
+                o.row_id,
+                o.pos,
+                CASE WHEN same_route THEN w.route_start ELSE o.dt END,
+                w.route_id + CASE WHEN same_route THEN 0 ELSE 1 END
+            FROM route_walk w
+            JOIN ordered o
+              ON o.row_id = w.row_id AND o.pos = w.pos + 1,
+            LATERAL (
+                SELECT epoch_us(o.dt) - epoch_us(w.route_start)
+                       <= {ROUTE_MAX_DAYS * 86_400_000_000} AS same_route
+            )
+        ),
+        sequenced AS (
+            SELECT o.*, w.route_id,
+                ROW_NUMBER() OVER (route ORDER BY o.pos) AS seq,
+                seq = COUNT(*) OVER route AS is_last
+            FROM ordered o
+            JOIN route_walk w USING (row_id, pos)
+            WINDOW route AS (PARTITION BY o.row_id, w.route_id)
+        )
+        -- no DISTINCT: finalize_target_table() keeps one row per key
+        SELECT
+            ANY_VALUE(BookingId),
+            ANY_VALUE(PaxName),
+            ANY_VALUE(JourneyBucket),
+            ANY_VALUE(BookingRef_PNR),
+            ANY_VALUE(Airline),
+            ANY_VALUE(ETicketNo),
+
+            MAX(CASE WHEN seq = 1 THEN fn END),
+            MAX(CASE WHEN seq = 2 THEN fn END),
+            MAX(CASE WHEN seq = 3 THEN fn END),
+            MAX(CASE WHEN seq = 4 THEN fn END),
+            MAX(CASE WHEN seq = 5 THEN fn END),
+
+            MAX(CASE WHEN seq = 1 THEN dt END),
+            MAX(CASE WHEN seq = 2 THEN dt END),
+            MAX(CASE WHEN seq = 3 THEN dt END),
+            MAX(CASE WHEN seq = 4 THEN dt END),
+            MAX(CASE WHEN seq = 5 THEN dt END),
+
+            -- departure of each leg, then the arrival of the last one
+            MAX(CASE WHEN seq = 1 THEN dep_ap END),
+            MAX(CASE WHEN seq = 2 THEN dep_ap WHEN seq = 1 AND is_last THEN arr_ap END),
+            MAX(CASE WHEN seq = 3 THEN dep_ap WHEN seq = 2 AND is_last THEN arr_ap END),
+            MAX(CASE WHEN seq = 4 THEN dep_ap WHEN seq = 3 AND is_last THEN arr_ap END),
+            MAX(CASE WHEN seq = 5 THEN dep_ap WHEN seq = 4 AND is_last THEN arr_ap END),
+            MAX(CASE WHEN seq = 5 AND is_last THEN arr_ap END)
+        FROM sequenced
+        GROUP BY row_id, route_id
+    """).fetchone()
+    # INSERT reports its own row count
+    return result[0] if result else 0
+
+
+def finalize_target_table(con):
+    """Drop composite-key repeats; the first row inserted wins."""
+    # NULL key parts compare equal, as INSERT OR IGNORE did within a batch
+    result = con.execute(f"""
+        DELETE FROM {TARGET_TABLE}
+        WHERE rowid IN (
+            SELECT rowid
+            FROM {TARGET_TABLE}
+            QUALIFY row_number() OVER (
+                PARTITION BY {", ".join(KEY_COLS)}
+                ORDER BY rowid
+            ) > 1
+        )
+    """).fetchone()
+    removed = result[0] if result else 0
+    if removed:
+        log(f"⚠️ {removed:,} rows removed — composite key already in target")
+    return removed
 
 
 def main():
@@ -309,31 +320,43 @@ def main():
     con = connect_db()
     create_target_table(con)
     create_clean_view(con)
+    create_macros(con)
 
-    result = con.execute("SELECT COUNT(*) FROM cleaned_source").fetchone()
+    result = con.execute("SELECT COUNT(*) FROM _cleaned_source").fetchone()
 
     total = result[0] if result else 0
     log(f"📊 Cleaned rows: {total:,}")
 
-    offset = 0
+    # One transaction for all batches: the target is rebuilt from scratch
+    # each run, so per-batch commits only add WAL flushes. An error leaves
+    # it uncommitted, and closing the connection rolls it back
+    con.execute("BEGIN TRANSACTION;")
+
+    row_id = 1
     batch = 0
     processed = 0
 
-    while offset < total:
+    while row_id <= total:
         batch += 1
         batch_start = time.time()
-        log(f"🔄 Batch {batch} | {offset:,} → {min(offset + BATCH_SIZE, total):,}")
+        log(
+            f"🔄 Batch {batch} | rows {row_id:,} → {min(row_id + BATCH_SIZE - 1, total):,}"
+        )
 
-        rows_processed = process_batch(con, offset)
+        rows_processed = process_batch(con, row_id)
         processed += rows_processed
-        offset += BATCH_SIZE
+        row_id += BATCH_SIZE
 
         batch_time = time.time() - batch_start
-        progress = (offset / total) * 100
-        eta = (batch_time * (total - offset) / BATCH_SIZE) / 3600
+        done = min(row_id - 1, total)
+        progress = (done / total) * 100
+        eta = (batch_time * (total - done) / BATCH_SIZE) / 3600
 
         log(f"✅ Processed {rows_processed:,} rows | {progress:.1f}% | ETA: {eta:.2f}h")
 
+    processed -= finalize_target_table(con)
+    con.execute("COMMIT;")
+
     elapsed = time.time() - start
     log(f"📊 Total processed: {processed:,} rows")
     log(f"⏱️ Execution Time: {elapsed / 3600:.2f} hours")
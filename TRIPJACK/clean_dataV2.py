@@ -1,9 +1,9 @@
 import duckdb
+import numpy as np
 import pandas as pd
 import time
 from pathlib import Path
 import re
-from datetime import timedelta
 
 # ==================================================
 # CONFIG
@@ -19,7 +19,9 @@ REJECTION_TABLE = "TRIPJACK_REJECTIONS"
 BATCH_SIZE = 100_000
 MAX_FLTNO_DIGITS = 8
 FLTNO_REGEX = r"^([A-Z]{2,3}|\d[A-Z])0+([1-9][0-9]*)$"
+FLTNO_FORMAT = re.compile(r"[A-Z0-9]{2,3}\d+")
 ROUTE_MAX_DAYS = 1
+US_PER_DAY = 86_400_000_000  # DuckDB TIMESTAMP is microseconds
 
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
@@ -231,12 +233,6 @@ def log_invalid_date_range_rows(con, rejection_rows: list):
         )
 
 
-def is_same_route(d1, d2):
-    if pd.isna(d1) or pd.isna(d2):
-        return False
-    return abs(d2 - d1) <= timedelta(days=ROUTE_MAX_DAYS)
-
-
 def is_valid_flightno(fn, dt):
     if pd.isna(fn) and pd.isna(dt):
         return False, Reason.FN_NULL + "-" + Reason.DT_NULL, f"fn={fn!r}, dt={dt!r}"
@@ -266,36 +262,40 @@ def is_valid_flightno(fn, dt):
         )
 
     fn_upper = fn_str.upper()
-    if not re.fullmatch(r"[A-Z0-9]{2,3}\d+", fn_upper):
+    if not FLTNO_FORMAT.fullmatch(fn_upper):
         return False, Reason.FN_BAD_FORMAT, f"fn={fn_upper!r}"
 
     return True, None, None
 
 
-def deduplicate_flights(flights):
+def deduplicate_flights(flights, days):
+    """days: day number of every DT slot of the row, so no date() per flight."""
     flights.sort(key=lambda x: x[1])
     seen = set()
     out = []
     for fn, dt, dep_ap, arr_ap, slot in flights:
-        k = (fn, dt.date())
+        k = (fn, days[slot - 1])
         if k not in seen:
             seen.add(k)
             out.append((fn, dt, dep_ap, arr_ap, slot))
     return out
 
 
-def group_into_routes(flights):
+def group_into_routes(flights, dt_us):
+    """dt_us: epoch microseconds of every DT slot of the row."""
+    max_span = ROUTE_MAX_DAYS * US_PER_DAY
     routes = []
     current = [flights[0]]
-    route_start = flights[0][1]
+    route_start = dt_us[flights[0][4] - 1]
 
     for f in flights[1:]:
-        if is_same_route(f[1], route_start):
+        d = dt_us[f[4] - 1]
+        if abs(d - route_start) <= max_span:
             current.append(f)
         else:
             routes.append(current)
             current = [f]
-            route_start = f[1]
+            route_start = d
     routes.append(current)
     return routes
 
@@ -517,6 +517,14 @@ def process_batch(con, row_id_start, rejection_rows):
     base_data = df[base_cols].values
     raw_data = df[raw_cols].values
     ap_data = df[ap_cols].values
+    # Slot i departs from AP{i} and arrives at AP{i+1}: two aligned views
+    dep_data, arr_data = ap_data[:, :5], ap_data[:, 1:]
+    # Epoch microseconds and day number per DT slot, for routing and
+    # date-level dedup as plain ints (NaT slots are never used)
+    dt_cols = ["DT1", "DT2", "DT3", "DT4", "DT5"]
+    dt_us = df[dt_cols].to_numpy(dtype="datetime64[us]").view(np.int64)
+    us_data = dt_us.tolist()
+    day_data = (dt_us // US_PER_DAY).tolist()
 
     for idx, row in enumerate(df.itertuples(index=False)):
 
@@ -570,8 +578,8 @@ def process_batch(con, row_id_start, rejection_rows):
                     continue
                 slot_rejections.append((i, reason, detail))
                 continue
-            dep_ap = getattr(row, f"AP{i}")
-            arr_ap = getattr(row, f"AP{i + 1}")
+            dep_ap = dep_data[idx, i - 1]
+            arr_ap = arr_data[idx, i - 1]
             flights.append((fn, dt, dep_ap, arr_ap, i))
 
         if not flights:
@@ -594,8 +602,8 @@ def process_batch(con, row_id_start, rejection_rows):
                 )
             continue
 
-        flights = deduplicate_flights(flights)
-        routes = group_into_routes(flights)
+        flights = deduplicate_flights(flights, day_data[idx])
+        routes = group_into_routes(flights, us_data[idx])
         rej_base = make_rej_base()
 
         for route in routes:
@@ -1,9 +1,13 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import time
 from pathlib import Path
 import re
-from datetime import timedelta
 
 # ==================================================
 # CONFIG
@@ -19,12 +23,16 @@ REJECTION_TABLE = "TRIPJACK_REJECTIONS"
 BATCH_SIZE = 100_000
 MAX_FLTNO_DIGITS = 8
 FLTNO_REGEX = r"^([A-Z]{2,3}|\d[A-Z])0+([1-9][0-9]*)$"
+FLTNO_FORMAT = re.compile(r"[A-Z0-9]{2,3}\d+")
 ROUTE_MAX_DAYS = 1
+US_PER_DAY = 86_400_000_000  # DuckDB TIMESTAMP is microseconds
+STRIP_WS = r"[\s\v\pZ\x1c-\x1f\x85]*"  # what str.strip() removes, as RE2
 
 VALID_YEAR_MIN = 2010
 VALID_YEAR_MAX = 2030
 
 THREADS = 8
+BUILD_WORKERS = 4
 MEMORY_LIMIT = "8GB"
 TEMP_DIR = "/tmp/duckdb_temp"
 
@@ -168,6 +176,19 @@ def create_rejection_table(con):
     """)
 
 
+def create_macros(con):
+    # Same rules as is_valid_flightno(), evaluated by DuckDB per slot.
+    # \p{Nd} is Python's \d; STRIP_WS stands in for str.strip()
+    con.execute(f"""
+        CREATE OR REPLACE TEMP MACRO valid_fltno(fn, dt) AS
+            fn IS NOT NULL
+            AND dt IS NOT NULL
+            AND regexp_full_match(fn, '{STRIP_WS}(?:[A-Z0-9]{{2,3}}\\p{{Nd}}+){STRIP_WS}')
+            AND regexp_full_match(fn, '{STRIP_WS}(?:[A-Z0-9\\p{{Nd}}]{{3,{MAX_FLTNO_DIGITS}}}){STRIP_WS}')
+            AND NOT regexp_full_match(fn, '{STRIP_WS}(?:\\p{{Nd}}+|[A-Z]*0*){STRIP_WS}')
+    """)
+
+
 def create_clean_view(con):
     log("🧹 Materializing cleaned source")
     con.execute("DROP TABLE IF EXISTS _cleaned_source")
@@ -189,6 +210,11 @@ def create_clean_view(con):
             TRY_CAST(DepartureDateLocal3 AS TIMESTAMP) AS DT3,
             TRY_CAST(DepartureDateLocal4 AS TIMESTAMP) AS DT4,
             TRY_CAST(DepartureDateLocal5 AS TIMESTAMP) AS DT5,
+            valid_fltno(FN1, DT1) AS VALID1,
+            valid_fltno(FN2, DT2) AS VALID2,
+            valid_fltno(FN3, DT3) AS VALID3,
+            valid_fltno(FN4, DT4) AS VALID4,
+            valid_fltno(FN5, DT5) AS VALID5,
             CAST(DepartureDateLocal1 AS VARCHAR) AS RAW_FD1,
             CAST(DepartureDateLocal2 AS VARCHAR) AS RAW_FD2,
             CAST(DepartureDateLocal3 AS VARCHAR) AS RAW_FD3,
@@ -243,12 +269,6 @@ def log_invalid_date_range_rows(con, rejection_rows: list):
         )
 
 
-def is_same_route(d1, d2):
-    if pd.isna(d1) or pd.isna(d2):
-        return False
-    return abs(d2 - d1) <= timedelta(days=ROUTE_MAX_DAYS)
-
-
 def is_valid_flightno(fn, dt):
     if pd.isna(fn) and pd.isna(dt):
         return False, Reason.FN_NULL + "-" + Reason.DT_NULL, f"fn={fn!r}, dt={dt!r}"
@@ -278,38 +298,37 @@ def is_valid_flightno(fn, dt):
         )
 
     fn_upper = fn_str.upper()
-    if not re.fullmatch(r"[A-Z0-9]{2,3}\d+", fn_upper):
+    if not FLTNO_FORMAT.fullmatch(fn_upper):
         return False, Reason.FN_BAD_FORMAT, f"fn={fn_upper!r}"
 
     return True, None, None
 
 
-def deduplicate_flights(flights):
-    flights.sort(key=lambda x: x[1])
-    seen = set()
-    out = []
-    for fn, dt, dep_ap, arr_ap, slot in flights:
-        k = (fn, dt.date())
-        if k not in seen:
-            seen.add(k)
-            out.append((fn, dt, dep_ap, arr_ap, slot))
-    return out
-
-
-def group_into_routes(flights):
-    routes = []
-    current = [flights[0]]
-    route_start = flights[0][1]
-
-    for f in flights[1:]:
-        if is_same_route(f[1], route_start):
-            current.append(f)
-        else:
-            routes.append(current)
-            current = [f]
-            route_start = f[1]
-    routes.append(current)
-    return routes
+def duplicate_leg_mask(fn_s, dt_us, valid_s) -> np.ndarray:
+    """Legs repeating an earlier FlightNo + FlightDate (date-level) in the same row."""
+    # Pack (flight-number code, day ordinal) into one int64 per leg
+    fn_codes = pd.factorize(fn_s.ravel())[0].reshape(fn_s.shape).astype(np.int64)
+    day = dt_us // US_PER_DAY
+    key = (fn_codes << 32) | (day & 0xFFFFFFFF)
+
+    dup = np.zeros(valid_s.shape, dtype=bool)
+    for j in range(1, valid_s.shape[1]):
+        for k in range(j):
+            dup[:, j] |= valid_s[:, k] & valid_s[:, j] & (key[:, k] == key[:, j])
+    return dup
+
+
+def route_ids(dt_us, keep) -> np.ndarray:
+    """Route number per sorted leg; a route spans ROUTE_MAX_DAYS from its first leg."""
+    max_span = ROUTE_MAX_DAYS * US_PER_DAY
+    ids = np.zeros(dt_us.shape, dtype=np.int64)
+    route_start = dt_us[:, 0].copy()
+
+    for j in range(1, dt_us.shape[1]):
+        new_route = keep[:, j] & (dt_us[:, j] - route_start > max_span)
+        route_start = np.where(new_route, dt_us[:, j], route_start)
+        ids[:, j] = ids[:, j - 1] + new_route
+    return ids
 
 
 COL_NAMES = [
@@ -336,66 +355,64 @@ COL_NAMES = [
     "Airport5",
     "Airport6",
 ]
+DATE_COLS = {c for c in COL_NAMES if c.startswith("FlightDate")}
+STRIP_COLS = {
+    c for c in COL_NAMES if c.startswith(("FlightNumber", "Airport"))
+} | {"BookingId", "PaxName", "ETicketNo"}
 
 
-def insert_target_table(con, paired_rows, rejection_rows):
+def insert_target_table(con, out_cols, rej_bases, rejection_rows):
     """
-    paired_rows: list of (out_row_data, rej_base) tuples.
+    out_cols: one list per target column; rej_bases[i] belongs to row i.
     Deduplicates within batch, then against DB, logging rejections at each step.
     """
-    if not paired_rows:
+    if not rej_bases:
         return
 
-    out_rows = [p[0] for p in paired_rows]
-    rej_bases = [p[1] for p in paired_rows]  # index-safe: built from same list
-
-    df_out = pd.DataFrame(out_rows, columns=COL_NAMES, dtype="object")
-    df_out.replace("", None, inplace=True)
-
-    for col in [
-        "BookingId",
-        "PaxName",
-        "ETicketNo",
-        "FlightNumber1",
-        "FlightNumber2",
-        "FlightNumber3",
-        "FlightNumber4",
-        "FlightNumber5",
-        "Airport1",
-        "Airport2",
-        "Airport3",
-        "Airport4",
-        "Airport5",
-        "Airport6",
-    ]:
-        df_out[col] = df_out[col].astype("string").str.strip()
-
-    for dc in [
-        "FlightDate1",
-        "FlightDate2",
-        "FlightDate3",
-        "FlightDate4",
-        "FlightDate5",
-    ]:
-        df_out[dc] = pd.to_datetime(df_out[dc], errors="coerce")
+    # Clean plain column lists; the batch goes to DuckDB as Arrow instead
+    # of an object-dtype DataFrame
+    columns = {}
+    for name in COL_NAMES:
+        values = out_cols[name]
+        if name in DATE_COLS:
+            columns[name] = [None if v is pd.NaT else v for v in values]
+        else:
+            # "" → NULL first, then strip (so "  " survives as "")
+            columns[name] = [
+                None if v is None or v != v or v == ""
+                else v.strip() if name in STRIP_COLS else v
+                for v in values
+            ]
 
     # ── Stage 1: batch-level dedup ──────────────────────────────────────────────
-    is_dup = df_out.duplicated(subset=KEY_COLS, keep="first")
-    dup_idxs = df_out.index[is_dup].tolist()
+    seen = set()
+    kept = []
+    for i, key in enumerate(zip(*(columns[c] for c in KEY_COLS))):
+        if key in seen:
+            rejection_rows.append(
+                rej_bases[i] + [Reason.BATCH_DUPLICATE, "Duplicate within batch"]
+            )
+        else:
+            seen.add(key)
+            kept.append(i)
 
-    for i in dup_idxs:
-        rejection_rows.append(
-            rej_bases[i] + [Reason.BATCH_DUPLICATE, "Duplicate within batch"]
-        )
+    if not kept:
+        return
 
-    df_out = df_out[~is_dup].reset_index(drop=True)
-    # Rebuild rej_bases to match the surviving rows (same order, no gaps)
-    rej_bases = [
-        rej_bases[i] for i in range(len(paired_rows)) if i not in set(dup_idxs)
+    # Surviving rows only, renumbered so _rej_idx lines up with rej_bases
+    rej_bases = [rej_bases[i] for i in kept]
+    arrays = [
+        pa.array(
+            [columns[name][i] for i in kept],
+            pa.timestamp("us") if name in DATE_COLS else pa.string(),
+        )
+        for name in COL_NAMES
     ]
-
-    if df_out.empty:
-        return
+    arrays.append(pa.array(range(len(kept)), pa.int32()))
+    con.register(
+        "arrow_staging",
+        pa.Table.from_arrays(arrays, names=COL_NAMES + ["_rej_idx"]),
+    )
 
     # ── Stage 2: DB conflict check via staging table ────────────────────────────
     con.execute("DROP TABLE IF EXISTS _batch_staging")
@@ -428,9 +445,8 @@ def insert_target_table(con, paired_rows, rejection_rows):
         WHERE 1=0
     """)
 
-    df_staging = df_out.copy()
-    df_staging["_rej_idx"] = range(len(df_staging))  # 0..N, lines up with rej_bases
-    con.execute("INSERT INTO _batch_staging SELECT * FROM df_staging")
+    con.execute("INSERT INTO _batch_staging SELECT * FROM arrow_staging")
+    con.unregister("arrow_staging")
 
     # Find staging rows whose composite key already exists in the target
     conflict_idxs = {
@@ -503,17 +519,31 @@ def flush_rejections(con, rejection_rows):
     rejection_rows.clear()
 
 
-def process_batch(con, row_id_start, rejection_rows):
-    df = con.execute(f"""
+def fetch_batch(con, row_id_start):
+    return con.execute(f"""
         SELECT * FROM _cleaned_source
         WHERE _row_id BETWEEN {row_id_start} AND {row_id_start + BATCH_SIZE - 1}
-    """).df()
+    """).to_arrow_table()
+
 
-    if df.empty:
-        return 0
+def column_matrix(tbl, cols) -> np.ndarray:
+    """Stack Arrow columns into a (rows x cols) object matrix; nulls become None."""
+    return np.column_stack(
+        [tbl.column(c).to_numpy(zero_copy_only=False) for c in cols]
+    ).astype(object)
 
-    # Each entry is (out_row_data, rej_base) — kept together, never drift apart
-    paired_rows = []
+
+def build_batch(tbl):
+    """
+    Pivot one _cleaned_source batch into target rows, without touching the DB.
+    Runs in a worker process; returns (out_cols, rej_bases, rejection_rows).
+    """
+    rejection_rows = []
+
+    # Output is built column-wise; row i of every column and rej_bases[i]
+    # come from the same route
+    out_cols = {}
+    rej_bases = []
 
     base_cols = [
         "BookingId",
@@ -535,106 +565,160 @@ def process_batch(con, row_id_start, rejection_rows):
         "RAW_FD4",
         "RAW_FD5",
     ]
+    fn_cols = ["FN1", "FN2", "FN3", "FN4", "FN5"]
+    dt_cols = ["DT1", "DT2", "DT3", "DT4", "DT5"]
     ap_cols = ["AP1", "AP2", "AP3", "AP4", "AP5", "AP6"]
+    valid_cols = ["VALID1", "VALID2", "VALID3", "VALID4", "VALID5"]
+
+    base_data = list(zip(*(tbl.column(c).to_pylist() for c in base_cols)))
+    raw_data = list(zip(*(tbl.column(c).to_pylist() for c in raw_cols)))
+    # Whole columns up front: the slot loop indexes arrays, no getattr per cell
+    fn_data = column_matrix(tbl, fn_cols)
+    dt_data = column_matrix(tbl, dt_cols)  # datetimes / None
+    ap_data = column_matrix(tbl, ap_cols)
+    valid_data = np.column_stack(  # from valid_fltno()
+        [tbl.column(c).to_numpy() for c in valid_cols]
+    )
 
-    base_data = df[base_cols].values
-    raw_data = df[raw_cols].values
-    ap_data = df[ap_cols].values
-
-    for idx, row in enumerate(df.itertuples(index=False)):
-
-        def make_rej_base(idx=idx):
-            bd, pax, jb, ref, al, etn = base_data[idx]
-            fn1, fn2, fn3, fn4, fn5, fd1, fd2, fd3, fd4, fd5 = raw_data[idx]
-            ap1, ap2, ap3, ap4, ap5, ap6 = ap_data[idx]
-            return [
-                str(bd) if bd is not None else None,
-                str(pax) if pax is not None else None,
-                str(jb) if jb is not None else None,
-                str(ref) if ref is not None else None,
-                str(al) if al is not None else None,
-                str(etn) if etn is not None else None,
-                str(fn1) if fn1 is not None else None,
-                str(fn2) if fn2 is not None else None,
-                str(fn3) if fn3 is not None else None,
-                str(fn4) if fn4 is not None else None,
-                str(fn5) if fn5 is not None else None,
-                str(fd1) if fd1 is not None else None,
-                str(fd2) if fd2 is not None else None,
-                str(fd3) if fd3 is not None else None,
-                str(fd4) if fd4 is not None else None,
-                str(fd5) if fd5 is not None else None,
-                str(ap1) if ap1 is not None else None,
-                str(ap2) if ap2 is not None else None,
-                str(ap3) if ap3 is not None else None,
-                str(ap4) if ap4 is not None else None,
-                str(ap5) if ap5 is not None else None,
-                str(ap6) if ap6 is not None else None,
-            ]
-
-        flights = []
+    def make_rej_base(idx):
+        bd, pax, jb, ref, al, etn = base_data[idx]
+        fn1, fn2, fn3, fn4, fn5, fd1, fd2, fd3, fd4, fd5 = raw_data[idx]
+        ap1, ap2, ap3, ap4, ap5, ap6 = ap_data[idx]
+        return [
+            str(bd) if bd is not None else None,
+            str(pax) if pax is not None else None,
+            str(jb) if jb is not None else None,
+            str(ref) if ref is not None else None,
+            str(al) if al is not None else None,
+            str(etn) if etn is not None else None,
+            str(fn1) if fn1 is not None else None,
+            str(fn2) if fn2 is not None else None,
+            str(fn3) if fn3 is not None else None,
+            str(fn4) if fn4 is not None else None,
+            str(fn5) if fn5 is not None else None,
+            str(fd1) if fd1 is not None else None,
+            str(fd2) if fd2 is not None else None,
+            str(fd3) if fd3 is not None else None,
+            str(fd4) if fd4 is not None else None,
+            str(fd5) if fd5 is not None else None,
+            str(ap1) if ap1 is not None else None,
+            str(ap2) if ap2 is not None else None,
+            str(ap3) if ap3 is not None else None,
+            str(ap4) if ap4 is not None else None,
+            str(ap5) if ap5 is not None else None,
+            str(ap6) if ap6 is not None else None,
+        ]
+
+    # Rows without a valid slot are rejected; only these need the per-slot
+    # reasons from is_valid_flightno()
+    for idx in np.flatnonzero(~valid_data.any(axis=1)):
         slot_rejections = []
 
         for i in range(1, 6):
-            fn = getattr(row, f"FN{i}")
-            dt = getattr(row, f"DT{i}")
-            valid, reason, detail = is_valid_flightno(fn, dt)
-            if not valid:
-                if (
-                    reason
-                    in (
-                        Reason.FN_NULL,
-                        Reason.DT_NULL,
-                        Reason.FN_EMPTY,
-                        Reason.DT_EMPTY,
-                    )
-                    and i > 1
-                ):
-                    continue
-                slot_rejections.append((i, reason, detail))
-                continue
-            dep_ap = getattr(row, f"AP{i}")
-            arr_ap = getattr(row, f"AP{i + 1}")
-            flights.append((fn, dt, dep_ap, arr_ap, i))
-
-        if not flights:
-            rej_base = make_rej_base()
-            if slot_rejections:
-                primary = next(
-                    (r for r in slot_rejections if r[0] == 1), slot_rejections[0]
+            _, reason, detail = is_valid_flightno(
+                fn_data[idx, i - 1], dt_data[idx, i - 1]
+            )
+            if (
+                reason
+                in (
+                    Reason.FN_NULL,
+                    Reason.DT_NULL,
+                    Reason.FN_EMPTY,
+                    Reason.DT_EMPTY,
                 )
-                rejection_rows.append(
-                    rej_base
-                    + [
-                        primary[1],
-                        f"No valid segments. Slots: {', '.join(f'FltNo{r[0]}({r[1]})' for r in slot_rejections)}",
-                    ]
-                )
-            else:
-                rejection_rows.append(
-                    rej_base
-                    + [Reason.NO_VALID_SEGMENTS, "All flight slots null or invalid"]
-                )
-            continue
-
-        flights = deduplicate_flights(flights)
-        routes = group_into_routes(flights)
-        rej_base = make_rej_base()
-
-        for route in routes:
-            row_out = list(base_data[idx])
-            fn_out, dt_out, ap_out = [None] * 5, [None] * 5, [None] * 6
-            for i, (fn, dt, dep_ap, arr_ap, slot) in enumerate(route[:5]):
-                fn_out[i] = fn
-                dt_out[i] = dt
-                ap_out[i] = dep_ap
-                ap_out[i + 1] = arr_ap
+                and i > 1
+            ):
+                continue
+            slot_rejections.append((i, reason, detail))
+
+        rej_base = make_rej_base(idx)
+        if slot_rejections:
+            primary = next(
+                (r for r in slot_rejections if r[0] == 1), slot_rejections[0]
+            )
+            rejection_rows.append(
+                rej_base
+                + [
+                    primary[1],
+                    f"No valid segments. Slots: {', '.join(f'FltNo{r[0]}({r[1]})' for r in slot_rejections)}",
+                ]
+            )
+        else:
+            rejection_rows.append(
+                rej_base
+                + [Reason.NO_VALID_SEGMENTS, "All flight slots null or invalid"]
+            )
+
+    # Sort each row's legs by date (stable: slot order on ties), invalid legs last
+    dt_us = np.column_stack(
+        [tbl.column(c).to_numpy(zero_copy_only=False) for c in dt_cols]
+    ).view(np.int64)
+    sort_key = np.where(valid_data, dt_us, np.iinfo(np.int64).max)
+    order = np.argsort(sort_key, axis=1, kind="stable")
+    fn_s = np.take_along_axis(fn_data, order, axis=1)
+    dt_s = np.take_along_axis(dt_data, order, axis=1)
+    dt_us_s = np.take_along_axis(dt_us, order, axis=1)
+    dep_s = np.take_along_axis(ap_data[:, :5], order, axis=1)
+    arr_s = np.take_along_axis(ap_data[:, 1:], order, axis=1)
+    valid_s = np.take_along_axis(valid_data, order, axis=1)
+
+    # Dedup and route split for the whole batch at once
+    keep = valid_s & ~duplicate_leg_mask(fn_s, dt_us_s, valid_s)
+    route_s = route_ids(dt_us_s, keep)
+
+    # One target row per route, packed for the whole batch at once. Kept legs
+    # in row-major order are grouped by route, legs in date order
+    rows, legs = np.nonzero(keep)
+    leg_route = route_s[rows, legs]
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (rows[1:] != rows[:-1]) | (leg_route[1:] != leg_route[:-1])
+    out_idx = np.cumsum(starts) - 1  # output row of each leg
+    pos = np.arange(len(rows)) - np.flatnonzero(starts)[out_idx]  # slot in route
+    out_src = rows[starts]  # source row of each output row
+    n_out = len(out_src)
+
+    fn_out = np.full((n_out, 5), None, dtype=object)
+    dt_out = np.full((n_out, 5), None, dtype=object)
+    ap_out = np.full((n_out, 6), None, dtype=object)
+    fn_out[out_idx, pos] = fn_s[rows, legs]
+    dt_out[out_idx, pos] = dt_s[rows, legs]
+    # Arrivals first, so each departure overwrites the previous leg's arrival
+    ap_out[out_idx, pos + 1] = arr_s[rows, legs]
+    ap_out[out_idx, pos] = dep_s[rows, legs]
+
+    src = out_src.tolist()
+    for k, c in enumerate(base_cols):
+        out_cols[c] = [base_data[i][k] for i in src]
+    for k in range(5):
+        out_cols[f"FlightNumber{k + 1}"] = fn_out[:, k].tolist()
+        out_cols[f"FlightDate{k + 1}"] = dt_out[:, k].tolist()
+    for k in range(6):
+        out_cols[f"Airport{k + 1}"] = ap_out[:, k].tolist()
+
+    # Routes of one row share its rej_base
+    row_rej = {i: make_rej_base(i) for i in set(src)}
+    rej_bases.extend(row_rej[i] for i in src)
+
+    return out_cols, rej_bases, rejection_rows
+
+
+def finish_batch(con, total, batch, row_id, batch_start, future) -> int:
+    out_cols, rej_bases, rejection_rows = future.result()
+
+    insert_target_table(con, out_cols, rej_bases, rejection_rows)
+    if rejection_rows:
+        flush_rejections(con, rejection_rows)
 
-            # ✅ Store data and its rej_base together — index alignment is guaranteed
-            paired_rows.append((row_out + fn_out + dt_out + ap_out, rej_base))
+    row_id += BATCH_SIZE
+    batch_time = time.time() - batch_start
+    progress = (min(row_id, total) / total) * 100
+    eta = (batch_time * max(total - row_id, 0) / BATCH_SIZE) / 3600
 
-    insert_target_table(con, paired_rows, rejection_rows)
-    return len(paired_rows)
+    rows_processed = len(rej_bases)
+    log(
+        f"✅ Batch {batch} | {rows_processed:,} rows | {progress:.1f}% | ETA {eta:.2f}h"
+    )
+    return rows_processed
 
 
 def main():
@@ -644,6 +728,7 @@ def main():
     con = connect_db()
     create_target_table(con)
     create_rejection_table(con)
+    create_macros(con)
     create_clean_view(con)
 
     rejection_rows = []
@@ -656,28 +741,23 @@ def main():
     total = con.execute("SELECT COUNT(*) FROM _cleaned_source").fetchone()[0]
     log(f"📊 Cleaned rows: {total:,}")
 
-    row_id = 1
-    batch = 0
+    # The per-row work is pure Python, so batches are built in worker
+    # processes; inserts stay on this connection in batch order
+    with ProcessPoolExecutor(max_workers=BUILD_WORKERS) as pool:
+        pending = deque()
 
-    while row_id <= total:
-        batch += 1
-        batch_start = time.time()
-        log(
-            f"🔄 Batch {batch} | rows {row_id:,} → {min(row_id + BATCH_SIZE - 1, total):,}"
-        )
+        for batch, row_id in enumerate(range(1, total + 1, BATCH_SIZE), start=1):
+            log(
+                f"🔄 Batch {batch} | rows {row_id:,} → {min(row_id + BATCH_SIZE - 1, total):,}"
+            )
+            future = pool.submit(build_batch, fetch_batch(con, row_id))
+            pending.append((batch, row_id, time.time(), future))
 
-        batch_rejections = []
-        rows_processed = process_batch(con, row_id, batch_rejections)
-        if batch_rejections:
-            flush_rejections(con, batch_rejections)
-        row_id += BATCH_SIZE
-
-        batch_time = time.time() - batch_start
-        progress = (min(row_id, total) / total) * 100
-        eta = (batch_time * max(total - row_id, 0) / BATCH_SIZE) / 3600
-        log(
-            f"✅ Batch {batch} | {rows_processed:,} rows | {progress:.1f}% | ETA {eta:.2f}h"
-        )
+            if len(pending) > BUILD_WORKERS:
+                finish_batch(con, total, *pending.popleft())
+
+        while pending:
+            finish_batch(con, total, *pending.popleft())
 
     # Final reconciliation
     src = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
@@ -10,6 +10,7 @@ DB_PATH = DATABASE_DIR / DATABASE_NAME
 
 
 def separate_and_inserts(con: duckdb.DuckDBPyConnection) -> None:
+    # Reads the rows delete_full_rows() returned, not TRIPJACK_TARGET again
     insert_sql = """
         INSERT INTO TRIPJACK_TARGET (
             BookingId,
@@ -49,10 +50,7 @@ def separate_and_inserts(con: duckdb.DuckDBPyConnection) -> None:
             Airport1,
             Airport2,
             NULL, NULL, NULL, NULL
-        FROM TRIPJACK_TARGET
-        WHERE Airport1 = Airport3
-          AND Airport4 IS NULL
-          AND Airport5 IS NULL          
+        FROM removed_rows
 
         UNION ALL
 
@@ -70,10 +68,7 @@ def separate_and_inserts(con: duckdb.DuckDBPyConnection) -> None:
             Airport2,
             Airport3,
             NULL, NULL, NULL, NULL
-        FROM TRIPJACK_TARGET
-        WHERE Airport1 = Airport3
-          AND Airport4 IS NULL
-          AND Airport5 IS NULL          
+        FROM removed_rows
         """
     return insert_sql
 
@@ -83,7 +78,8 @@ def delete_full_rows(con: duckdb.DuckDBPyConnection) -> None:
         DELETE FROM TRIPJACK_TARGET
         WHERE Airport1 = Airport3
           AND Airport4 IS NULL
-          AND Airport5 IS NULL;             
+          AND Airport5 IS NULL
+        RETURNING *
         """
     return delete_sql
 
@@ -97,8 +93,11 @@ def process_airports():
     try:
         con.execute("BEGIN TRANSACTION;")
 
+        # One pass over the target: the DELETE hands back the FULL rows
+        removed = con.execute(delete_full_rows(con)).to_arrow_table()
+        con.register("removed_rows", removed)
         con.execute(separate_and_inserts(con))
-        con.execute(delete_full_rows(con))
+        con.unregister("removed_rows")
 
         con.execute("COMMIT;")
         print("✅ Split completed and original FULL rows removed")
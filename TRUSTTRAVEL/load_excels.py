@@ -2,7 +2,9 @@ import time
 from pathlib import Path
 
 import duckdb
+import fastexcel
 import pandas as pd
+import pyarrow as pa
 
 
 # ==================================================
@@ -35,8 +37,36 @@ def connect_db() -> duckdb.DuckDBPyConnection:
     return con
 
 
+def append_sheet(con, table: pa.Table, create: bool) -> None:
+    con.register("sheet_arrow", table)
+
+    if create:
+        con.execute(f"""
+            CREATE TABLE {TABLE_NAME} AS
+            SELECT * FROM sheet_arrow
+        """)
+    else:
+        # Columns first seen in this sheet are added; rows of earlier
+        # sheets read NULL there, as pd.concat used to fill them
+        existing = {
+            row[0].lower() for row in con.execute(f"DESCRIBE {TABLE_NAME}").fetchall()
+        }
+        for name, col_type, *_ in con.execute(
+            "DESCRIBE SELECT * FROM sheet_arrow"
+        ).fetchall():
+            if name.lower() not in existing:
+                con.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN "{name}" {col_type}')
+
+        con.execute(f"""
+            INSERT INTO {TABLE_NAME} BY NAME
+            SELECT * FROM sheet_arrow
+        """)
+
+    con.unregister("sheet_arrow")
+
+
 def load_excel_files(con) -> None:
-    dfs = []
+    created = False
 
     DATE_COLUMNS = [
         "BillDate",
@@ -46,33 +76,37 @@ def load_excel_files(con) -> None:
         "FltDate4",
     ]
 
+    con.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+
     for file in sorted(EXCEL_DIR.glob("*.xlsx")):
         log(f"⏰ Loading {file.name}")
 
         if file.name != "TRUST_TRAVEL_RAW_DATA.xlsx":
             continue
 
-        sheets = pd.read_excel(file, sheet_name=None, dtype=str)
+        # fastexcel parses the workbook in Rust straight into Arrow columns;
+        # dtypes="string" keeps every cell as text, like dtype=str did
+        reader = fastexcel.read_excel(file)
 
-        for sheet_name, df in sheets.items():
-            if df.empty:
+        for sheet_name in reader.sheet_names:
+            sheet = reader.load_sheet(sheet_name, dtypes="string")
+            if sheet.height == 0 or sheet.width == 0:
                 continue
 
-            for col in DATE_COLUMNS:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors="coerce")
-
-            dfs.append(df)
-
-    final_df = pd.concat(dfs, ignore_index=True)
+            table = pa.Table.from_batches([sheet.to_arrow()])
 
-    con.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
-    con.register("final_df", final_df)
-
-    con.execute(f"""
-        CREATE TABLE {TABLE_NAME} AS
-        SELECT * FROM final_df
-    """)
+            for col in DATE_COLUMNS:
+                if col in table.column_names:
+                    dates = pd.to_datetime(table[col].to_pandas(), errors="coerce")
+                    table = table.set_column(
+                        table.column_names.index(col),
+                        col,
+                        pa.array(dates, from_pandas=True),
+                    )
+
+            # One sheet in memory at a time, written as soon as it is read
+            append_sheet(con, table, create=not created)
+            created = True
 
 
 def main() -> None:
@@ -0,0 +1,101 @@
+import duckdb
+
+# Padded, Unicode-digit and edge-case flight numbers; the SQL macro and the
+# Python re-check must agree on every one of them
+FLIGHT_NUMBERS = [
+    "TK123",
+    "TK123\t",
+    " TK123 ",
+    "TK1234\t\t\t",
+    "QR١٢٣",
+    "QR١٢٣\u3000",
+    "TK000",
+    "TK000\t",
+    "١٢٣٤",
+    "12345",
+    "TK²3",
+    "G8",
+    "ABCD123",
+    "TK123456789",
+]
+
+SOURCE_COLS = [
+    "PaxName",
+    "PNRNo",
+    "AirlineName",
+    "TicketNo",
+    "FltNo1",
+    "FltNo2",
+    "FltNo3",
+    "FltNo4",
+    "FltDate1",
+    "FltDate2",
+    "FltDate3",
+    "FltDate4",
+    "SupplierName",
+    "PaxType",
+    "Airport1",
+    "Airport2",
+    "Airport3",
+    "Airport4",
+    "Airport5",
+]
+
+
+def test_valid_fltno_matches_is_valid_flightno(load_script):
+    v2 = load_script("BLUESTAR/clean_dataV2.py")
+    con = duckdb.connect()
+    v2.create_macros(con)
+
+    for fn in FLIGHT_NUMBERS:
+        sql_valid = con.execute(
+            "SELECT valid_fltno(?, TIMESTAMP '2020-01-01')", [fn]
+        ).fetchone()[0]
+        assert sql_valid == v2.is_valid_flightno(fn, "2020-01-01")[0], repr(fn)
+
+
+def test_main_routes_padded_and_unicode_digit_flights(load_script, tmp_path):
+    v2 = load_script("BLUESTAR/clean_dataV2.py")
+    v2.DB_PATH = tmp_path / "bluestar.duckdb"
+    v2.TEMP_DIR = str(tmp_path)
+    v2.THREADS = 1
+
+    con = duckdb.connect(v2.DB_PATH)
+    con.execute(f"""
+        CREATE TABLE {v2.SOURCE_TABLE} (
+            BillDate TIMESTAMP,
+            {", ".join(f"{c} VARCHAR" for c in SOURCE_COLS)}
+        )
+    """)
+    for i, fn in enumerate(FLIGHT_NUMBERS):
+        con.execute(
+            f"INSERT INTO {v2.SOURCE_TABLE} VALUES ({', '.join('?' * 20)})",
+            ["2020-01-01", "PAX", f"PNR{i}", "TK", f"T{i}", fn, None, None, None]
+            + ["2020-03-01 10:00", None, None, None, "SUP", "ADT"]
+            + ["IST", "LHR", None, None, None],
+        )
+    con.close()
+
+    v2.main()
+
+    con = duckdb.connect(v2.DB_PATH)
+    routed = {
+        r[0]
+        for r in con.execute(f"SELECT PNRNo FROM {v2.TARGET_TABLE}").fetchall()
+    }
+    rejections = con.execute(
+        f"SELECT PNRNo, RejectionReason FROM {v2.REJECTION_TABLE}"
+    ).fetchall()
+    con.close()
+
+    expected = {
+        f"PNR{i}"
+        for i, fn in enumerate(FLIGHT_NUMBERS)
+        if v2.is_valid_flightno(fn, "2020-03-01 10:00")[0]
+    }
+    assert {"PNR1", "PNR3", "PNR4", "PNR5"} <= expected
+    assert routed == expected
+    assert {pnr for pnr, _ in rejections} == {
+        f"PNR{i}" for i in range(len(FLIGHT_NUMBERS))
+    } - expected
+    assert all(reason is not None for _, reason in rejections)
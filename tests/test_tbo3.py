@@ -0,0 +1,68 @@
+import datetime as dt
+import random
+
+import duckdb
+
+SOURCE_COLS = (
+    ["PaxName", "BookingRef", "ETicketNo", "ClientCode", "Airline", "JourneyType"]
+    + [f"FlightNumber{i}" for i in range(1, 8)]
+    + [f"DepartureDateLocal{i}" for i in range(1, 8)]
+    + [f"Airport{i}" for i in range(1, 9)]
+)
+
+
+def test_duplicate_keys_sequence_every_leg_once(load_script, tmp_path, monkeypatch):
+    db_path = tmp_path / "tbo3.duckdb"
+    con = duckdb.connect(db_path)
+    con.execute(
+        f"CREATE TABLE TBO3_MASTER ({', '.join(f'{c} VARCHAR' for c in SOURCE_COLS)})"
+    )
+
+    # Many source rows per BookingRef/PaxName: their legs tie on OriginalSeq.
+    # Departures fall on a 5h grid, so legs share trips and some collide
+    rnd = random.Random(0)
+    start = dt.datetime(2023, 1, 1)
+    rows = []
+    for key in range(5):
+        for r, hours in enumerate(rnd.sample(range(0, 4000, 5), 40)):
+            first = start + dt.timedelta(hours=hours)
+            second = first + dt.timedelta(hours=20)
+            rows.append(
+                ["PAX", f"B{key}", None, "CC", "TK", "OW"]
+                + [f"TK{key * 1000 + 2 * r + 1}", f"TK{key * 1000 + 2 * r + 2}"]
+                + [None] * 5
+                + [first.strftime("%Y-%m-%d %H:%M:%S")]
+                + [second.strftime("%Y-%m-%d %H:%M:%S")]
+                + [None] * 5
+                + ["IST", "LHR", "JFK"] + [None] * 5
+            )
+    con.executemany(
+        f"INSERT INTO TBO3_MASTER VALUES ({', '.join('?' * len(SOURCE_COLS))})", rows
+    )
+    con.close()
+
+    real_connect = duckdb.connect
+    monkeypatch.setattr(duckdb, "connect", lambda _path: real_connect(db_path))
+    load_script("TBO/tbo3.py")
+
+    con = real_connect(db_path)
+    trips = con.execute(f"""
+        SELECT [{", ".join(f"FlightNumber{i}" for i in range(1, 8))}]
+        FROM TBO3_MASTER_TARGET
+    """).fetchall()
+    con.close()
+
+    legs = []
+    for (fns,) in trips:
+        flown = [fn for fn in fns if fn is not None]
+        # dense seq_ids: no slot gaps inside a trip
+        assert fns[: len(flown)] == flown
+        legs += flown
+
+    # A second leg departing with another row's first leg is deduped (the
+    # lower OriginalSeq wins); every other leg lands in exactly one trip
+    firsts = {(row[1], row[13]) for row in rows}
+    expected = [row[6] for row in rows] + [
+        row[7] for row in rows if (row[1], row[14]) not in firsts
+    ]
+    assert sorted(legs) == sorted(expected)
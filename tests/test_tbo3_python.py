@@ -0,0 +1,45 @@
+import duckdb
+
+SOURCE_COLS = (
+    ["PaxName", "BookingRef", "ETicketNo", "ClientCode", "Airline", "JourneyType"]
+    + [f"FlightNumber{i}" for i in range(1, 8)]
+    + [f"DepartureDateLocal{i}" for i in range(1, 8)]
+    + [f"Airport{i}" for i in range(1, 9)]
+)
+
+
+def test_booking_with_fewer_than_seven_legs(load_script):
+    tp = load_script("TBO/tbo3_python.py")
+    con = duckdb.connect()
+    con.execute(
+        f"CREATE TABLE {tp.SOURCE_TABLE} "
+        f"({', '.join(f'{c} VARCHAR' for c in SOURCE_COLS)})"
+    )
+    # Slots past the last leg are NULL, as in the real source; the 7-leg
+    # booking keeps every FN column a string column
+    days = [f"2023-01-0{d} 10:00:00" for d in range(1, 8)]
+    con.executemany(
+        f"INSERT INTO {tp.SOURCE_TABLE} VALUES ({', '.join('?' * len(SOURCE_COLS))})",
+        [
+            ["PAX", "B1", "E1", "CC", "TK", "OW"]
+            + ["TK001", "TK2"] + [None] * 5
+            + ["2023-01-01 10:00:00", "2023-01-01 18:00:00"] + [None] * 5
+            + ["IST", "DOH", "LHR"] + [None] * 5,
+            ["PAX", "B2", "E2", "CC", "TK", "OW"]
+            + [f"TK{i}" for i in range(11, 18)]
+            + days
+            + ["IST", "DOH"] * 4,
+        ],
+    )
+
+    tp.create_target_table(con)
+    tp.create_clean_table(con)
+    # B2's legs are a day apart, so they chain into one route
+    assert tp.process_batch(con, 0) == 2
+
+    assert con.execute(f"""
+        SELECT FlightNumber1, FlightNumber2, FlightNumber3,
+               Airport1, Airport2, Airport3, Airport4
+        FROM {tp.TARGET_TABLE}
+        WHERE BookingRef = 'B1'
+    """).fetchall() == [("TK1", "TK2", None, "IST", "DOH", "LHR", None)]